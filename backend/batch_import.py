@@ -0,0 +1,297 @@
+"""Import many statement files (or ZIP archives of them) in one pass.
+
+Files are decoded and parsed in a process pool, then their transactions are
+merged per bank account and written in a single deduplicated phase.
+"""
+
+import hashlib
+import io
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+from . import config, models
+from .csv_utils import (
+    collect_events,
+    detect_stream_structure,
+    iter_parse_csv,
+    sniff_encoding,
+)
+from .importer import (
+    account_payload,
+    find_imported_file,
+    find_or_create_account,
+    hash_upload,
+    import_events,
+    record_imported_file,
+)
+from .parallel_csv import parse_csv_parallel
+from .statements import FORMAT_SAMPLE_SIZE, detect_format, iter_parse_statement, sniff_format
+from .xlsx_import import is_xlsx
+
+
+def expand_uploads(files):
+    """Return ``(filename, bytes)`` pairs, unpacking ZIP archives.
+
+    ``files`` is an iterable of ``(filename, bytes)`` pairs. Directories and
+    macOS metadata entries of archives are skipped. XLSX workbooks, which
+    are ZIP files too, are kept whole.
+    """
+    result = []
+    for name, data in files:
+        if zipfile.is_zipfile(io.BytesIO(data)):
+            with zipfile.ZipFile(io.BytesIO(data)) as archive:
+                if is_xlsx(archive):
+                    result.append((name, data))
+                    continue
+                for info in archive.infolist():
+                    if info.is_dir() or info.filename.startswith('__MACOSX/'):
+                        continue
+                    result.append((f'{name}/{info.filename}', archive.read(info)))
+        else:
+            result.append((name, data))
+    return result
+
+
+def parse_file(name, data, mapping=None):
+    """Decode and parse one file; run in worker processes.
+
+    ``data`` is the content of the file or the path of a file on disk. Files
+    on disk are read through a memory map instead of being loaded whole.
+    """
+    if isinstance(data, bytes):
+        return _parse_stream(name, io.BytesIO(data), mapping)
+    with open(data, 'rb') as fh:
+        return _parse_stream(name, fh, mapping)
+
+
+def _parse_stream(name, stream, mapping):
+    fmt, stream = sniff_format(stream)
+    try:
+        if fmt != 'csv':
+            parsed = collect_events(iter_parse_statement(stream, mapping=mapping, fmt=fmt))
+            delimiter, columns = None, []
+        else:
+            encoding, stream = sniff_encoding(stream)
+            (delimiter, _, _, columns), _ = detect_stream_structure(stream, encoding)
+            parsed = collect_events(iter_parse_csv(stream, mapping=mapping, encoding=encoding))
+    except ValueError as e:
+        # Includes UnicodeDecodeError
+        return {'filename': name, 'error': str(e)}
+    transactions, duplicates, errors, account_info = parsed
+    return {
+        'filename': name,
+        'delimiter': delimiter,
+        'columns': columns,
+        'transactions': transactions,
+        'duplicates': duplicates,
+        'errors': errors,
+        'account_info': account_info,
+    }
+
+
+def parse_files(files, mapping=None, workers=None):
+    """Parse ``(filename, data)`` pairs, in parallel when there are several.
+
+    ``data`` is accepted by :func:`parse_file`.
+    """
+    workers = workers or config.IMPORT_PROCESSES or os.cpu_count() or 1
+    workers = min(workers, len(files))
+    if workers <= 1:
+        return [parse_file(name, data, mapping) for name, data in files]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(parse_file, name, data, mapping) for name, data in files]
+        return [f.result() for f in futures]
+
+
+def _new_report(session, reports, name, sha256, force):
+    """Append the report of a file to ``reports``.
+
+    Return it, or ``None`` when the file was already imported and is
+    skipped.
+    """
+    report = {
+        'filename': name,
+        'transactions': 0,
+        'imported': 0,
+        'duplicates': [],
+        'errors': [],
+    }
+    reports.append(report)
+    record = None if force else find_imported_file(session, sha256)
+    if record:
+        report['account'] = account_payload(record.account)
+        report['already_imported'] = True
+        return None
+    return report
+
+
+def import_batch(session, files, mapping=None, workers=None, force=False):
+    """Import ``(filename, bytes)`` pairs and return a per-file report.
+
+    Files identical to an earlier complete import are skipped unless
+    ``force`` is set.
+    """
+    reports = []
+    pending = []
+    contents = []
+    for name, data in expand_uploads(files):
+        sha256 = hashlib.sha256(data).hexdigest()
+        report = _new_report(session, reports, name, sha256, force)
+        if report:
+            pending.append((report, sha256))
+            contents.append((name, data))
+    parsed = parse_files(contents, mapping=mapping, workers=workers)
+    return _import_parsed(session, reports, pending, parsed)
+
+
+def _import_parsed(session, reports, pending, parsed):
+    """Write parsed files, grouped per account, and complete their reports.
+
+    ``pending`` holds the ``(report, sha256)`` pairs of the files whose
+    :func:`parse_file` results are ``parsed``.
+    """
+    groups = {}
+    for (report, sha256), result in zip(pending, parsed):
+        if 'error' in result:
+            report['errors'].append(result['error'])
+            continue
+        info = result['account_info']
+        report['transactions'] = len(result['transactions'])
+        report['delimiter'] = result['delimiter']
+        report['columns'] = result['columns']
+        report['duplicates'].extend(result['duplicates'])
+        report['errors'].extend(result['errors'])
+        if not info:
+            continue
+        key = (info.get('account_type'), info.get('number'))
+        groups.setdefault(key, []).append((report, result, sha256))
+
+    accounts = []
+    for group in groups.values():
+        # The most recent export describes the account
+        info = max(
+            (result['account_info'] for _, result, _ in group),
+            key=lambda i: (i.get('export_date') is not None, i.get('export_date') or 0),
+        )
+        account = find_or_create_account(session, info)
+
+        seen = set()
+        origin = {}
+        events = []
+        for report, result, _ in group:
+            for t in result['transactions']:
+                key = (t['date'], t['label'], t['amount'])
+                if key in seen:
+                    # Already present in another file of the batch
+                    report['duplicates'].append(t)
+                    continue
+                seen.add(key)
+                origin[(t['date'].isoformat(), t['label'], t['amount'])] = report
+                events.append(('transaction', t))
+
+        imported, duplicates, errors = import_events(session, iter(events), account, bulk=True)
+        stored = dict(origin)
+        for d in duplicates:
+            report = stored.pop((d['date'], d['label'], d['amount']))
+            report['duplicates'].append(d)
+        payload = account_payload(account)
+        for report, _, _ in group:
+            report['account'] = payload
+            report['errors'].extend(errors)
+        if not errors:
+            for report in stored.values():
+                report['imported'] += 1
+            for report, _, sha256 in group:
+                if not report['errors']:
+                    record_imported_file(
+                        session, sha256, account, report['filename'], report['transactions']
+                    )
+        accounts.append({
+            'account': payload,
+            'files': len(group),
+            'transactions': len(events),
+            'imported': imported,
+            'duplicates': len(duplicates),
+        })
+
+    for report in reports:
+        report['duplicates'] = [
+            {
+                **d,
+                'date': d['date'].isoformat() if hasattr(d['date'], 'isoformat') else d['date'],
+            }
+            for d in report['duplicates']
+        ]
+    return {
+        'imported': sum(a['imported'] for a in accounts),
+        'accounts': accounts,
+        'files': reports,
+    }
+
+
+def parse_path(path, name, mapping=None, workers=None):
+    """Parse a large CSV file from disk in chunks, see :func:`parse_csv_parallel`."""
+    try:
+        transactions, duplicates, errors, account_info = parse_csv_parallel(
+            path, mapping=mapping, workers=workers
+        )
+    except UnicodeDecodeError as e:
+        return {'filename': name, 'error': str(e)}
+    with open(path, 'rb') as fh:
+        encoding, stream = sniff_encoding(fh)
+        (delimiter, _, _, columns), _ = detect_stream_structure(stream, encoding)
+    return {
+        'filename': name,
+        'delimiter': delimiter,
+        'columns': columns,
+        'transactions': transactions,
+        'duplicates': duplicates,
+        'errors': errors,
+        'account_info': account_info,
+    }
+
+
+def import_paths(paths, mapping=None, workers=None, force=False, parallel=False):
+    """Import files from disk; used by the command line interface.
+
+    CSV files are parsed from disk without being loaded. With ``parallel``
+    each CSV file is split in chunks parsed by ``workers`` processes instead
+    of parsing whole files in parallel; archives and other formats are read
+    and parsed as usual.
+    """
+    session = models.SessionLocal()
+    try:
+        reports = []
+        pending = []
+        contents = []
+        for path in paths:
+            name = os.path.basename(path)
+            with open(path, 'rb') as fh:
+                if detect_format(fh.read(FORMAT_SAMPLE_SIZE)) == 'csv':
+                    fh.seek(0)
+                    sha256, _ = hash_upload(fh)
+                    files = [(name, path, sha256)]
+                else:
+                    fh.seek(0)
+                    files = [
+                        (member, content, hashlib.sha256(content).hexdigest())
+                        for member, content in expand_uploads([(name, fh.read())])
+                    ]
+            for member, data, sha256 in files:
+                report = _new_report(session, reports, member, sha256, force)
+                if report:
+                    pending.append((report, sha256))
+                    contents.append((member, data))
+
+        if not parallel:
+            parsed = parse_files(contents, mapping=mapping, workers=workers)
+        else:
+            parsed = [
+                parse_path(data, name, mapping=mapping, workers=workers)
+                if not isinstance(data, bytes) else parse_file(name, data, mapping)
+                for name, data in contents
+            ]
+        return _import_parsed(session, reports, pending, parsed)
+    finally:
+        session.close()
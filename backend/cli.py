@@ -0,0 +1,67 @@
+"""Command line entry points: ``python -m backend.cli <command> ...``."""
+
+import argparse
+import json
+import sys
+
+from . import models
+from .batch_import import import_paths
+from .rule_matcher import reapply_rules
+
+
+def _import(args):
+    mapping = json.loads(args.mapping) if args.mapping else None
+    report = import_paths(
+        args.files,
+        mapping=mapping,
+        workers=args.workers,
+        force=args.force,
+        parallel=args.parallel,
+    )
+    json.dump(report, sys.stdout, ensure_ascii=False, indent=2, default=str)
+    sys.stdout.write('\n')
+    return 1 if any(f['errors'] for f in report['files']) else 0
+
+
+def _reapply_rules(args):
+    session = models.SessionLocal()
+    try:
+        result = reapply_rules(session, chunk_size=args.chunk_size)
+    finally:
+        session.close()
+    json.dump(result, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m backend.cli')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    imp = commands.add_parser('import', help='import CSV files or ZIP archives')
+    imp.add_argument('files', nargs='+', help='CSV files or ZIP archives')
+    imp.add_argument('--mapping', help='column mapping as JSON')
+    imp.add_argument('--workers', type=int, help='number of parsing processes')
+    imp.add_argument(
+        '--force', action='store_true', help='import files even if already imported'
+    )
+    imp.add_argument(
+        '--parallel',
+        action='store_true',
+        help='split each large CSV file in chunks parsed by several processes',
+    )
+    imp.set_defaults(func=_import)
+
+    reapply = commands.add_parser(
+        'reapply-rules', help='re-categorise all stored transactions with the rules'
+    )
+    reapply.add_argument('--chunk-size', type=int, help='transactions updated at once')
+    reapply.set_defaults(func=_reapply_rules)
+
+    args = parser.parse_args(argv)
+    models.init_db()
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
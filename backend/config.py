@@ -31,6 +31,33 @@ if not _SECRET_KEY:
 CATEGORIES_JSON = os.environ.get('CATEGORIES_JSON', str(BASE_DIR / 'categories.json'))
 SECRET_KEY = _SECRET_KEY
 
+# Number of parsed rows handled at once while importing a file
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', 1000))
+# Number of rows sent per INSERT statement (and committed) in bulk import mode
+IMPORT_CHUNK_SIZE = int(os.environ.get('IMPORT_CHUNK_SIZE', 5000))
+# Worker threads running background imports
+IMPORT_WORKERS = int(os.environ.get('IMPORT_WORKERS', 2))
+# Processes parsing batch imports (0 uses one per CPU)
+IMPORT_PROCESSES = int(os.environ.get('IMPORT_PROCESSES', 0))
+# Bytes of a large CSV file parsed by each process in parallel mode
+IMPORT_PARALLEL_CHUNK_SIZE = int(os.environ.get('IMPORT_PARALLEL_CHUNK_SIZE', 16 * 1024 * 1024))
+# Seconds a previewed upload stays available to /import
+IMPORT_SPOOL_TTL = int(os.environ.get('IMPORT_SPOOL_TTL', 900))
+# Total size of the previewed uploads kept on disk
+IMPORT_SPOOL_MAX_BYTES = int(os.environ.get('IMPORT_SPOOL_MAX_BYTES', 256 * 1024 * 1024))
+# Transactions read and updated at once when all rules are re-applied
+RULES_REAPPLY_CHUNK_SIZE = int(os.environ.get('RULES_REAPPLY_CHUNK_SIZE', 10000))
+# Matching transactions returned by /rules/preview
+RULES_PREVIEW_SAMPLE_SIZE = int(os.environ.get('RULES_PREVIEW_SAMPLE_SIZE', 10))
+# Distinct labels checked against the existing rules by /rules/preview
+RULES_PREVIEW_LABEL_LIMIT = int(os.environ.get('RULES_PREVIEW_LABEL_LIMIT', 5000))
+# Enforce (account, date, label, amount) uniqueness with a database index
+UNIQUE_TRANSACTIONS = os.environ.get('UNIQUE_TRANSACTIONS', '0').lower() in ('1', 'true', 'yes')
+
+# Index transaction labels by trigrams (SQLite FTS5) for substring searches;
+# opt-in as keeping the index up to date slows imports down
+LABEL_SEARCH_INDEX = os.environ.get('LABEL_SEARCH_INDEX', '0').lower() in ('1', 'true', 'yes')
+
 # *** ADAPTATION CHEMIN BASE ***
 if getattr(sys, 'frozen', False):
     # Exécuté via PyInstaller
@@ -44,4 +71,8 @@ DATABASE_URI = os.environ.get('DATABASE_URI', f'sqlite:///{DEFAULT_DB}')
 print("CHEMIN BASE DE DONNÉES UTILISÉ :", DEFAULT_DB)
 print("DATABASE_URI utilisée :", DATABASE_URI)
 
-__all__ = ['FRONTEND_DIR', 'SECRET_KEY', 'DATABASE_URI', 'CATEGORIES_JSON']
+__all__ = ['FRONTEND_DIR', 'SECRET_KEY', 'DATABASE_URI', 'CATEGORIES_JSON', 'IMPORT_BATCH_SIZE',
+           'IMPORT_CHUNK_SIZE', 'IMPORT_WORKERS',
+           'IMPORT_PROCESSES', 'IMPORT_PARALLEL_CHUNK_SIZE', 'IMPORT_SPOOL_TTL', 'IMPORT_SPOOL_MAX_BYTES',
+           'RULES_REAPPLY_CHUNK_SIZE', 'RULES_PREVIEW_SAMPLE_SIZE', 'RULES_PREVIEW_LABEL_LIMIT',
+           'UNIQUE_TRANSACTIONS', 'LABEL_SEARCH_INDEX']
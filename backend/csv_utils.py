@@ -1,11 +1,24 @@
+import codecs
 import csv
+import hashlib
+import io
+import mmap
+import os
 import re
-from datetime import datetime  # use standard datetime
+import unicodedata
+from datetime import date, datetime  # use standard datetime
+from itertools import chain, islice
 from typing import List, Optional, Tuple
 
-from sqlalchemy import func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 
-from .models import Transaction
+from .models import (
+    UNIQUE_TRANSACTION_COLUMNS,
+    Transaction,
+    deferred_label_index,
+    label_like,
+    transaction_fingerprint,
+)
 
 
 def detect_csv_structure(content: str) -> Tuple[str, Optional[int], int, List[str]]:
@@ -19,6 +32,73 @@ def detect_csv_structure(content: str) -> Tuple[str, Optional[int], int, List[st
     """
 
     lines = content.splitlines()
+    mid = len(lines) // 2
+    return _detect_structure(lines, lines[mid:mid + 10])
+
+
+# Bytes read from the start of a file to detect its structure
+STRUCTURE_PREFIX_SIZE = 64 * 1024
+# Bytes read around the middle of a file to sniff its delimiter
+STRUCTURE_SAMPLE_SIZE = 4 * 1024
+
+
+def detect_stream_structure(stream, encoding='utf-8', prefix_size=STRUCTURE_PREFIX_SIZE,
+                            sample_size=STRUCTURE_SAMPLE_SIZE):
+    """Run :func:`detect_csv_structure` on a bounded part of a binary stream.
+
+    Only the first ``prefix_size`` bytes and ``sample_size`` bytes around
+    the middle of a seekable ``stream`` are read, so the cost does not depend
+    on the file size. Files shorter than the prefix give exactly the result
+    of :func:`detect_csv_structure`. Return ``(structure, lines)`` where
+    ``structure`` is the usual tuple and ``lines`` the complete lines of the
+    prefix. The stream is left at its initial position when seekable.
+    """
+    seekable = getattr(stream, 'seekable', lambda: False)()
+    start = stream.tell() if seekable else 0
+    data = stream.read(prefix_size)
+    complete = len(data) < prefix_size
+    text = codecs.getincrementaldecoder(encoding)().decode(data, final=complete)
+    lines = text.splitlines()
+    if not complete and lines and text[-1] not in _LINE_BREAKS:
+        # The last line continues after the prefix
+        lines.pop()
+
+    if complete:
+        mid = len(lines) // 2
+        middle = lines[mid:mid + 10]
+    else:
+        middle = []
+        codec = codecs.lookup(encoding).name
+        if seekable and not codec.startswith(('utf-16', 'utf-32')):
+            end = stream.seek(0, 2)
+            stream.seek(start + (end - start) // 2)
+            chunk = stream.read(sample_size).decode(encoding, errors='replace')
+            # Drop the partial lines at both ends of the sample
+            middle = chunk.splitlines()[1:-1][:10]
+    if seekable:
+        stream.seek(start)
+    return _detect_structure(lines, middle), lines
+
+
+def header_signature(delimiter, columns):
+    """Return a hash identifying a CSV layout, or ``None`` without header.
+
+    Column names are compared without case, accents or repeated spaces so
+    that the same export decoded slightly differently keeps its signature.
+    """
+    if not columns:
+        return None
+    names = []
+    for column in columns:
+        text = unicodedata.normalize('NFKD', column)
+        text = ''.join(c for c in text if not unicodedata.combining(c))
+        names.append(' '.join(text.lower().split()))
+    data = '\x1f'.join([delimiter] + names).encode('utf-8')
+    return hashlib.sha256(data).hexdigest()
+
+
+def _detect_structure(lines, middle):
+    """Detect the structure from ``lines`` and a ``middle`` sample of the file."""
     if not lines:
         return ',', None, 0, []
 
@@ -31,8 +111,7 @@ def detect_csv_structure(content: str) -> Tuple[str, Optional[int], int, List[st
     else:
         return ',', None, 0, []
 
-    mid = len(lines) // 2
-    sample_lines = [l for l in lines[mid:mid + 10] if l.strip()]
+    sample_lines = [l for l in middle if l.strip()]
     if len(sample_lines) < 2:
         sample_lines = [l for l in lines[start_index:start_index + 10] if l.strip()]
     sample = '\n'.join(sample_lines)
@@ -81,26 +160,209 @@ def detect_csv_structure(content: str) -> Tuple[str, Optional[int], int, List[st
     return delimiter, header_index, data_start_idx, columns
 
 
-def parse_csv(content, mapping=None):
-    """Parse CSV content and return transactions, duplicates, errors and account info.
+# Characters treated as line boundaries by str.splitlines
+_LINE_BREAKS = '\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029'
 
-    ``mapping`` associates transaction fields to column indexes. The default
-    mapping assumes the following order: date, type, payment method, label and
-    amount.
+DEFAULT_MAPPING = {
+    'date': 0,
+    'type': 1,
+    'payment_method': 2,
+    'label': 3,
+    'amount': 4,
+}
+
+
+def iter_decoded_lines(stream, encoding='utf-8', chunk_size=64 * 1024):
+    """Yield text lines from a binary ``stream`` decoded incrementally.
+
+    Only ``chunk_size`` bytes are read at a time so the whole upload never has
+    to be held in memory. Lines are split like :meth:`str.splitlines` and are
+    returned without their terminator.
     """
-    if mapping is None:
-        mapping = {
-            'date': 0,
-            'type': 1,
-            'payment_method': 2,
-            'label': 3,
-            'amount': 4,
-        }
-    reader = csv.reader(content.splitlines(), delimiter=';')
-    rows = list(reader)
-    if not rows:
-        return [], [], ['Fichier totalement vide'], {}
+    decoder = codecs.getincrementaldecoder(encoding)()
+    pending = ''
+    while True:
+        chunk = stream.read(chunk_size)
+        final = not chunk
+        text = pending + decoder.decode(chunk, final=final)
+        lines = text.splitlines()
+        pending = ''
+        if lines and not final:
+            # Keep an unterminated line, or a trailing '\r' that may be
+            # followed by '\n' in the next chunk, for the next iteration.
+            if text[-1] == '\r':
+                pending = lines.pop() + '\r'
+            elif text[-1] not in _LINE_BREAKS:
+                pending = lines.pop()
+        yield from lines
+        if final:
+            break
+
+
+# Number of bytes inspected to guess the encoding of an upload
+ENCODING_SAMPLE_SIZE = 64 * 1024
+
+# Bytes that have no character assigned in cp1252
+_CP1252_UNDEFINED = b'\x81\x8d\x8f\x90\x9d'
+
+
+def detect_encoding(prefix):
+    """Guess the text encoding of a file from its first bytes.
+
+    A byte order mark wins; otherwise UTF-8 is used when ``prefix`` is valid
+    UTF-8 (a truncated trailing character is accepted). Other files are
+    assumed to be cp1252, the usual Windows export encoding, unless they
+    contain bytes undefined in cp1252, in which case latin-1 is returned.
+    """
+    if prefix.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    if prefix.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return 'utf-16'
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(prefix, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        pass
+    if any(b in _CP1252_UNDEFINED for b in prefix):
+        return 'latin-1'
+    return 'cp1252'
+
+
+class _PrefixedStream:
+    """Binary stream replaying ``prefix`` before the rest of ``stream``."""
+
+    def __init__(self, prefix, stream):
+        self.prefix = prefix
+        self.stream = stream
+
+    def read(self, size=-1):
+        if not self.prefix:
+            return self.stream.read(size)
+        if size is None or size < 0:
+            data = self.prefix + self.stream.read()
+            self.prefix = b''
+            return data
+        data = self.prefix[:size]
+        self.prefix = self.prefix[size:]
+        return data
+
+
+def sniff_encoding(stream, sample_size=ENCODING_SAMPLE_SIZE):
+    """Detect the encoding of a binary ``stream`` from a bounded prefix.
+
+    Return ``(encoding, stream)``; the returned stream starts at the same
+    position as the original one, so nothing is decoded twice beyond the
+    inspected prefix.
+    """
+    prefix, stream = peek_stream(stream, sample_size)
+    return detect_encoding(prefix), stream
+
+
+def peek_stream(stream, size):
+    """Return ``(prefix, stream)`` with the first ``size`` bytes of ``stream``.
 
+    The returned stream starts at the same position as the original one:
+    seekable streams are rewound, others replay the prefix.
+    """
+    prefix = stream.read(size)
+    try:
+        stream.seek(-len(prefix), 1)
+    except (AttributeError, OSError, ValueError):
+        stream = _PrefixedStream(prefix, stream)
+    return prefix, stream
+
+
+# Bytes of a memory-mapped file decoded at once
+MMAP_WINDOW_SIZE = 256 * 1024
+
+
+def ascii_compatible(encoding):
+    """Return ``True`` when ``encoding`` writes ``\\n`` as a byte no other character uses.
+
+    UTF-8 and the single-byte encodings qualify; UTF-16 and UTF-32 do not.
+    """
+    name = codecs.lookup(encoding).name
+    if name in ('utf-8', 'utf-8-sig'):
+        return True
+    try:
+        decoded = bytes(range(256)).decode(name, errors='replace')
+    except LookupError:
+        return False
+    return len(decoded) == 256 and decoded[10] == '\n'
+
+
+def map_stream(stream):
+    """Return ``(mmap, offset)`` for a binary stream backed by a file on disk.
+
+    Only plain files are mapped: file objects from :func:`open` or streams
+    whose ``name`` is the path of a file. ``offset`` is the current position
+    of the stream. ``None`` is returned for empty files and any other stream,
+    such as ``BytesIO`` or ``SpooledTemporaryFile``, which are read through
+    the buffered decoding path.
+    """
+    name = getattr(stream, 'name', None)
+    on_disk = isinstance(stream, (io.BufferedReader, io.BufferedRandom, io.FileIO)) or (
+        isinstance(name, str) and os.path.isfile(name)
+    )
+    if not on_disk:
+        return None
+    try:
+        fileno = stream.fileno()
+        offset = stream.tell()
+        # Data still buffered by the writer must reach the file
+        stream.flush()
+        return mmap.mmap(fileno, 0, access=mmap.ACCESS_READ), offset
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def iter_mapped_lines(mm, start=0, encoding='utf-8', window=MMAP_WINDOW_SIZE):
+    """Yield the text lines of ``mm[start:]`` like :func:`iter_decoded_lines`.
+
+    The map is scanned by windows of about ``window`` bytes ending after a
+    ``\\n`` and each window is decoded straight from the mapped pages, without
+    copying them to a bytes object first. ``encoding`` must be
+    :func:`ascii_compatible`.
+    """
+    view = memoryview(mm)
+    size = len(mm)
+    try:
+        while start < size:
+            end = mm.find(b'\n', min(start + window, size) - 1)
+            end = size if end < 0 else end + 1
+            yield from str(view[start:end], encoding).splitlines()
+            start = end
+            # Only the start of the file may hold a byte order mark
+            if codecs.lookup(encoding).name == 'utf-8-sig':
+                encoding = 'utf-8'
+    finally:
+        view.release()
+
+
+def _iter_stream_lines(stream, encoding):
+    mapped = map_stream(stream) if ascii_compatible(encoding) else None
+    if mapped is None:
+        yield from iter_decoded_lines(stream, encoding=encoding)
+        return
+    mm, offset = mapped
+    with mm:
+        yield from iter_mapped_lines(mm, offset, encoding)
+
+
+def _iter_lines(source, encoding='utf-8'):
+    """Return an iterator of text lines for a string, binary stream or iterable.
+
+    Streams backed by a file on disk are read through :func:`map_stream`.
+    """
+    if isinstance(source, str):
+        return iter(source.splitlines())
+    if hasattr(source, 'read'):
+        return _iter_stream_lines(source, encoding)
+    return iter(source)
+
+
+def _parse_account_header(rows):
+    """Return ``(account_info, header_mode)`` from the first rows of a file."""
     # Detect a BNP export with a header line after an empty row
     header_mode = False
     if len(rows) >= 3 and not any(c.strip() for c in rows[1]):
@@ -137,138 +399,446 @@ def parse_csv(content, mapping=None):
         if balance is not None:
             account_info['initial_balance'] = balance
             account_info['balance_date'] = export_date
-        start_idx = 3
-    else:
-        account_row = rows[0]
-        info_str = ' '.join(account_row)
-        number = ''
-        export_date = None
-        account_type = info_str
-        m = re.search(r'(\d{2}/\d{2}/\d{4}|\d{4}-\d{2}-\d{2})', info_str)
-        if m:
-            date_str = m.group(1)
+        return account_info, True
+
+    account_row = rows[0]
+    info_str = ' '.join(account_row)
+    number = ''
+    export_date = None
+    account_type = info_str
+    m = re.search(r'(\d{2}/\d{2}/\d{4}|\d{4}-\d{2}-\d{2})', info_str)
+    if m:
+        date_str = m.group(1)
+        try:
+            export_date = datetime.strptime(date_str, '%Y-%m-%d').date()
+        except ValueError:
             try:
-                export_date = datetime.strptime(date_str, '%Y-%m-%d').date()
+                export_date = datetime.strptime(date_str, '%d/%m/%Y').date()
             except ValueError:
-                try:
-                    export_date = datetime.strptime(date_str, '%d/%m/%Y').date()
-                except ValueError:
-                    export_date = None
-            account_type = info_str[:m.start()].strip()
-        n = re.search(r'(\d{4,})', info_str)
-        if n:
-            number = n.group(1)
-            if n.start() < len(account_type):
-                account_type = account_type[:n.start()].strip()
+                export_date = None
+        account_type = info_str[:m.start()].strip()
+    n = re.search(r'(\d{4,})', info_str)
+    if n:
+        number = n.group(1)
+        if n.start() < len(account_type):
+            account_type = account_type[:n.start()].strip()
+
+    account_info = {
+        'account_type': account_type.strip(),
+        'number': number,
+        'export_date': export_date,
+    }
+    return account_info, False
+
+
+def _parse_date(value):
+    """Convert a YYYY-MM-DD or DD/MM/YYYY string, raising ``ValueError``."""
+    value = value.strip()
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        return datetime.strptime(value, '%d/%m/%Y').date()
 
-        account_info = {
-            'account_type': account_type.strip(),
-            'number': number,
-            'export_date': export_date,
-        }
-        start_idx = 1
 
-    transactions = []
-    duplicates = []
-    errors = []
+def _parse_iso_date(value):
+    if len(value) != 10 or value[4] != '-' or value[7] != '-':
+        raise ValueError(value)
+    return date.fromisoformat(value)
+
+
+def parse_iso_date(value):
+    """Convert a YYYY-MM-DD string, also accepting unpadded months and days."""
+    try:
+        return _parse_iso_date(value)
+    except (TypeError, ValueError):
+        return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def _parse_dmy_date(value):
+    digits = value[:2] + value[3:5] + value[6:]
+    if len(value) != 10 or value[2] != '/' or value[5] != '/' or not digits.isdigit():
+        raise ValueError(value)
+    return date(int(value[6:]), int(value[3:5]), int(value[:2]))
+
+
+def _parse_amount(value):
+    """Convert an amount string, handling spaces, decimal commas and signs."""
+    cleaned = value.replace('\xa0', '').replace(' ', '')
+    negative = False
+    if cleaned.endswith('-'):
+        negative = True
+        cleaned = cleaned[:-1]
+    elif cleaned.startswith('(') and cleaned.endswith(')'):
+        negative = True
+        cleaned = cleaned[1:-1]
+
+    cleaned = cleaned.replace(',', '.')
+    amount = float(cleaned)
+    if negative:
+        amount = -amount
+    return amount
+
+
+def _parse_comma_amount(value):
+    return float(value.replace(',', '.'))
+
+
+def _parse_signed_amount(value):
+    if value[-1] == '-':
+        return -float(value[:-1].replace(',', '.'))
+    if value[0] == '(' and value[-1] == ')':
+        return -float(value[1:-1].replace(',', '.'))
+    return float(value.replace(',', '.'))
+
+
+# Specialised converters, from the cheapest to the most general. A value they
+# cannot convert falls back to _parse_date/_parse_amount, so they only need
+# to agree with them on the values they accept.
+_DATE_PARSERS = {
+    'iso': _parse_iso_date,
+    'dmy': _parse_dmy_date,
+    None: _parse_date,
+}
+_AMOUNT_PARSERS = {
+    'dot': float,
+    'comma': _parse_comma_amount,
+    'signed': _parse_signed_amount,
+    None: _parse_amount,
+}
+
+# Number of data rows inspected to choose the converters of a file
+FORMAT_SAMPLE_SIZE = 100
+
+
+def _best_format(parsers, reference, values):
+    """Return the name of the first parser agreeing with ``reference`` on most values."""
+    expected = []
+    for value in values:
+        try:
+            expected.append((value, reference(value)))
+        except ValueError:
+            continue
+    best, best_count = None, 0
+    for name, parser in parsers.items():
+        if name is None:
+            continue
+        count = 0
+        for value, result in expected:
+            try:
+                if parser(value) == result:
+                    count += 1
+            except (TypeError, ValueError):
+                pass
+        if count > best_count:
+            best, best_count = name, count
+        if expected and count == len(expected):
+            break
+    return best
+
+
+def detect_value_formats(rows, mapping):
+    """Return the ``(date_format, amount_format)`` suited to sample ``rows``.
+
+    The names select specialised converters used by :func:`iter_row_events`;
+    ``None`` means the generic conversion.
+    """
+    date_idx = mapping.get('date', 0)
+    amount_idx = mapping.get('amount', 0)
+    dates = [r[date_idx] for r in rows if len(r) > date_idx and r[date_idx]]
+    amounts = [r[amount_idx] for r in rows if len(r) > amount_idx and r[amount_idx]]
+    return (
+        _best_format(_DATE_PARSERS, _parse_date, dates),
+        _best_format(_AMOUNT_PARSERS, _parse_amount, amounts),
+    )
+
+
+def iter_parse_csv(source, mapping=None, encoding='utf-8'):
+    """Parse CSV content lazily and yield ``(kind, value)`` events.
+
+    ``source`` may be a string, a binary stream (decoded incrementally with
+    ``encoding``) or an iterable of lines. The first event is always
+    ``('account', account_info)``, read from the first rows of the file. It is
+    followed by ``('transaction', dict)``, ``('duplicate', dict)`` and
+    ``('error', message)`` events in file order.
+    """
+    reader = csv.reader(_iter_lines(source, encoding), delimiter=';')
+    yield from iter_parse_rows(reader, mapping=mapping)
+
+
+def iter_parse_rows(rows, mapping=None):
+    """Yield the events of :func:`iter_parse_csv` for an iterable of cell lists.
+
+    The account is read from the first rows, the remaining rows are converted
+    with ``mapping``. Spreadsheet readers use it to share the CSV logic.
+    """
+    if mapping is None:
+        mapping = DEFAULT_MAPPING
+    reader = iter(rows)
+    head = list(islice(reader, 3))
+    if not head:
+        yield 'account', {}
+        yield 'error', 'Fichier totalement vide'
+        return
+
+    account_info, header_mode = _parse_account_header(head)
+    yield 'account', account_info
+    start_idx = 3 if header_mode else 1
+
+    rows = chain(head[start_idx:], reader)
+    yield from iter_row_events(rows, mapping, start_line=start_idx + 1)
+
+
+def iter_row_events(rows, mapping, start_line=1, formats=None):
+    """Yield transaction, duplicate and error events for CSV data ``rows``.
+
+    ``start_line`` is the line number of the first row. ``formats`` is the
+    ``(date_format, amount_format)`` pair returned by
+    :func:`detect_value_formats`; it is detected from the first rows when
+    omitted.
+    """
+    if formats is None:
+        sample = list(islice(rows, FORMAT_SAMPLE_SIZE))
+        formats = detect_value_formats(sample, mapping)
+        rows = chain(sample, rows)
+    fast_date = _DATE_PARSERS.get(formats[0])
+    fast_amount = _AMOUNT_PARSERS.get(formats[1])
+
     seen = set()
 
     max_required = max(mapping.get('date', 0), mapping.get('label', 0), mapping.get('amount', 0))
-    for line_no, row in enumerate(rows[start_idx:], start=start_idx + 1):
-        if not any(cell.strip() for cell in row):
+    date_idx = mapping['date']
+    label_idx = mapping['label']
+    amount_idx = mapping['amount']
+    type_idx = mapping['type'] if 'type' in mapping else None
+    method_idx = mapping['payment_method'] if 'payment_method' in mapping else None
+    for line_no, row in enumerate(rows, start=start_line):
+        if not ''.join(row).strip():
             continue
-        if len(row) <= max_required:
-            errors.append(
+        width = len(row)
+        if width <= max_required:
+            yield 'error', (
                 f"Ligne {line_no}: colonnes manquantes (ligne comportant moins de colonnes que requis)"
             )
             continue
 
-        date_str = row[mapping['date']]
-        tx_type = row[mapping['type']] if 'type' in mapping and mapping['type'] < len(row) else ''
-        payment_method = row[mapping['payment_method']] if 'payment_method' in mapping and mapping['payment_method'] < len(row) else ''
-        label = row[mapping['label']].strip()
+        date_str = row[date_idx]
+        tx_type = row[type_idx].strip() if type_idx is not None and type_idx < width else ''
+        payment_method = row[method_idx].strip() if method_idx is not None and method_idx < width else ''
+        label = row[label_idx].strip()
         if label.startswith(('=', '+', '-', '@')):
             label = "'" + label
 
-        amount_str = row[mapping['amount']]
+        amount_str = row[amount_idx]
 
         if not (date_str and label and amount_str):
-            errors.append(
+            yield 'error', (
                 f"Ligne {line_no}: colonnes manquantes (valeurs essentielles manquantes)"
             )
             continue
 
         try:
+            date = fast_date(date_str)
+        except (TypeError, ValueError):
             try:
-                date = datetime.strptime(date_str.strip(), '%Y-%m-%d').date()
+                date = _parse_date(date_str)
             except ValueError:
-                date = datetime.strptime(date_str.strip(), '%d/%m/%Y').date()
-        except ValueError:
-            errors.append(
-                f"Ligne {line_no}: date impossible à convertir (formats acceptés : YYYY-MM-DD ou DD/MM/YYYY)"
-            )
-            continue
+                yield 'error', (
+                    f"Ligne {line_no}: date impossible à convertir (formats acceptés : YYYY-MM-DD ou DD/MM/YYYY)"
+                )
+                continue
 
         try:
-            cleaned = amount_str.replace('\xa0', '').replace(' ', '')
-            negative = False
-            if cleaned.endswith('-'):
-                negative = True
-                cleaned = cleaned[:-1]
-            elif cleaned.startswith('(') and cleaned.endswith(')'):
-                negative = True
-                cleaned = cleaned[1:-1]
-
-            cleaned = cleaned.replace(',', '.')
-            amount = float(cleaned)
-            if negative:
-                amount = -amount
-        except ValueError:
-            errors.append(
-                f"Ligne {line_no}: montant non numérique (gestion du signe - en fin ou de parenthèses)"
-            )
-            continue
+            amount = fast_amount(amount_str)
+        except (TypeError, ValueError):
+            try:
+                amount = _parse_amount(amount_str)
+            except ValueError:
+                yield 'error', (
+                    f"Ligne {line_no}: montant non numérique (gestion du signe - en fin ou de parenthèses)"
+                )
+                continue
 
-        key = (date, label.strip(), amount)
+        key = (date, label, amount)
         if key in seen:
-            duplicates.append({
+            yield 'duplicate', {
                 'line_no': line_no,
                 'date': date,
-                'type': tx_type.strip(),
-                'payment_method': payment_method.strip(),
-                'label': label.strip(),
+                'type': tx_type,
+                'payment_method': payment_method,
+                'label': label,
                 'amount': amount,
-            })
+            }
             continue
         seen.add(key)
 
-        transactions.append({
+        yield 'transaction', {
             'date': date,
-            'type': tx_type.strip(),
-            'payment_method': payment_method.strip(),
-            'label': label.strip(),
+            'type': tx_type,
+            'payment_method': payment_method,
+            'label': label,
             'amount': amount,
             'reconciled': False,
             'to_analyze': True
-        })
+        }
 
+
+def parse_csv(content, mapping=None, encoding='utf-8'):
+    """Parse CSV content and return transactions, duplicates, errors and account info.
+
+    ``mapping`` associates transaction fields to column indexes. The default
+    mapping assumes the following order: date, type, payment method, label and
+    amount. ``content`` may also be a binary stream, see :func:`iter_parse_csv`.
+    """
+    return collect_events(iter_parse_csv(content, mapping=mapping, encoding=encoding))
+
+
+def collect_events(events):
+    """Return ``(transactions, duplicates, errors, account_info)`` from parse events."""
+    transactions = []
+    duplicates = []
+    errors = []
+    account_info = {}
+    for kind, value in events:
+        if kind == 'transaction':
+            transactions.append(value)
+        elif kind == 'duplicate':
+            duplicates.append(value)
+        elif kind == 'error':
+            errors.append(value)
+        else:
+            account_info = value
     return transactions, duplicates, errors, account_info
 
 
+def iter_transaction_batches(events, size, duplicates, errors):
+    """Group the ``transaction`` events of :func:`iter_parse_csv` in lists.
+
+    Lists hold at most ``size`` transactions. ``duplicate`` and ``error``
+    events are appended to the ``duplicates`` and ``errors`` lists as they
+    are read.
+    """
+    batch = []
+    for kind, value in events:
+        if kind == 'transaction':
+            batch.append(value)
+            if len(batch) >= size:
+                yield batch
+                batch = []
+        elif kind == 'duplicate':
+            duplicates.append(value)
+        elif kind == 'error':
+            errors.append(value)
+    if batch:
+        yield batch
+
+
+# Maximum number of fingerprints sent in one ``IN`` clause
+FINGERPRINT_QUERY_SIZE = 500
+
+
+class ExistingKeys:
+    """``(date, label, amount)`` keys already stored for a bank account.
+
+    Stored rows are looked up by fingerprint through the
+    ``(bank_account_id, fingerprint)`` index. Each fingerprint is queried at
+    most once and the keys of the matching rows are kept in a set, so only
+    rows with a new fingerprint cost a lookup.
+    """
+
+    def __init__(self, session, account_id):
+        self.session = session
+        self.account_id = account_id
+        self.keys = set()
+        self.checked = set()
+
+    def load(self, fingerprints):
+        """Make sure rows with the given ``fingerprints`` are available."""
+        pending = [fp for fp in set(fingerprints) if fp not in self.checked]
+        self.checked.update(pending)
+        for i in range(0, len(pending), FINGERPRINT_QUERY_SIZE):
+            rows = (
+                self.session.query(Transaction.date, Transaction.label, Transaction.amount)
+                .filter(
+                    Transaction.bank_account_id == self.account_id,
+                    Transaction.fingerprint.in_(pending[i:i + FINGERPRINT_QUERY_SIZE]),
+                )
+            )
+            self.keys.update((d, label, amount) for d, label, amount in rows)
+
+    def load_for(self, transactions):
+        """Load the stored rows matching ``transactions``."""
+        self.load(
+            transaction_fingerprint(t['date'], t['label'], t['amount'])
+            for t in transactions
+        )
+
+    def add(self, key):
+        self.keys.add(key)
+
+    def __contains__(self, key):
+        return key in self.keys
+
+
+def bulk_insert_transactions(session, rows):
+    """Insert transaction rows with a single executemany ``INSERT``.
+
+    ``rows`` are dictionaries keyed by column name. The session is committed
+    right away and the number of inserted rows is returned.
+    """
+    if not rows:
+        return 0
+    with deferred_label_index(session):
+        result = session.execute(Transaction.__table__.insert(), rows)
+    session.commit()
+    return result.rowcount if result.rowcount is not None and result.rowcount >= 0 else len(rows)
+
+
+def insert_ignore_transactions(session, rows):
+    """Insert transaction rows, skipping those already stored.
+
+    Conflicts are resolved by the unique ``(bank_account_id, date, label,
+    amount)`` index, which must exist. The session is committed and the
+    ``(date, label, amount)`` keys of the inserted rows are returned.
+    """
+    if not rows:
+        return []
+    table = Transaction.__table__
+    stmt = (
+        sqlite_insert(table)
+        .on_conflict_do_nothing(index_elements=list(UNIQUE_TRANSACTION_COLUMNS))
+        .returning(table.c.date, table.c.label, table.c.amount)
+    )
+    with deferred_label_index(session):
+        keys = [tuple(row) for row in session.execute(stmt, rows)]
+    session.commit()
+    return keys
+
+
+def rule_like_pattern(pattern):
+    """Return the ``LIKE`` pattern of a rule, or ``None`` when it has no word.
+
+    A rule matches the labels containing its words in order.
+    """
+    words = (pattern or '').split()
+    if not words:
+        return None
+    return '%' + '%'.join(words) + '%'
+
+
 def apply_rule_to_transactions(session, rule):
     """Update transactions matching a rule and return the number updated."""
-    words = [w for w in rule.pattern.split() if w]
-    if not words:
+    like_pattern = rule_like_pattern(rule.pattern)
+    if like_pattern is None:
         return 0
 
-    like_pattern = '%' + '%'.join(words) + '%'
     updated = (
         session.query(Transaction)
-        .filter(func.lower(Transaction.label).like(like_pattern.lower()))
+        .filter(label_like(session, like_pattern))
         .update(
             {
                 Transaction.category_id: rule.category_id,
                 Transaction.subcategory_id: rule.subcategory_id,
+                Transaction.rule_id: rule.id,
             },
             synchronize_session=False,
         )
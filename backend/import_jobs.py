@@ -0,0 +1,212 @@
+"""Background statement imports running in a worker thread pool."""
+
+import logging
+import os
+import shutil
+import tempfile
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from . import config, models
+from .import_metrics import ImportMetrics
+from .import_spool import iter_spooled_events
+from .importer import (
+    account_payload,
+    find_or_create_account,
+    import_events,
+    import_response,
+    record_imported_file,
+)
+from .statements import iter_parse_statement
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_futures = {}
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=config.IMPORT_WORKERS, thread_name_prefix='import'
+        )
+    return _executor
+
+
+def submit_import_job(
+    stream,
+    filename='',
+    mapping=None,
+    chunk_size=None,
+    encoding='utf-8',
+    sha256=None,
+    ignore_conflicts=False,
+    spool_path=None,
+):
+    """Spool ``stream`` to disk, queue its import and return the job id.
+
+    ``spool_path`` replaces ``stream`` with the events recorded by
+    ``/import/preview``; the job then owns and removes that file.
+    """
+    if spool_path:
+        path = spool_path
+    else:
+        fd, path = tempfile.mkstemp(prefix='tresoperso-import-', suffix='.csv')
+        with os.fdopen(fd, 'wb') as fh:
+            shutil.copyfileobj(stream, fh)
+
+    now = datetime.now()
+    job = models.ImportJob(
+        id=uuid.uuid4().hex,
+        filename=filename,
+        phase='queued',
+        created_at=now,
+        updated_at=now,
+    )
+    session = models.SessionLocal()
+    session.add(job)
+    session.commit()
+    job_id = job.id
+    session.close()
+
+    future = _get_executor().submit(
+        run_import_job,
+        job_id,
+        path,
+        mapping,
+        chunk_size,
+        encoding,
+        sha256,
+        ignore_conflicts,
+        bool(spool_path),
+    )
+    _futures[job_id] = future
+    future.add_done_callback(lambda f: _futures.pop(job_id, None))
+    return job_id
+
+
+def wait_for_job(job_id, timeout=None):
+    """Block until the job submitted in this process is finished."""
+    future = _futures.get(job_id)
+    if future is not None:
+        future.result(timeout=timeout)
+
+
+def run_import_job(
+    job_id,
+    path,
+    mapping=None,
+    chunk_size=None,
+    encoding='utf-8',
+    sha256=None,
+    ignore_conflicts=False,
+    spooled=False,
+):
+    """Import the spooled file at ``path`` and record progress on the job.
+
+    ``path`` is a CSV, CAMT.053 or OFX upload, or a file of parsed events when ``spooled``.
+
+    Jobs always use the chunked bulk insert so that rows and progress are
+    committed together after each chunk, keeping them visible to pollers.
+    """
+    metrics = ImportMetrics()
+    metrics.switch('read')
+    metrics.watch(models.engine)
+    session = models.SessionLocal()
+    job = session.query(models.ImportJob).get(job_id)
+
+    def progress(phase, rows, imported, duplicates, errors):
+        job.phase = phase
+        job.rows_processed = rows
+        job.imported = imported
+        job.duplicates = duplicates
+        job.errors = errors
+        job.updated_at = datetime.now()
+        session.commit()
+
+    try:
+        with open(path, 'rb') as fh:
+            if spooled:
+                events = iter_spooled_events(path)
+            else:
+                events = iter_parse_statement(fh, mapping=mapping, encoding=encoding)
+            metrics.switch('parse')
+            try:
+                _, account_info = next(events)
+            except Exception as e:
+                job.result = {'error': str(e)}
+                job.status_code = 400
+                job.errors = 1
+            else:
+                metrics.switch('account')
+                account = find_or_create_account(session, account_info)
+                imported, duplicates, errors = import_events(
+                    session,
+                    events,
+                    account,
+                    bulk=True,
+                    chunk_size=chunk_size,
+                    progress=progress,
+                    ignore_conflicts=ignore_conflicts,
+                    metrics=metrics,
+                )
+                if sha256 and not errors:
+                    metrics.switch('record')
+                    record_imported_file(
+                        session, sha256, account, job.filename, imported + len(duplicates)
+                    )
+                response, status = import_response(
+                    imported, account_payload(account), duplicates, errors
+                )
+                job.imported = imported
+                job.duplicates = len(duplicates)
+                job.errors = len(errors)
+                job.result = response
+                job.status_code = status
+                logger.info(
+                    "CSV import job %s for account %s: imported=%s duplicates=%s errors=%s",
+                    job_id,
+                    account.id,
+                    imported,
+                    len(duplicates),
+                    len(errors),
+                )
+                metrics.log(
+                    logger, 'job', job_id=job_id, account_id=account.id, imported=imported,
+                    duplicates=len(duplicates), errors=len(errors),
+                )
+        job.phase = 'done'
+    except Exception as e:
+        session.rollback()
+        logger.exception("CSV import job %s failed", job_id)
+        job.phase = 'failed'
+        job.result = {'error': str(e)}
+        job.status_code = 500
+    finally:
+        metrics.stop()
+        job.updated_at = datetime.now()
+        session.commit()
+        session.close()
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def import_job_payload(job):
+    """Return the JSON representation of an import job."""
+    return {
+        'id': job.id,
+        'filename': job.filename,
+        'phase': job.phase,
+        'rows_processed': job.rows_processed or 0,
+        'imported': job.imported or 0,
+        'duplicates': job.duplicates or 0,
+        'errors': job.errors or 0,
+        'result': job.result,
+        'status_code': job.status_code,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'updated_at': job.updated_at.isoformat() if job.updated_at else None,
+    }
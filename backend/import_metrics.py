@@ -0,0 +1,83 @@
+"""Wall time, row and query counts of the phases of an import.
+
+An :class:`ImportMetrics` follows an import through its phases (reading the
+upload, parsing, duplicate lookups, rule matching, inserts and commit). The
+figures are logged as one JSON line per import and can be returned to the
+client under the ``timings`` key of the import responses.
+"""
+
+import json
+import threading
+import time
+
+from sqlalchemy import event
+
+
+class ImportMetrics:
+    """Per-phase figures of one import.
+
+    Phases do not overlap: :meth:`switch` closes the current phase and opens
+    the next one, so that the phase times add up to the total. Streamed files
+    are decoded while their rows are parsed, hence decoding is part of the
+    ``parse`` phase.
+    """
+
+    def __init__(self):
+        self.phases = {}
+        self.current = None
+        self.thread = threading.get_ident()
+        self.started = self.mark = time.perf_counter()
+        self.total = None
+        self.engine = None
+
+    def watch(self, engine):
+        """Count the statements this thread runs on ``engine`` until :meth:`stop`."""
+        if self.engine is None:
+            self.engine = engine
+            event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, conn, cursor, statement, parameters, context, executemany):
+        if self.current is not None and threading.get_ident() == self.thread:
+            self.phases[self.current]['queries'] += 1
+
+    def _phase(self, name):
+        return self.phases.setdefault(name, {'seconds': 0.0, 'rows': 0, 'queries': 0})
+
+    def switch(self, name):
+        """Close the current phase and open ``name`` (``None`` to pause)."""
+        now = time.perf_counter()
+        if self.current is not None:
+            self._phase(self.current)['seconds'] += now - self.mark
+        self.current = name
+        self.mark = now
+        if name is not None:
+            self._phase(name)
+
+    def add_rows(self, name, count):
+        """Add ``count`` rows to those handled by phase ``name``."""
+        self._phase(name)['rows'] += count
+
+    def stop(self):
+        """Close the current phase, freeze the total time and stop counting queries."""
+        self.switch(None)
+        if self.total is None:
+            self.total = time.perf_counter() - self.started
+        if self.engine is not None:
+            event.remove(self.engine, 'before_cursor_execute', self._count)
+            self.engine = None
+
+    def payload(self):
+        """Return the figures as a JSON-serialisable dict."""
+        self.stop()
+        return {
+            'total_seconds': round(self.total, 4),
+            'phases': {
+                name: {**phase, 'seconds': round(phase['seconds'], 4)}
+                for name, phase in self.phases.items()
+            },
+        }
+
+    def log(self, logger, kind, **fields):
+        """Emit the figures of a ``kind`` import as one JSON log line."""
+        record = {'import': kind, **fields, **self.payload()}
+        logger.info('import metrics %s', json.dumps(record, default=str, sort_keys=True))
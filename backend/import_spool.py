@@ -0,0 +1,126 @@
+"""Parsed uploads kept between ``/import/preview`` and the final import.
+
+The events produced while previewing a file are pickled to a temporary file
+and registered under a random token. ``/import`` can then replay them
+instead of receiving and parsing the file again. Spools
+expire after ``IMPORT_SPOOL_TTL`` seconds and the oldest ones are dropped when
+their total size exceeds ``IMPORT_SPOOL_MAX_BYTES``.
+"""
+
+import os
+import pickle
+import secrets
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from . import config
+
+# Number of events pickled together
+_BATCH = 1000
+
+_spools = OrderedDict()
+_lock = threading.Lock()
+
+
+class Spool:
+    """A registered spool file and what is known about its upload."""
+
+    def __init__(self, path, size, sha256=None, filename='', preset=None):
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+        self.filename = filename
+        self.preset = preset
+        self.created = time.monotonic()
+
+
+class SpoolWriter:
+    """Record events to a temporary file while they are consumed."""
+
+    def __init__(self):
+        fd, self.path = tempfile.mkstemp(prefix='tresoperso-preview-', suffix='.spool')
+        self._fh = os.fdopen(fd, 'wb')
+        self._buffer = []
+
+    def wrap(self, events):
+        """Yield ``events`` unchanged, writing them to the spool."""
+        for event in events:
+            self._buffer.append(event)
+            if len(self._buffer) >= _BATCH:
+                self._flush()
+            yield event
+
+    def _flush(self):
+        if self._buffer:
+            pickle.dump(self._buffer, self._fh, pickle.HIGHEST_PROTOCOL)
+            self._buffer = []
+
+    def commit(self, **info):
+        """Register the spool and return its token.
+
+        ``info`` is stored on the :class:`Spool`. ``None`` is returned, and
+        the file removed, when the spool alone exceeds the size limit.
+        """
+        self._flush()
+        self._fh.close()
+        spool = Spool(self.path, os.path.getsize(self.path), **info)
+        if spool.size > config.IMPORT_SPOOL_MAX_BYTES:
+            remove_spool(spool)
+            return None
+        token = secrets.token_urlsafe(24)
+        with _lock:
+            _purge_locked()
+            total = sum(s.size for s in _spools.values())
+            while _spools and total + spool.size > config.IMPORT_SPOOL_MAX_BYTES:
+                _, oldest = _spools.popitem(last=False)
+                total -= oldest.size
+                remove_spool(oldest)
+            _spools[token] = spool
+        return token
+
+    def discard(self):
+        """Drop an incomplete spool."""
+        self._fh.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+def _purge_locked():
+    deadline = time.monotonic() - config.IMPORT_SPOOL_TTL
+    for token in [t for t, s in _spools.items() if s.created < deadline]:
+        remove_spool(_spools.pop(token))
+
+
+def take_spool(token):
+    """Return the :class:`Spool` of ``token`` and unregister it.
+
+    Tokens are single use: the caller owns the file and must pass the spool
+    to :func:`remove_spool` once done. Return ``None`` for unknown or expired
+    tokens.
+    """
+    with _lock:
+        _purge_locked()
+        return _spools.pop(token, None)
+
+
+def iter_spooled_events(path):
+    """Yield the events recorded in the spool file at ``path``."""
+    with open(path, 'rb') as fh:
+        while True:
+            try:
+                batch = pickle.load(fh)
+            except EOFError:
+                return
+            yield from batch
+
+
+def remove_spool(spool):
+    """Delete the file of ``spool``."""
+    try:
+        os.remove(spool.path)
+    except OSError:
+        pass
@@ -0,0 +1,363 @@
+"""Import pipeline shared by the ``/import`` endpoint and background jobs."""
+
+import hashlib
+import tempfile
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy.exc import IntegrityError
+
+from . import config, models
+from .csv_utils import (
+    ExistingKeys,
+    bulk_insert_transactions,
+    insert_ignore_transactions,
+    iter_transaction_batches,
+)
+from .rule_matcher import get_rule_matcher
+
+# Result of a rule lookup for labels matched by no rule
+NO_RULE = (None, None, None, None)
+
+
+def hash_upload(stream, chunk_size=64 * 1024):
+    """Return ``(sha256, stream)`` for a binary upload.
+
+    Seekable streams are rewound after hashing; other streams are copied to
+    a spooled temporary file while they are read.
+    """
+    digest = hashlib.sha256()
+    if getattr(stream, 'seekable', lambda: False)():
+        start = stream.tell()
+        for chunk in iter(lambda: stream.read(chunk_size), b''):
+            digest.update(chunk)
+        stream.seek(start)
+        return digest.hexdigest(), stream
+    spool = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+    for chunk in iter(lambda: stream.read(chunk_size), b''):
+        digest.update(chunk)
+        spool.write(chunk)
+    spool.seek(0)
+    return digest.hexdigest(), spool
+
+
+class HashingReader:
+    """Binary stream wrapper computing the SHA-256 of the bytes read."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.digest = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.digest.update(data)
+        return data
+
+    def hexdigest(self):
+        return self.digest.hexdigest()
+
+
+def find_imported_file(session, sha256):
+    """Return the :class:`ImportFile` recorded for ``sha256`` or ``None``."""
+    return session.query(models.ImportFile).filter_by(sha256=sha256).first()
+
+
+def record_imported_file(session, sha256, account, filename='', rows=0):
+    """Remember that the file hashed as ``sha256`` was imported into ``account``."""
+    if find_imported_file(session, sha256):
+        return
+    session.add(models.ImportFile(
+        sha256=sha256,
+        bank_account_id=account.id,
+        filename=filename or '',
+        rows=rows,
+        imported_at=datetime.now(),
+    ))
+    try:
+        session.commit()
+    except IntegrityError:
+        # Recorded meanwhile by a concurrent import of the same file
+        session.rollback()
+
+
+def find_or_create_account(session, account_info):
+    """Return the bank account described by ``account_info``.
+
+    The account is matched on its type and number and created when missing.
+    Its export date (and name when provided) is refreshed and committed.
+    """
+    account = session.query(models.BankAccount).filter_by(
+        account_type=account_info.get('account_type'),
+        number=account_info.get('number'),
+    ).first()
+    if not account:
+        account = models.BankAccount(
+            account_type=account_info.get('account_type'),
+            number=account_info.get('number'),
+            export_date=account_info.get('export_date'),
+            name=account_info.get('name', ''),
+        )
+        if account_info.get('initial_balance') is not None:
+            account.initial_balance = account_info['initial_balance']
+            account.balance_date = account_info.get('balance_date')
+        session.add(account)
+        session.commit()
+    else:
+        account.export_date = account_info.get('export_date')
+        if account_info.get('name'):
+            account.name = account_info['name']
+        session.commit()
+    return account
+
+
+def account_payload(account):
+    """Return the JSON representation of ``account`` used in import responses."""
+    return {
+        'id': account.id,
+        'name': account.name,
+        'account_type': account.account_type,
+        'number': account.number,
+        'export_date': account.export_date.isoformat() if account.export_date else None,
+        'initial_balance': account.initial_balance,
+        'balance_date': account.balance_date.isoformat() if account.balance_date else None,
+    }
+
+
+def import_events(
+    session,
+    events,
+    account,
+    bulk=False,
+    chunk_size=None,
+    progress=None,
+    ignore_conflicts=False,
+    metrics=None,
+):
+    """Deduplicate, categorise and insert parsed transactions for ``account``.
+
+    ``events`` are the remaining events of :func:`iter_parse_csv` once the
+    account header was read. In bulk mode each chunk of ``chunk_size`` rows
+    is inserted with one ``INSERT`` and committed; otherwise the whole import
+    is committed at the end. With ``ignore_conflicts`` stored rows are not
+    looked up: chunks are inserted with ``ON CONFLICT DO NOTHING`` against
+    the unique transaction index and the rows missing from ``RETURNING`` are
+    reported as duplicates. ``progress`` is called as ``progress(phase,
+    rows, imported, duplicates, errors)`` while the import advances and
+    the phases are recorded on ``metrics``, an :class:`ImportMetrics`.
+
+    Return ``(imported, duplicates, errors)`` where duplicates lists the
+    in-file duplicates first, then the rows already stored.
+    """
+    if chunk_size is None:
+        chunked = bulk or ignore_conflicts
+        chunk_size = config.IMPORT_CHUNK_SIZE if chunked else config.IMPORT_BATCH_SIZE
+
+    def report(phase):
+        if metrics:
+            metrics.switch(phase)
+        if progress:
+            progress(phase, rows, imported, len(csv_duplicates) + len(db_duplicates), len(errors))
+
+    def duplicate(t):
+        return {
+            'date': t['date'].isoformat(),
+            'type': t['type'],
+            'payment_method': t['payment_method'],
+            'label': t['label'],
+            'amount': t['amount'],
+            'account_id': account.id,
+        }
+
+    imported = 0
+    rows = 0
+    csv_duplicates = []
+    db_duplicates = []
+    errors = []
+
+    if metrics:
+        metrics.switch('rules')
+    matcher = get_rule_matcher(session)
+    existing = ExistingKeys(session, account.id)
+
+    try:
+        report('parse')
+        batches = iter_transaction_batches(events, chunk_size, csv_duplicates, errors)
+        for batch in batches:
+            rows += len(batch)
+            if metrics:
+                metrics.add_rows('parse', len(batch))
+            fingerprints = [
+                models.transaction_fingerprint(t['date'], t['label'], t['amount'])
+                for t in batch
+            ]
+            if ignore_conflicts:
+                fresh = list(zip(batch, fingerprints))
+            else:
+                report('dedupe')
+                if metrics:
+                    metrics.add_rows('dedupe', len(batch))
+                existing.load(fingerprints)
+                fresh = []
+                for t, fingerprint in zip(batch, fingerprints):
+                    if (t['date'], t['label'], t['amount']) in existing:
+                        db_duplicates.append(duplicate(t))
+                        continue
+                    fresh.append((t, fingerprint))
+
+            report('rules')
+            if metrics:
+                metrics.add_rows('rules', len(fresh))
+            new_rows = []
+            for t, fingerprint in fresh:
+                rule = matcher.match(t['label']) or NO_RULE
+                new_rows.append({
+                    'date': t['date'],
+                    'tx_type': t['type'],
+                    'payment_method': t['payment_method'],
+                    'label': t['label'],
+                    'amount': t['amount'],
+                    'bank_account_id': account.id,
+                    'favorite': False,
+                    'category_id': rule[2],
+                    'subcategory_id': rule[3],
+                    'rule_id': rule[0],
+                    'reconciled': t['reconciled'],
+                    'to_analyze': t['to_analyze'],
+                    'fingerprint': fingerprint,
+                })
+
+            report('insert')
+            if metrics:
+                metrics.add_rows('insert', len(new_rows))
+            if ignore_conflicts:
+                inserted = Counter(insert_ignore_transactions(session, new_rows))
+                for t, _ in fresh:
+                    key = (t['date'], t['label'], t['amount'])
+                    if inserted[key]:
+                        inserted[key] -= 1
+                        imported += 1
+                    else:
+                        db_duplicates.append(duplicate(t))
+            elif bulk:
+                # Each chunk is committed so rows inserted so far are kept
+                imported += bulk_insert_transactions(session, new_rows)
+            else:
+                # Flush each batch so pending objects do not pile up in the session
+                with models.deferred_label_index(session):
+                    session.add_all(models.Transaction(**row) for row in new_rows)
+                    session.flush()
+                imported += len(new_rows)
+            report('parse')
+        if metrics:
+            metrics.switch('commit')
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        errors.append(str(e))
+    return imported, csv_duplicates + db_duplicates, errors
+
+
+def insert_confirmed(session, transactions, account_id, chunk_size=None, metrics=None):
+    """Insert transactions confirmed by the user for ``account_id``.
+
+    ``transactions`` are ``(position, dict)`` pairs, the dictionaries having
+    the keys of the parser transactions and ``position`` being reported in
+    errors. Rows already stored, or repeated, are skipped. Rows are inserted
+    ``chunk_size`` at a time, each chunk in a savepoint: a chunk that fails
+    is rolled back and reported while the other chunks are kept. The phases
+    are recorded on ``metrics``, an :class:`ImportMetrics`, when given.
+
+    Return ``(imported, errors)``.
+    """
+
+    def phase(name, rows):
+        if metrics:
+            metrics.switch(name)
+            metrics.add_rows(name, rows)
+
+    chunk_size = chunk_size or config.IMPORT_CHUNK_SIZE
+    phase('dedupe', len(transactions))
+    matcher = get_rule_matcher(session)
+    fingerprints = [
+        models.transaction_fingerprint(t['date'], t['label'], t['amount'])
+        for _, t in transactions
+    ]
+    existing = ExistingKeys(session, account_id)
+    existing.load(fingerprints)
+
+    fresh = []
+    for (position, t), fingerprint in zip(transactions, fingerprints):
+        key = (t['date'], t['label'], t['amount'])
+        if key in existing:
+            continue
+        existing.add(key)
+        fresh.append((position, t, fingerprint))
+
+    phase('rules', len(fresh))
+    positions = []
+    new_rows = []
+    for position, t, fingerprint in fresh:
+        rule = matcher.match(t['label']) or NO_RULE
+        positions.append(position)
+        new_rows.append({
+            'date': t['date'],
+            'tx_type': t['type'],
+            'payment_method': t['payment_method'],
+            'label': t['label'],
+            'amount': t['amount'],
+            'bank_account_id': account_id,
+            'favorite': False,
+            'category_id': rule[2],
+            'subcategory_id': rule[3],
+            'rule_id': rule[0],
+            'reconciled': False,
+            'to_analyze': True,
+            'fingerprint': fingerprint,
+        })
+
+    phase('insert', len(new_rows))
+    imported = 0
+    errors = []
+    table = models.Transaction.__table__
+    for start in range(0, len(new_rows), chunk_size):
+        chunk = new_rows[start:start + chunk_size]
+        try:
+            with session.begin_nested(), models.deferred_label_index(session):
+                session.execute(table.insert(), chunk)
+        except Exception as e:
+            first, last = positions[start], positions[start + len(chunk) - 1]
+            errors.append(f'Lignes {first} à {last} : {getattr(e, "orig", None) or e}')
+            continue
+        imported += len(chunk)
+    phase('commit', 0)
+    session.commit()
+    return imported, errors
+
+
+def already_imported_response(record):
+    """Return the ``/import`` payload for a file that was already imported."""
+    return {
+        'imported': 0,
+        'account': account_payload(record.account),
+        'already_imported': True,
+    }
+
+
+def import_response(imported, account, duplicates, errors):
+    """Return the ``/import`` JSON payload and its HTTP status code."""
+    response = {
+        'imported': imported,
+        'account': account,
+    }
+    if duplicates:
+        response['duplicates'] = [
+            {
+                **d,
+                'date': d['date'].isoformat() if hasattr(d['date'], 'isoformat') else d['date'],
+            }
+            for d in duplicates
+        ]
+    if errors:
+        response['errors'] = errors
+        return response, 400
+    return response, 200
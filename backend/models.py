@@ -5,18 +5,30 @@ from sqlalchemy import (
     String,
     Float,
     Date,
+    DateTime,
     Boolean,
     ForeignKey,
+    Index,
     JSON,
     text,
+    bindparam,
     event,
+    func,
     inspect,
+    select,
+    column,
+    table,
 )
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import declarative_base, relationship, sessionmaker
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash
+import hashlib
+import logging
 import os
 import json
+import re
+from contextlib import contextmanager
 
 from . import config
 
@@ -103,6 +115,141 @@ class BankAccount(Base):
         back_populates='account',
         cascade='all, delete-orphan'
     )
+    import_files = relationship(
+        'ImportFile',
+        back_populates='account',
+        cascade='all, delete-orphan'
+    )
+
+
+def transaction_fingerprint(date, label, amount):
+    """Return a signed 64-bit hash of the ``(date, label, amount)`` key."""
+    data = f'{date.isoformat()}\x1f{label}\x1f{float(amount)!r}'.encode('utf-8')
+    digest = hashlib.blake2b(data, digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+
+# Columns of the optional unique index created by init_db
+UNIQUE_TRANSACTION_COLUMNS = ('bank_account_id', 'date', 'label', 'amount')
+UNIQUE_TRANSACTION_INDEX = 'ux_transactions_account_key'
+
+
+def has_unique_transaction_index(bind):
+    """Return whether the unique transaction index exists."""
+    row = bind.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = :name"),
+        {'name': UNIQUE_TRANSACTION_INDEX},
+    ).first()
+    return row is not None
+
+
+# Label with its digits masked: labels differing by their digits alone (dates,
+# card or cheque numbers) share it. Uncategorised transactions are indexed on
+# it so that the rule suggestions count them by label without reading them
+MASKED_LABEL = 'label'
+for _digit in '123456789':
+    MASKED_LABEL = f"replace({MASKED_LABEL}, '{_digit}', '0')"
+
+# FTS5 table indexing transaction labels by trigrams, kept in sync by triggers
+TRANSACTION_FTS_TABLE = 'transactions_fts'
+# A row in this table suspends the insert trigger, see deferred_label_index()
+TRANSACTION_FTS_DEFERRED_TABLE = 'transactions_fts_deferred'
+_TRANSACTION_FTS_TRIGGERS = {
+    'transactions_fts_insert': (
+        'AFTER INSERT ON transactions '
+        'WHEN NOT EXISTS (SELECT 1 FROM transactions_fts_deferred) BEGIN '
+        'INSERT INTO transactions_fts (rowid, label) VALUES (new.id, new.label); END'
+    ),
+    'transactions_fts_delete': (
+        'AFTER DELETE ON transactions BEGIN '
+        "INSERT INTO transactions_fts (transactions_fts, rowid, label) "
+        "VALUES ('delete', old.id, old.label); END"
+    ),
+    'transactions_fts_update': (
+        'AFTER UPDATE OF label ON transactions BEGIN '
+        "INSERT INTO transactions_fts (transactions_fts, rowid, label) "
+        "VALUES ('delete', old.id, old.label); "
+        'INSERT INTO transactions_fts (rowid, label) VALUES (new.id, new.label); END'
+    ),
+}
+
+
+def has_transaction_fts(bind):
+    """Return whether the trigram index of transaction labels exists."""
+    row = bind.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+        {'name': TRANSACTION_FTS_TABLE},
+    ).first()
+    return row is not None
+
+
+@contextmanager
+def deferred_label_index(session):
+    """Index the labels of the transactions inserted in the block at its end.
+
+    Indexing rows one at a time from the trigger is several times slower than
+    a single ``INSERT ... SELECT``, so bulk inserts suspend the trigger for
+    their transaction. The flag row is written first: the write lock is then
+    held and the new transactions are those above the largest id read next.
+    On error the caller rolls back, which also removes the flag.
+    """
+    if not has_transaction_fts(session):
+        yield
+        return
+    session.execute(text(f'INSERT INTO {TRANSACTION_FTS_DEFERRED_TABLE} VALUES (1)'))
+    last_id = session.execute(select(func.max(Transaction.id))).scalar() or 0
+    yield
+    session.execute(
+        text(
+            f'INSERT INTO {TRANSACTION_FTS_TABLE} (rowid, label) '
+            'SELECT id, label FROM transactions WHERE id > :last_id'
+        ),
+        {'last_id': last_id},
+    )
+    session.execute(text(f'DELETE FROM {TRANSACTION_FTS_DEFERRED_TABLE}'))
+
+
+def _uses_label_index(bind, pattern):
+    """Return whether ``LIKE pattern`` is evaluated through the trigram index.
+
+    SQLite 3.40 finds no row for a segment of fewer than three characters
+    spanning three bytes or more (``fé``). Such segments gain nothing from
+    the index anyway, so patterns containing one scan the labels.
+    """
+    if any(len(segment) < 3 for segment in re.split('[%_]', pattern) if segment):
+        return False
+    return has_transaction_fts(bind)
+
+
+def label_matches(bind, pattern):
+    """Return a subquery of the ``id`` of transactions whose label is ``LIKE pattern``.
+
+    The comparison ignores case. Joined on the transaction id, the subquery
+    lets SQLite stop reading the trigram index early, e.g. with ``LIMIT``.
+    """
+    if _uses_label_index(bind, pattern):
+        fts = table(TRANSACTION_FTS_TABLE, column('rowid'), column('label'))
+        query = select(fts.c.rowid.label('id')).where(fts.c.label.like(pattern.lower()))
+    else:
+        query = select(Transaction.id).where(func.lower(Transaction.label).like(pattern.lower()))
+    return query.subquery()
+
+
+def label_like(bind, pattern):
+    """Return a filter on transactions whose label is ``LIKE pattern``.
+
+    The comparison ignores case. When the trigram index exists and every
+    segment of the pattern has three characters or more, the matching rows
+    are looked up in it; otherwise every label is scanned.
+    """
+    if _uses_label_index(bind, pattern):
+        return Transaction.id.in_(select(label_matches(bind, pattern).c.id))
+    return func.lower(Transaction.label).like(pattern.lower())
+
+
+def _default_fingerprint(context):
+    params = context.get_current_parameters()
+    return transaction_fingerprint(params['date'], params['label'], params['amount'])
 
 
 class Transaction(Base):
@@ -120,6 +267,19 @@ class Transaction(Base):
     subcategory_id = Column(Integer, ForeignKey('subcategories.id'))
     reconciled = Column(Boolean, default=False)
     to_analyze = Column(Boolean, default=True)
+    # Hash of (date, label, amount) used to find duplicates through an index
+    fingerprint = Column(Integer, default=_default_fingerprint)
+    # Rule which set the category, cleared when the category is edited by hand
+    rule_id = Column(Integer, ForeignKey('rules.id', ondelete='SET NULL'), index=True)
+
+    __table_args__ = (
+        Index('ix_transactions_account_fingerprint', 'bank_account_id', 'fingerprint'),
+        # Uncategorised transactions by masked label, read by the rule suggestions
+        Index(
+            'ix_transactions_uncategorised', text(MASKED_LABEL),
+            sqlite_where=text('category_id IS NULL'),
+        ),
+    )
 
     category = relationship('Category', back_populates='transactions')
     subcategory = relationship('Subcategory', back_populates='transactions')
@@ -167,6 +327,131 @@ class ImportPreset(Base):
     id = Column(Integer, primary_key=True)
     name = Column(String, unique=True, nullable=False)
     mapping = Column(JSON, nullable=False)
+    # Encoding detected on the first import, reused to skip detection
+    encoding = Column(String)
+    # Hash of the delimiter and header columns, used to select the preset
+    signature = Column(String, index=True)
+
+
+class ImportFile(Base):
+    """Content hash of a file whose import completed without errors."""
+
+    __tablename__ = 'import_files'
+
+    id = Column(Integer, primary_key=True)
+    sha256 = Column(String(64), unique=True, nullable=False)
+    bank_account_id = Column(
+        Integer, ForeignKey('bank_accounts.id', ondelete='CASCADE'), nullable=False
+    )
+    filename = Column(String, default='')
+    rows = Column(Integer, default=0)
+    imported_at = Column(DateTime)
+
+    account = relationship('BankAccount', back_populates='import_files')
+
+
+class ImportJob(Base):
+    """Progress of a background CSV import."""
+
+    __tablename__ = 'import_jobs'
+
+    id = Column(String, primary_key=True)
+    filename = Column(String, default='')
+    phase = Column(String, nullable=False, default='queued')
+    rows_processed = Column(Integer, default=0)
+    imported = Column(Integer, default=0)
+    duplicates = Column(Integer, default=0)
+    errors = Column(Integer, default=0)
+    result = Column(JSON)
+    status_code = Column(Integer)
+    created_at = Column(DateTime)
+    updated_at = Column(DateTime)
+
+
+def _backfill_fingerprints(batch_size=1000):
+    """Compute the fingerprint of transactions stored before it existed."""
+    session = SessionLocal()
+    try:
+        while True:
+            rows = (
+                session.query(Transaction.id, Transaction.date, Transaction.label, Transaction.amount)
+                .filter(Transaction.fingerprint.is_(None))
+                .limit(batch_size)
+                .all()
+            )
+            if not rows:
+                break
+            session.execute(
+                Transaction.__table__.update()
+                .where(Transaction.id == bindparam('tx_id'))
+                .values(fingerprint=bindparam('fp')),
+                [
+                    {'tx_id': tx_id, 'fp': transaction_fingerprint(d, label, amount)}
+                    for tx_id, d, label, amount in rows
+                ],
+            )
+            session.commit()
+    finally:
+        session.close()
+
+
+def _sync_unique_transaction_index():
+    """Create or drop the unique transaction index per ``UNIQUE_TRANSACTIONS``.
+
+    The index is not created while duplicate rows are stored.
+    """
+    columns = ', '.join(UNIQUE_TRANSACTION_COLUMNS)
+    with engine.begin() as conn:
+        if not config.UNIQUE_TRANSACTIONS:
+            conn.execute(text(f'DROP INDEX IF EXISTS {UNIQUE_TRANSACTION_INDEX}'))
+            return
+        if has_unique_transaction_index(conn):
+            return
+        duplicate = conn.execute(text(
+            'SELECT 1 FROM transactions WHERE bank_account_id IS NOT NULL '
+            f'GROUP BY {columns} HAVING COUNT(*) > 1 LIMIT 1'
+        )).first()
+        if duplicate:
+            logging.warning(
+                'Duplicate transactions found; unique index %s not created',
+                UNIQUE_TRANSACTION_INDEX,
+            )
+            return
+        conn.execute(text(
+            f'CREATE UNIQUE INDEX {UNIQUE_TRANSACTION_INDEX} ON transactions ({columns})'
+        ))
+
+
+def _sync_transaction_fts():
+    """Create or drop the trigram index of labels per ``LABEL_SEARCH_INDEX``.
+
+    Labels stored beforehand are indexed when the table is created. Nothing
+    is created when SQLite lacks FTS5 or its trigram tokenizer.
+    """
+    with engine.begin() as conn:
+        if not config.LABEL_SEARCH_INDEX:
+            for name in _TRANSACTION_FTS_TRIGGERS:
+                conn.execute(text(f'DROP TRIGGER IF EXISTS {name}'))
+            conn.execute(text(f'DROP TABLE IF EXISTS {TRANSACTION_FTS_TABLE}'))
+            conn.execute(text(f'DROP TABLE IF EXISTS {TRANSACTION_FTS_DEFERRED_TABLE}'))
+            return
+        if not has_transaction_fts(conn):
+            try:
+                conn.execute(text(
+                    f'CREATE VIRTUAL TABLE {TRANSACTION_FTS_TABLE} USING fts5('
+                    "label, content='transactions', content_rowid='id', tokenize='trigram')"
+                ))
+            except OperationalError:
+                logging.warning('SQLite FTS5 trigram tokenizer unavailable; labels are not indexed')
+                return
+            conn.execute(text(
+                f"INSERT INTO {TRANSACTION_FTS_TABLE} ({TRANSACTION_FTS_TABLE}) VALUES ('rebuild')"
+            ))
+        conn.execute(text(
+            f'CREATE TABLE IF NOT EXISTS {TRANSACTION_FTS_DEFERRED_TABLE} (deferred INTEGER)'
+        ))
+        for name, body in _TRANSACTION_FTS_TRIGGERS.items():
+            conn.execute(text(f'CREATE TRIGGER IF NOT EXISTS {name} {body}'))
 
 
 def init_db():
@@ -197,6 +482,21 @@ def init_db():
             conn.execute(text('ALTER TABLE transactions ADD COLUMN bank_account_id INTEGER'))
         if 'favorite' not in cols:
             conn.execute(text('ALTER TABLE transactions ADD COLUMN favorite INTEGER DEFAULT 0'))
+        if 'fingerprint' not in cols:
+            conn.execute(text('ALTER TABLE transactions ADD COLUMN fingerprint INTEGER'))
+        conn.execute(text(
+            'CREATE INDEX IF NOT EXISTS ix_transactions_account_fingerprint '
+            'ON transactions (bank_account_id, fingerprint)'
+        ))
+        if 'rule_id' not in cols:
+            conn.execute(text('ALTER TABLE transactions ADD COLUMN rule_id INTEGER'))
+        conn.execute(text(
+            'CREATE INDEX IF NOT EXISTS ix_transactions_rule_id ON transactions (rule_id)'
+        ))
+        conn.execute(text(
+            'CREATE INDEX IF NOT EXISTS ix_transactions_uncategorised '
+            f'ON transactions ({MASKED_LABEL}) WHERE category_id IS NULL'
+        ))
 
         info = conn.execute(text('PRAGMA table_info(categories)')).fetchall()
         cols = {row[1] for row in info}
@@ -224,6 +524,21 @@ def init_db():
         if 'balance_date' not in cols:
             conn.execute(text('ALTER TABLE bank_accounts ADD COLUMN balance_date DATE'))
 
+        info = conn.execute(text('PRAGMA table_info(import_presets)')).fetchall()
+        cols = {row[1] for row in info}
+        if 'encoding' not in cols:
+            conn.execute(text('ALTER TABLE import_presets ADD COLUMN encoding TEXT'))
+        if 'signature' not in cols:
+            conn.execute(text('ALTER TABLE import_presets ADD COLUMN signature TEXT'))
+        conn.execute(text(
+            'CREATE INDEX IF NOT EXISTS ix_import_presets_signature '
+            'ON import_presets (signature)'
+        ))
+
+    _backfill_fingerprints()
+    _sync_unique_transaction_index()
+    _sync_transaction_fts()
+
     # Create a default user if none exists
     session = SessionLocal()
     if not session.query(User).first():
@@ -0,0 +1,185 @@
+"""Parse one very large CSV file with several processes.
+
+The file is memory-mapped and cut into chunks ending at newlines. The
+account header and the value formats are read once from the start of the
+file, then each chunk is parsed in a process pool. Results are merged in
+file order: line numbers are shifted by the lines of the previous chunks
+and rows repeating a row of an earlier chunk become duplicates, so the
+result is the one :func:`csv_utils.parse_csv` gives.
+
+Chunks are cut at ``\\n`` bytes, so only ASCII-compatible encodings are
+split and quoted fields spanning several lines are not supported; other
+files are parsed sequentially.
+"""
+
+import codecs
+import csv
+import mmap
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from . import config
+from .csv_utils import (
+    DEFAULT_MAPPING,
+    ENCODING_SAMPLE_SIZE,
+    FORMAT_SAMPLE_SIZE,
+    _parse_account_header,
+    ascii_compatible,
+    detect_encoding,
+    detect_value_formats,
+    iter_row_events,
+    parse_csv,
+)
+
+# Bytes decoded after the header to choose the value converters
+_FORMAT_SAMPLE_BYTES = 64 * 1024
+
+_LINE_PREFIX = re.compile(r'^Ligne (\d+)')
+
+
+def _line_end(mm, pos, count):
+    """Return the offset following the ``count`` lines starting at ``pos``."""
+    for _ in range(count):
+        end = mm.find(b'\n', pos)
+        if end < 0:
+            return len(mm)
+        pos = end + 1
+    return pos
+
+
+def split_chunks(mm, start, chunk_size):
+    """Return ``(start, end)`` byte ranges of about ``chunk_size`` ending at newlines."""
+    chunks = []
+    size = len(mm)
+    while start < size:
+        end = mm.find(b'\n', min(start + chunk_size, size) - 1)
+        end = size if end < 0 else end + 1
+        chunks.append((start, end))
+        start = end
+    return chunks
+
+
+def parse_chunk(path, start, end, mapping, formats, encoding):
+    """Parse bytes ``start:end`` of ``path``; run in worker processes.
+
+    Return ``(lines, transactions, duplicates, errors)`` with line numbers
+    relative to the chunk. ``transactions`` holds ``(line_no, dict)`` pairs
+    so that duplicates of earlier chunks can be reported with their line.
+    """
+    with open(path, 'rb') as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        text = mm[start:end].decode(encoding)
+
+    position = 0
+
+    def numbered(rows):
+        nonlocal position
+        for row in rows:
+            position += 1
+            yield row
+
+    transactions = []
+    duplicates = []
+    errors = []
+    rows = numbered(csv.reader(text.splitlines(), delimiter=';'))
+    # With the formats given, each event concerns the last row read
+    for kind, value in iter_row_events(rows, mapping, start_line=1, formats=formats):
+        if kind == 'transaction':
+            transactions.append((position, value))
+        elif kind == 'duplicate':
+            duplicates.append(value)
+        else:
+            errors.append(value)
+    return position, transactions, duplicates, errors
+
+
+def _shift(message, offset):
+    return _LINE_PREFIX.sub(lambda m: f'Ligne {int(m.group(1)) + offset}', message, count=1)
+
+
+def merge_chunks(results, first_line=0):
+    """Merge :func:`parse_chunk` results, in file order.
+
+    ``first_line`` is the number of lines before the first chunk. Return
+    ``(transactions, duplicates, errors)``.
+    """
+    seen = set()
+    transactions = []
+    duplicates = []
+    errors = []
+    offset = first_line
+    for lines, chunk_transactions, chunk_duplicates, chunk_errors in results:
+        found = [{**d, 'line_no': d['line_no'] + offset} for d in chunk_duplicates]
+        for line_no, t in chunk_transactions:
+            key = (t['date'], t['label'], t['amount'])
+            if key in seen:
+                # Already present in an earlier chunk
+                found.append({
+                    'line_no': line_no + offset,
+                    'date': t['date'],
+                    'type': t['type'],
+                    'payment_method': t['payment_method'],
+                    'label': t['label'],
+                    'amount': t['amount'],
+                })
+                continue
+            seen.add(key)
+            transactions.append(t)
+        found.sort(key=lambda d: d['line_no'])
+        duplicates.extend(found)
+        errors.extend(_shift(e, offset) for e in chunk_errors)
+        offset += lines
+    return transactions, duplicates, errors
+
+
+def parse_csv_parallel(path, mapping=None, encoding=None, workers=None, chunk_size=None):
+    """Parse the CSV file at ``path`` like :func:`csv_utils.parse_csv`, in parallel.
+
+    ``encoding`` is detected from the start of the file when omitted.
+    ``workers`` defaults to ``IMPORT_PROCESSES`` (one per CPU when 0) and
+    ``chunk_size`` to ``IMPORT_PARALLEL_CHUNK_SIZE`` bytes. Files that cannot
+    be split, or fit in a single chunk, are parsed sequentially.
+    """
+    if mapping is None:
+        mapping = DEFAULT_MAPPING
+    chunk_size = chunk_size or config.IMPORT_PARALLEL_CHUNK_SIZE
+    workers = workers or config.IMPORT_PROCESSES or os.cpu_count() or 1
+
+    with open(path, 'rb') as fh:
+        if os.fstat(fh.fileno()).st_size == 0:
+            return parse_csv(fh, mapping=mapping, encoding=encoding or 'utf-8')
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if encoding is None:
+                encoding = detect_encoding(mm[:ENCODING_SAMPLE_SIZE])
+            if not ascii_compatible(encoding) or mm.find(b'\n') < 0:
+                fh.seek(0)
+                return parse_csv(fh, mapping=mapping, encoding=encoding)
+
+            # The account header is read from the first three lines
+            head_end = _line_end(mm, 0, 3)
+            head = list(csv.reader(mm[:head_end].decode(encoding).splitlines(), delimiter=';'))
+            account_info, header_mode = _parse_account_header(head)
+            first_line = 3 if header_mode else 1
+            data_start = _line_end(mm, 0, first_line)
+
+            # The BOM, if any, belongs to the header
+            if codecs.lookup(encoding).name == 'utf-8-sig':
+                encoding = 'utf-8'
+            sample = mm[data_start:data_start + _FORMAT_SAMPLE_BYTES]
+            if data_start + len(sample) < len(mm):
+                sample = sample[:sample.rfind(b'\n') + 1]
+            rows = csv.reader(sample.decode(encoding, errors='replace').splitlines(), delimiter=';')
+            formats = detect_value_formats(list(islice(rows, FORMAT_SAMPLE_SIZE)), mapping)
+            chunks = split_chunks(mm, data_start, chunk_size)
+
+    args = [(path, start, end, mapping, formats, encoding) for start, end in chunks]
+    workers = min(workers, len(args))
+    if workers <= 1:
+        results = [parse_chunk(*a) for a in args]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(parse_chunk, *a) for a in args]
+            results = [f.result() for f in futures]
+    transactions, duplicates, errors = merge_chunks(results, first_line)
+    return transactions, duplicates, errors, account_info
@@ -10,8 +10,41 @@ import re
 from difflib import SequenceMatcher
 
 from .app import app, load_categories_json, save_categories_json
-from . import models
-from .csv_utils import parse_csv, apply_rule_to_transactions, detect_csv_structure
+from . import config, models
+from .csv_utils import (
+    ExistingKeys,
+    apply_rule_to_transactions,
+    detect_stream_structure,
+    header_signature,
+    iter_transaction_batches,
+    parse_iso_date,
+    sniff_encoding,
+)
+from .batch_import import import_batch
+from .importer import (
+    HashingReader,
+    account_payload,
+    already_imported_response,
+    find_imported_file,
+    find_or_create_account,
+    hash_upload,
+    import_events,
+    import_response,
+    insert_confirmed,
+    record_imported_file,
+)
+from .import_jobs import import_job_payload, submit_import_job
+from .import_metrics import ImportMetrics
+from .import_spool import SpoolWriter, iter_spooled_events, remove_spool, take_spool
+from .rule_matcher import (
+    invalidate_rule_matcher,
+    preview_rule,
+    reapply_rules,
+    update_rule_transactions,
+)
+from .rule_suggestions import suggest_rules
+from .statements import iter_parse_statement, sniff_format
+from .xlsx_import import detect_xlsx_structure
 
 logger = logging.getLogger(__name__)
 
@@ -34,6 +67,107 @@ def _parse_account_ids():
     return ids
 
 
+def _import_options(stream, auto_preset=True):
+    """Return ``(mapping, encoding, stream, preset)`` for an uploaded file.
+
+    The mapping comes from the ``mapping`` form field, or from the preset
+    selected with ``preset_id``. Without either, the preset whose header
+    signature matches the file is used when ``auto_preset`` is set. The
+    encoding stored on the preset is reused; otherwise it is detected from
+    the start of ``stream`` and saved on the preset, like the signature.
+    ``preset`` describes the preset used, if any. Return ``None`` when the
+    requested preset does not exist. Presets apply to CSV and XLSX files,
+    not to CAMT.053 and OFX statements.
+    """
+    mapping = None
+    if 'mapping' in request.form:
+        try:
+            mapping = json.loads(request.form['mapping'])
+        except Exception:
+            mapping = None
+
+    fmt, stream = sniff_format(stream)
+    if fmt in ('camt', 'ofx'):
+        return mapping, 'utf-8', stream, None
+
+    session = models.SessionLocal()
+    try:
+        preset = None
+        if request.form.get('preset_id'):
+            try:
+                preset = session.query(models.ImportPreset).get(int(request.form['preset_id']))
+            except ValueError:
+                preset = None
+            if not preset:
+                return None
+
+        if preset and preset.encoding:
+            encoding = preset.encoding
+        elif fmt == 'xlsx':
+            encoding = 'utf-8'
+        else:
+            encoding, stream = sniff_encoding(stream)
+
+        need_signature = (preset is None and mapping is None and auto_preset) or (
+            preset is not None and not preset.signature
+        )
+        if need_signature and getattr(stream, 'seekable', lambda: False)():
+            try:
+                _, _, signature = _upload_structure(stream, encoding, fmt)
+            except ValueError:
+                # Reported when the file is parsed
+                signature = None
+            if preset is not None:
+                preset.signature = signature
+            elif signature:
+                preset = _find_preset(session, signature)
+                if preset and preset.encoding:
+                    encoding = preset.encoding
+
+        if preset is None:
+            return mapping, encoding, stream, None
+        if mapping is None:
+            mapping = preset.mapping or None
+        if not preset.encoding and fmt == 'csv':
+            preset.encoding = encoding
+        session.commit()
+        return mapping, encoding, stream, {'id': preset.id, 'name': preset.name}
+    finally:
+        session.close()
+
+
+def _upload_structure(stream, encoding, fmt):
+    """Return ``(structure, rows, signature)`` for the start of a CSV or XLSX file.
+
+    ``rows`` are the first rows split in cells. XLSX layouts are signed with
+    ``'xlsx'`` in place of the delimiter.
+    """
+    if fmt == 'xlsx':
+        structure, rows = detect_xlsx_structure(stream)
+        return structure, rows, header_signature('xlsx', structure[3])
+    structure, lines = detect_stream_structure(stream, encoding)
+    rows = [line.split(structure[0]) for line in lines]
+    return structure, rows, header_signature(structure[0], structure[3])
+
+
+def _wants_timings():
+    """Return ``True`` when the request asks for the ``timings`` of an import."""
+    value = request.values.get('timings')
+    if value is None and request.is_json:
+        value = (request.get_json(silent=True) or {}).get('timings')
+    return str(value).lower() in ('true', '1', 'yes')
+
+
+def _find_preset(session, signature):
+    """Return the preset recorded for a header ``signature``, if any."""
+    return (
+        session.query(models.ImportPreset)
+        .filter_by(signature=signature)
+        .order_by(models.ImportPreset.id)
+        .first()
+    )
+
+
 @app.route('/')
 def index():
     return app.send_static_file('index.html')
@@ -209,7 +343,7 @@ def account_detail(account_id):
 @app.route('/import/preset', methods=['POST'])
 @login_required
 def import_preset():
-    """Return CSV columns and sample rows without inserting data."""
+    """Return CSV or XLSX columns and sample rows without inserting data."""
     if 'file' not in request.files:
         return jsonify({'error': 'Aucun fichier fourni'}), 400
 
@@ -217,31 +351,57 @@ def import_preset():
     if file.filename == '':
         return jsonify({'error': 'Aucun fichier fourni'}), 400
 
+    options = _import_options(file.stream, auto_preset=False)
+    if options is None:
+        return jsonify({'error': 'Not found'}), 404
+    _, encoding, stream, preset = options
+    fmt, stream = sniff_format(stream)
+    if fmt in ('camt', 'ofx'):
+        # XML statements describe their own fields
+        return jsonify({
+            'columns': [],
+            'preview': [],
+            'delimiter': None,
+            'signature': None,
+            'preset': None,
+            'format': fmt,
+        })
     try:
-        content = file.stream.read().decode('utf-8')
+        structure, rows, signature = _upload_structure(stream, encoding, fmt)
     except Exception as e:
         return jsonify({'error': str(e)}), 400
 
-    delimiter, header_idx, data_start_idx, columns = detect_csv_structure(content)
-    lines = content.splitlines()
+    delimiter, header_idx, data_start_idx, columns = structure
+    if preset is None and signature:
+        session = models.SessionLocal()
+        match = _find_preset(session, signature)
+        if match:
+            preset = {'id': match.id, 'name': match.name}
+        session.close()
     start = data_start_idx
     preview = []
-    for row in lines[start:start + 5]:
-        if not row.strip():
+    for row in rows[start:start + 5]:
+        if not ''.join(row).strip():
             continue
-        preview.append([c.strip() for c in row.split(delimiter)])
+        preview.append([c.strip() for c in row])
 
-    if not columns and start < len(lines):
-        col_count = len(lines[start].split(delimiter))
-        columns = [f'Colonne {i}' for i in range(1, col_count + 1)]
+    if not columns and start < len(rows):
+        columns = [f'Colonne {i}' for i in range(1, len(rows[start]) + 1)]
 
-    return jsonify({'columns': columns, 'preview': preview})
+    return jsonify({
+        'columns': columns,
+        'preview': preview,
+        'delimiter': delimiter,
+        'signature': signature,
+        'preset': preset,
+        'format': fmt,
+    })
 
 
 @app.route('/import/preview', methods=['POST'])
 @login_required
 def import_preview():
-    """Return a preview of CSV transactions without inserting them."""
+    """Return a preview of statement transactions without inserting them."""
     if 'file' not in request.files:
         return jsonify({'error': 'Aucun fichier fourni'}), 400
 
@@ -249,51 +409,83 @@ def import_preview():
     if file.filename == '':
         return jsonify({'error': 'Aucun fichier fourni'}), 400
 
-    mapping = None
-    if 'mapping' in request.form:
-        try:
-            mapping = json.loads(request.form['mapping'])
-        except Exception:
-            mapping = None
+    metrics = ImportMetrics()
+    metrics.switch('read')
+    metrics.watch(models.engine)
+    try:
+        return _preview_upload(file, metrics)
+    finally:
+        metrics.stop()
+
 
+def _preview_upload(file, metrics):
+    """Build the :func:`import_preview` response for an uploaded ``file``."""
+    options = _import_options(file.stream)
+    if options is None:
+        return jsonify({'error': 'Not found'}), 404
+    mapping, encoding, stream, preset = options
+    fmt, stream = sniff_format(stream)
+
+    # Parsed events are spooled so that /import can reuse them with a token
+    reader = HashingReader(stream)
+    spool = SpoolWriter()
+    events = spool.wrap(
+        iter_parse_statement(reader, mapping=mapping, encoding=encoding, fmt=fmt)
+    )
+    metrics.switch('parse')
     try:
-        content = file.stream.read().decode('utf-8')
+        _, account_info = next(events)
     except Exception as e:
+        spool.discard()
         return jsonify({'error': str(e)}), 400
 
-    transactions, csv_duplicates, csv_errors, account_info = parse_csv(
-        content, mapping=mapping
-    )
-    errors = list(csv_errors)
-
     session = models.SessionLocal()
-    duplicates = list(csv_duplicates)
+    token = None
+    transactions = []
+    csv_duplicates = []
+    db_duplicates = []
+    errors = []
     account = session.query(models.BankAccount).filter_by(
         account_type=account_info.get('account_type'),
         number=account_info.get('number'),
     ).first()
-    if account:
-        for t in transactions:
-            exists = (
-                session.query(models.Transaction)
-                .filter_by(
-                    date=t['date'],
-                    label=t['label'],
-                    amount=t['amount'],
-                    bank_account_id=account.id,
-                )
-                .first()
-            )
-            if exists:
-                duplicates.append({
-                    'date': t['date'],
-                    'type': t['type'],
-                    'payment_method': t['payment_method'],
-                    'label': t['label'],
-                    'amount': t['amount'],
-                    'account_id': account.id,
-                })
-    session.close()
+    existing = ExistingKeys(session, account.id) if account else None
+    try:
+        batches = iter_transaction_batches(
+            events, config.IMPORT_BATCH_SIZE, csv_duplicates, errors
+        )
+        for batch in batches:
+            metrics.add_rows('parse', len(batch))
+            transactions.extend(batch[:5 - len(transactions)])
+            if not existing:
+                continue
+            metrics.switch('dedupe')
+            metrics.add_rows('dedupe', len(batch))
+            existing.load_for(batch)
+            for t in batch:
+                if (t['date'], t['label'], t['amount']) in existing:
+                    db_duplicates.append({
+                        'date': t['date'],
+                        'type': t['type'],
+                        'payment_method': t['payment_method'],
+                        'label': t['label'],
+                        'amount': t['amount'],
+                        'account_id': account.id,
+                    })
+            metrics.switch('parse')
+    except UnicodeDecodeError as e:
+        errors.append(str(e))
+        spool.discard()
+    else:
+        metrics.switch('spool')
+        token = spool.commit(
+            sha256=reader.hexdigest(),
+            filename=file.filename,
+            preset=preset,
+        )
+    finally:
+        session.close()
+    duplicates = csv_duplicates + db_duplicates
 
     preview_rows = [
         {
@@ -302,10 +494,11 @@ def import_preview():
             if hasattr(t['date'], 'isoformat')
             else t['date'],
         }
-        for t in transactions[:5]
+        for t in transactions
     ]
 
     response = {
+        'format': fmt,
         'transactions': preview_rows,
         'account': {
             'id': account.id if account else None,
@@ -333,18 +526,162 @@ def import_preview():
         ]
     if errors:
         response['errors'] = errors
+    if preset:
+        response['preset'] = preset
+    if token:
+        response['token'] = token
+    metrics.log(
+        logger, 'preview', format=fmt, account_id=response['account']['id'],
+        rows=metrics.phases['parse']['rows'], duplicates=len(duplicates), errors=len(errors),
+    )
+    if _wants_timings():
+        response['timings'] = metrics.payload()
     return jsonify(response)
 
 
 @app.route('/import', methods=['POST'])
 @login_required
 def import_csv():
-    """Import transactions from a CSV file."""
-    if 'file' not in request.files:
-        return jsonify({'error': 'Aucun fichier fourni'}), 400
+    """Import transactions from a statement file or from a previewed upload token."""
+    metrics = ImportMetrics()
+    metrics.switch('read')
+    spool = None
+    stream = None
+    preset = None
+    if request.form.get('token'):
+        spool = take_spool(request.form['token'])
+        if spool is None:
+            return jsonify({'error': 'Jeton inconnu ou expiré'}), 404
+        sha256, filename, preset = spool.sha256, spool.filename, spool.preset
+    else:
+        if 'file' not in request.files:
+            return jsonify({'error': 'Aucun fichier fourni'}), 400
+
+        file = request.files['file']
+        if file.filename == '':
+            return jsonify({'error': 'Aucun fichier fourni'}), 400
+        sha256, stream = hash_upload(file.stream)
+        filename = file.filename
+
+    # Background jobs take over the spool file; it is removed here otherwise
+    keep_spool = False
+    metrics.watch(models.engine)
+    try:
+        if request.form.get('force') not in ('true', '1', 'yes'):
+            session = models.SessionLocal()
+            try:
+                record = find_imported_file(session, sha256)
+                if record:
+                    logger.info("CSV file %s already imported, skipping", sha256)
+                    return jsonify(already_imported_response(record))
+            finally:
+                session.close()
 
-    file = request.files['file']
-    if file.filename == '':
+        mapping = encoding = None
+        if spool is None:
+            options = _import_options(stream)
+            if options is None:
+                return jsonify({'error': 'Not found'}), 404
+            mapping, encoding, stream, preset = options
+
+        mode = request.form.get('mode')
+        bulk = mode == 'bulk'
+        ignore_conflicts = mode == 'ignore'
+        if ignore_conflicts:
+            with models.engine.connect() as conn:
+                if not models.has_unique_transaction_index(conn):
+                    return jsonify({'error': "Index d'unicité des transactions absent"}), 400
+        chunked = bulk or ignore_conflicts
+        chunk_size = config.IMPORT_CHUNK_SIZE if chunked else config.IMPORT_BATCH_SIZE
+        if request.form.get('chunk_size'):
+            try:
+                chunk_size = max(1, int(request.form['chunk_size']))
+            except ValueError:
+                return jsonify({'error': 'chunk_size invalide'}), 400
+
+        if request.form.get('async') in ('true', '1', 'yes'):
+            job_id = submit_import_job(
+                stream,
+                filename=filename,
+                mapping=mapping,
+                chunk_size=chunk_size,
+                encoding=encoding,
+                sha256=sha256,
+                ignore_conflicts=ignore_conflicts,
+                spool_path=spool.path if spool else None,
+            )
+            keep_spool = True
+            logger.info("Queued CSV import job %s", job_id)
+            response = {'job_id': job_id, 'status_url': f'/import/jobs/{job_id}'}
+            if preset:
+                response['preset'] = preset
+            return jsonify(response), 202
+
+        if spool is not None:
+            events = iter_spooled_events(spool.path)
+        else:
+            events = iter_parse_statement(stream, mapping=mapping, encoding=encoding)
+        metrics.switch('parse')
+        try:
+            _, account_info = next(events)
+        except Exception as e:
+            return jsonify({'error': str(e)}), 400
+
+        session = models.SessionLocal()
+        try:
+            metrics.switch('account')
+            account = find_or_create_account(session, account_info)
+            imported, duplicates, errors = import_events(
+                session,
+                events,
+                account,
+                bulk=bulk,
+                chunk_size=chunk_size,
+                ignore_conflicts=ignore_conflicts,
+                metrics=metrics,
+            )
+            if not errors:
+                metrics.switch('record')
+                record_imported_file(
+                    session, sha256, account, filename, imported + len(duplicates)
+                )
+            account_data = account_payload(account)
+        finally:
+            session.close()
+    finally:
+        metrics.stop()
+        if spool is not None and not keep_spool:
+            remove_spool(spool)
+
+    response, status = import_response(imported, account_data, duplicates, errors)
+    if preset:
+        response['preset'] = preset
+    metrics.log(
+        logger, 'csv', account_id=account_data['id'], imported=imported,
+        duplicates=len(duplicates), errors=len(errors), mode=mode or 'default',
+    )
+    if _wants_timings():
+        response['timings'] = metrics.payload()
+    if errors:
+        logger.info(
+            "CSV import for account %s had errors: %s", account_data['id'], errors
+        )
+    else:
+        logger.info(
+            "CSV import for account %s: imported=%s duplicates=%s",
+            account_data['id'],
+            imported,
+            len(duplicates),
+        )
+    return jsonify(response), status
+
+
+@app.route('/import/batch', methods=['POST'])
+@login_required
+def import_batch_files():
+    """Import several CSV files or ZIP archives at once."""
+    files = [f for f in request.files.getlist('files') if f.filename]
+    if not files:
         return jsonify({'error': 'Aucun fichier fourni'}), 400
 
     mapping = None
@@ -354,177 +691,104 @@ def import_csv():
         except Exception:
             mapping = None
 
-    errors = []
-    try:
-        content = file.stream.read().decode('utf-8')
-    except Exception as e:
-        return jsonify({'error': str(e)}), 400
-
-    transactions, csv_duplicates, csv_errors, account_info = parse_csv(content, mapping=mapping)
-    errors = list(csv_errors)
-
     session = models.SessionLocal()
-    imported = 0
-    duplicates = list(csv_duplicates)
-
-    account = session.query(models.BankAccount).filter_by(
-        account_type=account_info.get('account_type'),
-        number=account_info.get('number'),
-    ).first()
-    if not account:
-        account = models.BankAccount(
-            account_type=account_info.get('account_type'),
-            number=account_info.get('number'),
-            export_date=account_info.get('export_date'),
-            name=account_info.get('name', ''),
-        )
-        if account_info.get('initial_balance') is not None:
-            account.initial_balance = account_info['initial_balance']
-            account.balance_date = account_info.get('balance_date')
-        session.add(account)
-        session.commit()
-    else:
-        account.export_date = account_info.get('export_date')
-        if account_info.get('name'):
-            account.name = account_info['name']
-        session.commit()
-
-    rules = session.query(models.Rule).all()
-
     try:
-        for t in transactions:
-            exists = session.query(models.Transaction).filter_by(
-                date=t['date'], label=t['label'], amount=t['amount'], bank_account_id=account.id
-            ).first()
-            if exists:
-                duplicates.append({
-                    'date': t['date'].isoformat(),
-                    'type': t['type'],
-                    'payment_method': t['payment_method'],
-                    'label': t['label'],
-                    'amount': t['amount'],
-                    'account_id': account.id,
-                })
-                continue
-
-            category_id = None
-            subcategory_id = None
-            for r in rules:
-                if r.pattern.lower() in t['label'].lower():
-                    category_id = r.category_id
-                    subcategory_id = r.subcategory_id
-                    break
-
-            session.add(models.Transaction(
-                date=t['date'],
-                tx_type=t['type'],
-                payment_method=t['payment_method'],
-                label=t['label'],
-                amount=t['amount'],
-                bank_account_id=account.id,
-                category_id=category_id,
-                subcategory_id=subcategory_id,
-                reconciled=t['reconciled'],
-                to_analyze=t['to_analyze']
-            ))
-            imported += 1
-        session.commit()
-    except Exception as e:
-        session.rollback()
-        errors.append(str(e))
+        report = import_batch(
+            session,
+            [(f.filename, f.stream.read()) for f in files],
+            mapping=mapping,
+            force=request.form.get('force') in ('true', '1', 'yes'),
+        )
     finally:
         session.close()
-
-    response = {
-        'imported': imported,
-        'account': {
-            'id': account.id,
-            'name': account.name,
-            'account_type': account.account_type,
-            'number': account.number,
-            'export_date': account.export_date.isoformat() if account.export_date else None,
-            'initial_balance': account.initial_balance,
-            'balance_date': account.balance_date.isoformat() if account.balance_date else None,
-        }
-    }
-    if duplicates:
-        response['duplicates'] = [
-            {
-                **d,
-                'date': d['date'].isoformat() if hasattr(d['date'], 'isoformat') else d['date'],
-            }
-            for d in duplicates
-        ]
-    if errors:
-        response['errors'] = errors
-        logger.info(
-            "CSV import for account %s had errors: %s", account.id, errors
-        )
-        return jsonify(response), 400
     logger.info(
-        "CSV import for account %s: imported=%s duplicates=%s", account.id, imported, len(duplicates)
+        "CSV batch import of %s files: imported=%s", len(report['files']), report['imported']
     )
-    return jsonify(response)
+    return jsonify(report)
+
+
+@app.route('/import/jobs/<job_id>')
+@login_required
+def import_job_status(job_id):
+    """Return the progress of a background import job."""
+    session = models.SessionLocal()
+    job = session.query(models.ImportJob).get(job_id)
+    if not job:
+        session.close()
+        return jsonify({'error': 'Not found'}), 404
+    result = import_job_payload(job)
+    session.close()
+    return jsonify(result)
 
 
 @app.route('/import/confirm', methods=['POST'])
 @login_required
 def confirm_import():
-    """Insert transactions that were previously flagged as duplicates."""
+    """Insert transactions that were previously flagged as duplicates.
+
+    The transactions must belong to an existing account. Rows are inserted by
+    chunks of ``IMPORT_CHUNK_SIZE``; a chunk that fails is reported in
+    ``errors`` without discarding the others.
+    """
     data = request.get_json() or {}
     rows = data.get('transactions', [])
     account_id = data.get('account_id')
 
-    session = models.SessionLocal()
-    imported = 0
+    metrics = ImportMetrics()
+    metrics.switch('read')
     errors = []
-
-    rules = session.query(models.Rule).all()
-
+    session = models.SessionLocal()
+    metrics.watch(models.engine)
     try:
-        for t in rows:
+        metrics.switch('account')
+        try:
+            account = session.get(models.BankAccount, int(account_id))
+        except (TypeError, ValueError):
+            account = None
+        if account is None:
+            return jsonify({'error': 'invalid account'}), 400
+        account_id = account.id
+
+        metrics.switch('parse')
+        transactions = []
+        for position, t in enumerate(rows, start=1):
             try:
-                date = datetime.strptime(t['date'], '%Y-%m-%d').date()
-            except (KeyError, ValueError):
+                day = parse_iso_date(t['date'])
+            except (KeyError, TypeError, ValueError):
                 errors.append('Date invalide')
                 continue
-
-            exists = session.query(models.Transaction).filter_by(
-                date=date, label=t.get('label'), amount=t.get('amount'), bank_account_id=account_id
-            ).first()
-            if exists:
+            try:
+                amount = float(t['amount'])
+            except (KeyError, TypeError, ValueError):
+                errors.append('Montant invalide')
                 continue
-
-            category_id = None
-            subcategory_id = None
-            for r in rules:
-                if r.pattern.lower() in t.get('label', '').lower():
-                    category_id = r.category_id
-                    subcategory_id = r.subcategory_id
-                    break
-
-            session.add(models.Transaction(
-                date=date,
-                tx_type=t.get('type', ''),
-                payment_method=t.get('payment_method', ''),
-                label=t.get('label', ''),
-                amount=t.get('amount'),
-                bank_account_id=account_id,
-                category_id=category_id,
-                subcategory_id=subcategory_id,
-                reconciled=False,
-                to_analyze=True,
-            ))
-            imported += 1
-        session.commit()
-    except Exception as e:
-        session.rollback()
-        session.close()
-        return jsonify({'error': str(e)}), 400
+            transactions.append((position, {
+                'date': day,
+                'type': t.get('type', ''),
+                'payment_method': t.get('payment_method', ''),
+                'label': t.get('label', ''),
+                'amount': amount,
+            }))
+
+        metrics.add_rows('parse', len(rows))
+        try:
+            imported, chunk_errors = insert_confirmed(
+                session, transactions, account_id, metrics=metrics
+            )
+        except Exception as e:
+            session.rollback()
+            return jsonify({'error': str(e)}), 400
+        errors.extend(chunk_errors)
     finally:
+        metrics.stop()
         session.close()
 
     response = {'imported': imported}
+    metrics.log(
+        logger, 'confirm', account_id=account_id, imported=imported, errors=len(errors)
+    )
+    if _wants_timings():
+        response['timings'] = metrics.payload()
     if errors:
         response['errors'] = errors
         logger.info(
@@ -574,7 +838,7 @@ def list_transactions():
 
     label = request.args.get('label')
     if label:
-        query = query.filter(models.Transaction.label.contains(label))
+        query = query.filter(models.label_like(session, f'%{label}%'))
     sid = request.args.get('subcategory_id')
     if sid:
         try:
@@ -703,6 +967,9 @@ def update_transaction(tx_id):
                 session.close()
                 return jsonify({'error': 'invalid category'}), 400
         tx.subcategory_id = sub_id
+    if 'category_id' in data or 'subcategory_id' in data:
+        # A category chosen by hand is no longer the one of a rule
+        tx.rule_id = None
     if 'favorite' in data:
         tx.favorite = bool(data['favorite'])
     if 'reconciled' in data:
@@ -1360,7 +1627,7 @@ def dashboard():
     for f in filters:
         subconds = []
         if f.pattern:
-            subconds.append(func.lower(models.Transaction.label).contains(f.pattern.lower()))
+            subconds.append(models.label_like(session, f'%{f.pattern}%'))
         if f.category_id:
             subconds.append(models.Transaction.category_id == f.category_id)
         if f.subcategory_id:
@@ -1430,7 +1697,7 @@ def dashboard():
     for f in filters:
         subconds = []
         if f.pattern:
-            subconds.append(func.lower(models.Transaction.label).contains(f.pattern.lower()))
+            subconds.append(models.label_like(session, f'%{f.pattern}%'))
         if f.category_id:
             subconds.append(models.Transaction.category_id == f.category_id)
         if f.subcategory_id:
@@ -1912,6 +2179,8 @@ def categories(category_id=None):
     cat_name = category.name
     session.delete(category)
     session.commit()
+    # Rules of the category are deleted with it
+    invalidate_rule_matcher()
     logger.info("Deleted category %s (id=%s)", cat_name, category.id)
 
     data_json = load_categories_json()
@@ -2065,6 +2334,7 @@ def subcategories(sub_id=None):
 
     session.delete(sub)
     session.commit()
+    invalidate_rule_matcher()
     logger.info("Deleted subcategory %s (id=%s)", sub.name, sub.id)
     session.close()
     return jsonify({'message': 'deleted'})
@@ -2120,6 +2390,7 @@ def rules(rule_id=None):
         )
         session.add(rule)
         session.commit()
+        invalidate_rule_matcher()
         logger.info(
             "Created rule %s (id=%s) for category %s subcategory %s",
             pattern,
@@ -2157,8 +2428,9 @@ def rules(rule_id=None):
             rule.subcategory_id = int(sid) if sid else None
 
         session.commit()
+        invalidate_rule_matcher()
         logger.info("Updated rule %s (id=%s)", rule.pattern, rule.id)
-        updated = apply_rule_to_transactions(session, rule)
+        updated = update_rule_transactions(session, rule)
         result = {
             'id': rule.id,
             'pattern': rule.pattern,
@@ -2171,11 +2443,85 @@ def rules(rule_id=None):
         session.close()
         return jsonify(result)
 
+    # Transactions keep the category of the deleted rule unless cleared
+    clear = str(request.args.get('clear')).lower() in ('true', '1', 'yes')
+    values = {models.Transaction.rule_id: None}
+    if clear:
+        values[models.Transaction.category_id] = None
+        values[models.Transaction.subcategory_id] = None
+    released = (
+        session.query(models.Transaction)
+        .filter(models.Transaction.rule_id == rule.id)
+        .update(values, synchronize_session=False)
+    )
     session.delete(rule)
     session.commit()
+    invalidate_rule_matcher()
     logger.info("Deleted rule %s (id=%s)", rule.pattern, rule.id)
     session.close()
-    return jsonify({'message': 'deleted'})
+    result = {'message': 'deleted'}
+    if clear:
+        result['cleared'] = released
+    return jsonify(result)
+
+
+@app.route('/rules/suggestions')
+@login_required
+def rules_suggestions():
+    """Return rule patterns suggested from the uncategorised transactions."""
+    try:
+        limit = int(request.args.get('limit', 20))
+    except ValueError:
+        limit = 20
+    session = models.SessionLocal()
+    try:
+        suggestions = suggest_rules(session, limit=max(limit, 0))
+    finally:
+        session.close()
+    return jsonify(suggestions)
+
+
+@app.route('/rules/preview', methods=['POST'])
+@login_required
+def rules_preview():
+    """Return what saving each pattern as a rule would change, without saving it."""
+    data = request.get_json() or {}
+    patterns = data.get('patterns')
+    if patterns is None and data.get('pattern') is not None:
+        patterns = [data['pattern']]
+    if not patterns or not isinstance(patterns, list) or not all(isinstance(p, str) for p in patterns):
+        return jsonify({'error': 'Missing fields'}), 400
+    try:
+        category_id = int(data['category_id']) if data.get('category_id') else None
+        subcategory_id = int(data['subcategory_id']) if data.get('subcategory_id') else None
+    except (TypeError, ValueError):
+        return jsonify({'error': 'invalid category'}), 400
+    session = models.SessionLocal()
+    try:
+        results = [
+            preview_rule(session, pattern.strip(), category_id, subcategory_id)
+            for pattern in patterns
+        ]
+    finally:
+        session.close()
+    return jsonify({'results': results})
+
+
+@app.route('/rules/reapply', methods=['POST'])
+@login_required
+def rules_reapply():
+    """Re-categorise every transaction with the current rules."""
+    session = models.SessionLocal()
+    try:
+        result = reapply_rules(session)
+    finally:
+        session.close()
+    logger.info(
+        "Re-applied rules: %s transactions scanned, %s updated",
+        result['scanned'],
+        result['updated'],
+    )
+    return jsonify(result)
 
 
 @app.route('/favorite_filters', methods=['GET', 'POST'])
@@ -2279,6 +2625,16 @@ def favorite_filters(filter_id=None):
     return jsonify({'message': 'deleted'})
 
 
+def _preset_payload(preset):
+    return {
+        'id': preset.id,
+        'name': preset.name,
+        'mapping': preset.mapping,
+        'encoding': preset.encoding,
+        'signature': preset.signature,
+    }
+
+
 @app.route('/import_presets', methods=['GET', 'POST'])
 @app.route('/import_presets/<int:preset_id>', methods=['GET', 'PUT', 'DELETE'])
 @login_required
@@ -2287,7 +2643,7 @@ def import_presets(preset_id=None):
     if request.method == 'GET':
         if preset_id is None:
             data = [
-                {'id': p.id, 'name': p.name, 'mapping': p.mapping}
+                _preset_payload(p)
                 for p in session.query(models.ImportPreset).all()
             ]
             session.close()
@@ -2296,7 +2652,7 @@ def import_presets(preset_id=None):
         if not preset:
             session.close()
             return jsonify({'error': 'Not found'}), 404
-        result = {'id': preset.id, 'name': preset.name, 'mapping': preset.mapping}
+        result = _preset_payload(preset)
         session.close()
         return jsonify(result)
 
@@ -2307,10 +2663,15 @@ def import_presets(preset_id=None):
         if not name or not isinstance(mapping, dict):
             session.close()
             return jsonify({'error': 'Missing fields'}), 400
-        preset = models.ImportPreset(name=name, mapping=mapping)
+        preset = models.ImportPreset(
+            name=name,
+            mapping=mapping,
+            encoding=data.get('encoding') or None,
+            signature=data.get('signature') or None,
+        )
         session.add(preset)
         session.commit()
-        result = {'id': preset.id, 'name': preset.name, 'mapping': preset.mapping}
+        result = _preset_payload(preset)
         session.close()
         return jsonify(result), 201
 
@@ -2325,8 +2686,12 @@ def import_presets(preset_id=None):
             preset.name = data['name']
         if 'mapping' in data and isinstance(data['mapping'], dict):
             preset.mapping = data['mapping']
+        if 'encoding' in data:
+            preset.encoding = data['encoding'] or None
+        if 'signature' in data:
+            preset.signature = data['signature'] or None
         session.commit()
-        result = {'id': preset.id, 'name': preset.name, 'mapping': preset.mapping}
+        result = _preset_payload(preset)
         session.close()
         return jsonify(result)
 
@@ -2342,6 +2707,7 @@ def reset():
     """Delete all transactions from the database."""
     session = models.SessionLocal()
     session.query(models.Transaction).delete()
+    session.query(models.ImportFile).delete()
     session.commit()
     session.close()
     return jsonify({'message': 'reset'})
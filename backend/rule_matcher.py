@@ -0,0 +1,410 @@
+"""Compiled matcher used to categorise transactions from :class:`Rule` patterns."""
+
+import re
+from collections import deque
+
+from sqlalchemy import bindparam, case, func, select, update
+
+from . import config, models
+from .csv_utils import apply_rule_to_transactions, rule_like_pattern
+
+
+class RuleMatcher:
+    """Aho-Corasick automaton built from lowercased rule patterns.
+
+    ``rules`` is a sequence of ``(rule_id, pattern, category_id,
+    subcategory_id)`` tuples. :meth:`match` returns the first of them whose
+    pattern is contained in the label, exactly like testing
+    ``pattern.lower() in label.lower()`` for each rule in turn, but with a
+    single pass over the label whatever the number of rules.
+    """
+
+    cache_size = 50000
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+        none = len(self.rules)
+        goto = [{}]
+        first = [none]
+        for index, (_, pattern, _, _) in enumerate(self.rules):
+            node = 0
+            for ch in (pattern or '').lower():
+                nxt = goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[node][ch] = nxt
+                    goto.append({})
+                    first.append(none)
+                node = nxt
+            first[node] = min(first[node], index)
+
+        # Breadth-first construction of the failure links. Each node also
+        # inherits the lowest rule index reachable through its failure link
+        # so that a single lookup gives the first rule ending at a position.
+        fail = [0] * len(goto)
+        queue = deque()
+        for child in goto[0].values():
+            first[child] = min(first[child], first[0])
+            queue.append(child)
+        while queue:
+            node = queue.popleft()
+            for ch, child in goto[node].items():
+                f = fail[node]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[child] = goto[f].get(ch, 0)
+                first[child] = min(first[child], first[fail[child]])
+                queue.append(child)
+
+        self._goto = goto
+        self._fail = fail
+        self._first = first
+        self._cache = {}
+
+    def match(self, label):
+        """Return the first matching rule tuple for ``label`` or ``None``."""
+        try:
+            return self._cache[label]
+        except KeyError:
+            pass
+        goto = self._goto
+        fail = self._fail
+        first = self._first
+        state = 0
+        best = first[0]
+        for ch in label.lower():
+            while True:
+                nxt = goto[state].get(ch)
+                if nxt is not None:
+                    state = nxt
+                    break
+                if not state:
+                    break
+                state = fail[state]
+            if first[state] < best:
+                best = first[state]
+                if not best:
+                    break
+        result = self.rules[best] if best < len(self.rules) else None
+        if len(self._cache) >= self.cache_size:
+            self._cache.clear()
+        self._cache[label] = result
+        return result
+
+    def categorize(self, label):
+        """Return ``(category_id, subcategory_id)`` for ``label``."""
+        rule = self.match(label)
+        if rule is None:
+            return None, None
+        return rule[2], rule[3]
+
+
+def _trie_pattern(words):
+    """Return a regular expression matching the longest of ``words``.
+
+    The alternation is factorised as a trie so that the regular expression
+    engine follows a single branch per character instead of trying every
+    word in turn.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[''] = {}
+
+    def pattern(node):
+        branches = [re.escape(ch) + pattern(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ''
+        group = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        if '' in node:
+            return '(?:' + group + ')?' if len(branches) == 1 else group + '?'
+        return group
+
+    return pattern(trie)
+
+
+class WordSequenceMatcher:
+    """Matcher reproducing :func:`apply_rule_to_transactions` for many rules.
+
+    A rule matches a label when the words of its pattern appear in it in
+    order, like ``lower(label) LIKE '%w1%w2%'``. ``rules`` are tuples as for
+    :class:`RuleMatcher` and :meth:`match` returns the first matching one.
+    All the words are looked up with a single regular expression; only the
+    rules whose words were all found are then checked for word order.
+    """
+
+    cache_size = 50000
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+        self._words = [
+            [w.lower() for w in (rule[1] or '').split()] for rule in self.rules
+        ]
+        by_first = {}
+        for index, words in enumerate(self._words):
+            if words:
+                by_first.setdefault(words[0], []).append(index)
+        vocabulary = sorted({w for words in self._words for w in words}, key=len, reverse=True)
+        # Every position is tried and the longest word found there is
+        # reported; the shorter words it starts with are found with it.
+        self._prefixes = {
+            word: [v for v in vocabulary if word.startswith(v)] for word in vocabulary
+        }
+        self._regex = re.compile('(?=(' + _trie_pattern(vocabulary) + '))' if vocabulary else '(?!)')
+        self._by_first = by_first
+        self._cache = {}
+
+    def _in_order(self, words, label):
+        position = 0
+        for word in words:
+            position = label.find(word, position)
+            if position < 0:
+                return False
+            position += len(word)
+        return True
+
+    def match(self, label):
+        """Return the first matching rule tuple for ``label`` or ``None``."""
+        try:
+            return self._cache[label]
+        except KeyError:
+            pass
+        lowered = label.lower()
+        found = set()
+        for longest in set(self._regex.findall(lowered)):
+            found.update(self._prefixes[longest])
+        candidates = sorted({i for w in found for i in self._by_first.get(w, ())})
+        result = None
+        for index in candidates:
+            words = self._words[index]
+            if all(w in found for w in words) and self._in_order(words, lowered):
+                result = self.rules[index]
+                break
+        if len(self._cache) >= self.cache_size:
+            self._cache.clear()
+        self._cache[label] = result
+        return result
+
+    def categorize(self, label):
+        """Return ``(category_id, subcategory_id)`` for ``label``."""
+        rule = self.match(label)
+        if rule is None:
+            return None, None
+        return rule[2], rule[3]
+
+
+def _assign_statement():
+    """Return the ``UPDATE`` giving one transaction the category of a rule."""
+    table = models.Transaction.__table__
+    return (
+        update(table)
+        .where(table.c.id == bindparam('tx_id'))
+        .values(
+            category_id=bindparam('new_category'),
+            subcategory_id=bindparam('new_subcategory'),
+            rule_id=bindparam('new_rule'),
+        )
+    )
+
+
+def _assignment(tx_id, rule):
+    """Return the parameters of :func:`_assign_statement` for ``rule`` (or none)."""
+    rule_id, _, category_id, subcategory_id = rule or (None, None, None, None)
+    return {
+        'tx_id': tx_id,
+        'new_category': category_id,
+        'new_subcategory': subcategory_id,
+        'new_rule': rule_id,
+    }
+
+
+def reapply_rules(session, chunk_size=None):
+    """Re-categorise the stored transactions with all the rules at once.
+
+    Transactions are read once, ``chunk_size`` rows at a time, and each label
+    is given the category of its first matching rule in id order, the rule
+    being recorded in ``rule_id``. Only the rows whose category or rule
+    changes are updated, one ``executemany`` per chunk. Rows matched by no
+    rule keep their category but lose their ``rule_id``, so that editing or
+    deleting that rule later does not touch them. The update is committed at
+    the end.
+
+    Return ``{'scanned': rows, 'updated': rows}``.
+    """
+    chunk_size = chunk_size or config.RULES_REAPPLY_CHUNK_SIZE
+    matcher = get_rule_matcher(session, WordSequenceMatcher)
+
+    table = models.Transaction.__table__
+    statement = _assign_statement()
+    rows = session.execute(
+        select(
+            table.c.id,
+            table.c.label,
+            table.c.category_id,
+            table.c.subcategory_id,
+            table.c.rule_id,
+        )
+        .order_by(table.c.id)
+        .execution_options(yield_per=chunk_size)
+    )
+    scanned = 0
+    updated = 0
+    for partition in rows.partitions():
+        scanned += len(partition)
+        changes = []
+        for tx_id, label, category_id, subcategory_id, rule_id in partition:
+            rule = matcher.match(label or '')
+            if rule is None:
+                if rule_id is not None:
+                    changes.append(_assignment(tx_id, (None, None, category_id, subcategory_id)))
+                continue
+            if (rule[0], rule[2], rule[3]) == (rule_id, category_id, subcategory_id):
+                continue
+            changes.append(_assignment(tx_id, rule))
+        if changes:
+            session.execute(statement, changes)
+            updated += len(changes)
+    session.commit()
+    return {'scanned': scanned, 'updated': updated}
+
+
+def update_rule_transactions(session, rule):
+    """Re-categorise the transactions affected by the edit of ``rule``.
+
+    The transactions attributed to the rule which no longer match its
+    pattern are given the category of the first other matching rule, or no
+    category; they are found through the ``rule_id`` index. Transactions
+    matching the pattern are then updated by
+    :func:`apply_rule_to_transactions`. Call it once the cached matchers
+    were invalidated. Return the number of updated transactions.
+    """
+    tx = models.Transaction
+    own = WordSequenceMatcher([(rule.id, rule.pattern, rule.category_id, rule.subcategory_id)])
+    stale = [
+        (tx_id, label)
+        for tx_id, label in session.query(tx.id, tx.label).filter(tx.rule_id == rule.id)
+        if own.match(label or '') is None
+    ]
+    if stale:
+        matcher = get_rule_matcher(session, WordSequenceMatcher)
+        session.execute(
+            _assign_statement(),
+            [_assignment(tx_id, matcher.match(label or '')) for tx_id, label in stale],
+        )
+    return len(stale) + apply_rule_to_transactions(session, rule)
+
+
+def preview_rule(session, pattern, category_id=None, subcategory_id=None):
+    """Describe what saving a rule would change, without writing anything.
+
+    Return a dict with the number of transactions the rule matches
+    (``count``), the last imported of them (``sample``) and how many already
+    have another category (``overrides``). ``conflicts`` lists the existing
+    rules giving some of these transactions another category; they take
+    precedence over the new rule during imports as rules apply in id order.
+    Conflicts are looked up on at most ``RULES_PREVIEW_LABEL_LIMIT``
+    distinct labels, ``complete`` is false when more labels match.
+    """
+    result = {
+        'pattern': pattern,
+        'count': 0,
+        'overrides': 0,
+        'sample': [],
+        'conflicts': [],
+        'complete': True,
+    }
+    like_pattern = rule_like_pattern(pattern)
+    if like_pattern is None:
+        return result
+
+    # Joining the matching ids lets the sample stop early in the index
+    tx = models.Transaction
+    ids = models.label_matches(session, like_pattern)
+    target = (category_id, subcategory_id)
+    other = tx.category_id.isnot(None) & (
+        tx.category_id.is_distinct_from(category_id)
+        | tx.subcategory_id.is_distinct_from(subcategory_id)
+    )
+    count, overrides = (
+        session.query(func.count(tx.id), func.sum(case((other, 1), else_=0)))
+        .join(ids, ids.c.id == tx.id)
+        .one()
+    )
+    result['count'] = count
+    result['overrides'] = overrides or 0
+    result['sample'] = [
+        {
+            'id': t.id,
+            'date': t.date.isoformat() if t.date else None,
+            'label': t.label,
+            'amount': t.amount,
+            'category_id': t.category_id,
+            'subcategory_id': t.subcategory_id,
+        }
+        for t in session.query(tx)
+        .join(ids, ids.c.id == tx.id)
+        .order_by(ids.c.id.desc())
+        .limit(config.RULES_PREVIEW_SAMPLE_SIZE)
+    ]
+
+    limit = config.RULES_PREVIEW_LABEL_LIMIT
+    labels = (
+        session.query(tx.label, func.count(tx.id))
+        .join(ids, ids.c.id == tx.id)
+        .group_by(tx.label)
+        .limit(limit + 1)
+        .all()
+    )
+    if len(labels) > limit:
+        result['complete'] = False
+        labels = labels[:limit]
+    matcher = get_rule_matcher(session, WordSequenceMatcher)
+    conflicts = {}
+    for label, rows in labels:
+        rule = matcher.match(label or '')
+        if rule is not None and (rule[2], rule[3]) != target:
+            conflicts[rule] = conflicts.get(rule, 0) + rows
+    result['conflicts'] = [
+        {
+            'id': rule[0],
+            'pattern': rule[1],
+            'category_id': rule[2],
+            'subcategory_id': rule[3],
+            'count': rows,
+        }
+        for rule, rows in sorted(conflicts.items(), key=lambda item: (-item[1], item[0][0]))
+    ]
+    return result
+
+
+_matchers = {}
+_version = 0
+
+
+def invalidate_rule_matcher():
+    """Discard the cached matchers; call it whenever rules are modified."""
+    global _version
+    _version += 1
+
+
+def get_rule_matcher(session, matcher_class=RuleMatcher):
+    """Return a ``matcher_class`` for all rules, rebuilding it only when needed."""
+    engine = session.get_bind()
+    cached = _matchers.get(matcher_class)
+    if cached is None or cached[0] is not engine or cached[1] != _version:
+        version = _version
+        rows = (
+            session.query(
+                models.Rule.id,
+                models.Rule.pattern,
+                models.Rule.category_id,
+                models.Rule.subcategory_id,
+            )
+            .order_by(models.Rule.id)
+            .all()
+        )
+        cached = (engine, version, matcher_class(tuple(r) for r in rows))
+        _matchers[matcher_class] = cached
+    return cached[2]
@@ -0,0 +1,230 @@
+"""Rule patterns suggested from the transactions left without category."""
+
+import re
+import threading
+from collections import Counter
+
+from sqlalchemy import func, literal, select, text, union_all
+
+from . import models
+from .csv_utils import rule_like_pattern
+
+# Words found in a larger share of the distinct labels (CARTE, PRLV, SEPA...)
+# say nothing about the merchant and are not suggested
+GENERIC_WORD_SHARE = 0.2
+# Last categorised transactions from which categories are proposed
+CATEGORY_SAMPLE_SIZE = 10000
+
+_WORD = re.compile(r'[^\W\d_]{3,}')
+
+# Both queries are answered from the ix_transactions_uncategorised index
+_LABEL_COUNTS = text(
+    f'SELECT {models.MASKED_LABEL}, count(*) FROM transactions '
+    f'WHERE category_id IS NULL GROUP BY {models.MASKED_LABEL}'
+)
+_EXAMPLE_LABEL = text(
+    'SELECT label FROM transactions '
+    f'WHERE category_id IS NULL AND {models.MASKED_LABEL} = :masked LIMIT 1'
+)
+
+
+def label_phrases(label):
+    """Return the words of ``label`` used to suggest rules, by phrase.
+
+    As for recurrence grouping, case, digits and punctuation are ignored;
+    words shorter than three letters are dropped as well. A phrase gathers
+    the words separated by a single space: rules match the label text, so
+    only those can be suggested together.
+    """
+    label = (label or '').lower()
+    phrases = []
+    end = None
+    for match in _WORD.finditer(label):
+        if end is not None and match.start() == end + 1 and label[end] == ' ':
+            phrases[-1].append(match.group())
+        else:
+            phrases.append([match.group()])
+        end = match.end()
+    return tuple(tuple(phrase) for phrase in phrases)
+
+
+def _candidates(phrases):
+    """Return the patterns suggested for labels made of ``phrases``."""
+    candidates = set()
+    for words in phrases:
+        candidates.update((w,) for w in words)
+        candidates.update(zip(words, words[1:]))
+    return candidates
+
+
+class SuggestionIndex:
+    """Inverted index of the uncategorised transactions of one database.
+
+    Transactions are grouped by the phrases of their label. Each candidate
+    pattern, a word or two consecutive words of a phrase, maps to the groups
+    containing it with their number of transactions. Only these counts are
+    kept: :meth:`refresh` reads the number of uncategorised transactions per
+    label, digits masked, from an index and applies the difference with the
+    previous counts.
+    """
+
+    cache_size = 50000
+
+    def __init__(self):
+        self.groups = Counter()
+        self.examples = {}
+        self.index = {}
+        self.coverage = Counter()
+        self._phrases = {}
+
+    def _label_phrases(self, label):
+        try:
+            return self._phrases[label]
+        except KeyError:
+            pass
+        if len(self._phrases) >= self.cache_size:
+            self._phrases.clear()
+        phrases = self._phrases[label] = label_phrases(label)
+        return phrases
+
+    def _add(self, phrases, rows):
+        count = self.groups[phrases] + rows
+        for candidate in _candidates(phrases):
+            groups = self.index.setdefault(candidate, {})
+            self.coverage[candidate] += rows
+            if count:
+                groups[phrases] = count
+            else:
+                del groups[phrases]
+                if not groups:
+                    del self.index[candidate]
+                    del self.coverage[candidate]
+        if count:
+            self.groups[phrases] = count
+        else:
+            del self.groups[phrases]
+
+    def refresh(self, session):
+        """Bring the index up to date with the stored transactions."""
+        groups = Counter()
+        examples = {}
+        for masked, rows in session.execute(_LABEL_COUNTS):
+            phrases = self._label_phrases(masked)
+            if phrases:
+                groups[phrases] += rows
+                examples.setdefault(phrases, masked)
+        for phrases in groups.keys() | self.groups.keys():
+            rows = groups[phrases] - self.groups[phrases]
+            if rows:
+                self._add(phrases, rows)
+        self.examples = examples
+
+    def suggest(self, limit, exclude=()):
+        """Return ``(words, rows, example masked label)`` for the best patterns.
+
+        Patterns are ranked by the number of transactions they cover, longer
+        ones first on ties. A pattern covering only groups already covered by
+        a better ranked one is skipped, as are those in ``exclude`` and those
+        containing a generic word.
+        """
+        threshold = GENERIC_WORD_SHARE * len(self.groups)
+        generic = set()
+        if len(self.groups) * GENERIC_WORD_SHARE >= 1:
+            generic = {
+                candidate[0]
+                for candidate, groups in self.index.items()
+                if len(candidate) == 1 and len(groups) > threshold
+            }
+        ranked = sorted(self.coverage.items(), key=lambda item: (-item[1], -len(item[0]), item[0]))
+        covered = set()
+        result = []
+        for candidate, rows in ranked:
+            if len(result) >= limit:
+                break
+            if candidate in exclude or any(w in generic for w in candidate):
+                continue
+            groups = self.index[candidate]
+            if all(g in covered for g in groups):
+                continue
+            covered.update(groups)
+            result.append((candidate, rows, self.examples[max(groups, key=groups.get)]))
+        return result
+
+
+_indexes = {}
+_lock = threading.Lock()
+
+
+def propose_categories(session, patterns, sample_size=CATEGORY_SAMPLE_SIZE):
+    """Return ``{pattern: (category_id, subcategory_id, share)}`` for ``patterns``.
+
+    Among the last ``sample_size`` categorised transactions, those whose
+    label matches each pattern give it their most used category; ``share``
+    is the part of them having it. Patterns matching none are left out.
+    All the patterns are checked in a single pass over the sample.
+    """
+    if not patterns:
+        return {}
+    tx = models.Transaction
+    recent = (
+        select(tx.label, tx.category_id, tx.subcategory_id)
+        .where(tx.category_id.isnot(None))
+        .order_by(tx.id.desc())
+        .limit(sample_size)
+        .subquery()
+    )
+    wanted = union_all(*(
+        select(literal(i).label('position'), literal(rule_like_pattern(pattern).lower()).label('pattern'))
+        for i, pattern in enumerate(patterns)
+    )).subquery()
+    counts = {}
+    for position, category_id, subcategory_id, rows in session.execute(
+        select(wanted.c.position, recent.c.category_id, recent.c.subcategory_id, func.count())
+        .select_from(wanted)
+        .join(recent, func.lower(recent.c.label).like(wanted.c.pattern))
+        .group_by(wanted.c.position, recent.c.category_id, recent.c.subcategory_id)
+    ):
+        counts.setdefault(patterns[position], Counter())[(category_id, subcategory_id)] = rows
+    proposals = {}
+    for pattern, categories in counts.items():
+        (category_id, subcategory_id), rows = categories.most_common(1)[0]
+        proposals[pattern] = (category_id, subcategory_id, rows / sum(categories.values()))
+    return proposals
+
+
+def suggest_rules(session, limit=20):
+    """Return rule suggestions for the uncategorised transactions.
+
+    Each suggestion gives the ``pattern``, the number of uncategorised
+    transactions it covers (``count``, counting consecutive words), an
+    ``example`` label and the category proposed from similar categorised
+    transactions with its ``confidence``. Patterns of existing rules are
+    not suggested.
+    """
+    rules = {
+        tuple(pattern.lower().split())
+        for pattern, in session.query(models.Rule.pattern)
+    }
+    engine = session.get_bind()
+    with _lock:
+        index = _indexes.get(engine)
+        if index is None:
+            index = _indexes[engine] = SuggestionIndex()
+        index.refresh(session)
+        suggestions = index.suggest(limit, exclude=rules)
+
+    proposals = propose_categories(session, [' '.join(words) for words, _, _ in suggestions])
+    result = []
+    for words, rows, masked in suggestions:
+        pattern = ' '.join(words)
+        example = session.execute(_EXAMPLE_LABEL, {'masked': masked}).scalar() or masked
+        category_id, subcategory_id, confidence = proposals.get(pattern, (None, None, None))
+        result.append({
+            'pattern': pattern,
+            'count': rows,
+            'example': example,
+            'category_id': category_id,
+            'subcategory_id': subcategory_id,
+            'confidence': round(confidence, 3) if confidence is not None else None,
+        })
+    return result
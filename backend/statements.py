@@ -0,0 +1,469 @@
+"""Streaming parsers for XML bank statements (CAMT.053 and OFX).
+
+:func:`iter_parse_statement` also dispatches CSV and XLSX uploads to their
+readers. The parsers yield the same events as :func:`csv_utils.iter_parse_csv` so
+that statements go through the same deduplication and rule pipeline as CSV
+exports. Files are read with :func:`xml.etree.ElementTree.iterparse` and
+every processed element is detached from the tree, keeping memory flat
+whatever the size of the statement.
+"""
+
+import codecs
+import html
+import re
+import xml.etree.ElementTree as ET
+from datetime import date
+
+from .csv_utils import iter_parse_csv, peek_stream
+from .xlsx_import import iter_parse_xlsx
+
+# Bytes inspected to recognise the format of an upload
+FORMAT_SAMPLE_SIZE = 4096
+# Bytes decoded at once from OFX 1.x (SGML) files
+OFX_CHUNK_SIZE = 64 * 1024
+
+CAMT_ACCOUNT_TYPES = {
+    'CACC': 'Compte courant',
+    'SVGS': 'Compte épargne',
+    'CARD': 'Carte',
+    'LOAN': 'Prêt',
+}
+# Bank transaction family codes (ISO 20022 BkTxCd/Domn/Fmly/Cd)
+CAMT_PAYMENT_METHODS = {
+    'ICDT': 'Virement',
+    'RCDT': 'Virement',
+    'IDDT': 'Prélèvement',
+    'RDDT': 'Prélèvement',
+    'ICHQ': 'Chèque',
+    'RCHQ': 'Chèque',
+    'CCRD': 'CB',
+    'MCRD': 'CB',
+    'CNTR': 'Retrait',
+}
+OFX_ACCOUNT_TYPES = {
+    'CHECKING': 'Compte courant',
+    'SAVINGS': 'Compte épargne',
+    'MONEYMRKT': 'Compte épargne',
+    'CREDITLINE': 'Ligne de crédit',
+    'CREDITCARD': 'Carte',
+}
+# Generic transaction types carry no payment method
+OFX_PAYMENT_METHODS = {
+    'ATM': 'Retrait',
+    'CASH': 'Retrait',
+    'CHECK': 'Chèque',
+    'CREDIT': '',
+    'DEBIT': '',
+    'DEP': 'Dépôt',
+    'DIRECTDEBIT': 'Prélèvement',
+    'DIRECTDEP': 'Virement',
+    'FEE': 'Frais',
+    'INT': 'Intérêts',
+    'OTHER': '',
+    'PAYMENT': 'Paiement',
+    'POS': 'CB',
+    'REPEATPMT': 'Prélèvement',
+    'SRVCHG': 'Frais',
+    'XFER': 'Virement',
+}
+
+_OFX_TAG = re.compile(r'<(/?)([A-Za-z0-9._]+)>([^<]*)')
+_OFX_CHARSET = re.compile(rb'CHARSET:\s*([A-Za-z0-9-]+)')
+_OFX_ENCODING = re.compile(rb'ENCODING:\s*([A-Za-z0-9-]+)')
+
+
+def detect_format(prefix):
+    """Return ``'camt'``, ``'ofx'``, ``'xlsx'`` or ``'csv'`` for a file prefix."""
+    if prefix.startswith(b'PK\x03\x04'):
+        return 'xlsx'
+    if b'OFXHEADER' in prefix or b'<OFX>' in prefix.upper():
+        return 'ofx'
+    if b'camt.053' in prefix or b'BkToCstmrStmt' in prefix:
+        return 'camt'
+    return 'csv'
+
+
+def sniff_format(stream, sample_size=FORMAT_SAMPLE_SIZE):
+    """Return ``(format, stream)`` for a binary ``stream``, see :func:`detect_format`."""
+    prefix, stream = peek_stream(stream, sample_size)
+    return detect_format(prefix), stream
+
+
+def iter_parse_statement(stream, mapping=None, encoding='utf-8', fmt=None):
+    """Yield parse events for a CSV, XLSX, CAMT.053 or OFX binary ``stream``.
+
+    ``fmt`` is sniffed from the start of the stream when omitted. ``mapping``
+    only applies to CSV and XLSX files; XML statements carry their own
+    encoding.
+    """
+    if fmt is None:
+        fmt, stream = sniff_format(stream)
+    if fmt == 'camt':
+        yield from iter_parse_camt(stream)
+    elif fmt == 'ofx':
+        yield from iter_parse_ofx(stream, encoding=encoding)
+    elif fmt == 'xlsx':
+        yield from iter_parse_xlsx(stream, mapping=mapping)
+    else:
+        yield from iter_parse_csv(stream, mapping=mapping, encoding=encoding)
+
+
+def _local(tag):
+    return tag.rpartition('}')[2]
+
+
+def _text(elem, path):
+    found = elem.find(path)
+    if found is None or found.text is None:
+        return ''
+    return ' '.join(found.text.split())
+
+
+def _iso_date(value):
+    return date.fromisoformat(value[:10])
+
+
+def _label(value):
+    label = ' '.join(value.split())
+    if label.startswith(('=', '+', '-', '@')):
+        label = "'" + label
+    return label
+
+
+def _with_duplicates(entries, fmt):
+    """Turn ``(kind, value)`` entries into parse events.
+
+    ``kind`` is ``'account'``, ``'error'`` or the number of the operation in
+    the file. Operations repeating an earlier date, label and amount become
+    ``duplicate`` events, like rows of a CSV file. XML errors before the
+    account is known are raised; later ones end the import with an error.
+    """
+    seen = set()
+    started = False
+    try:
+        for kind, value in entries:
+            if kind == 'account':
+                started = True
+                yield kind, value
+                continue
+            if kind == 'error':
+                yield kind, value
+                continue
+            key = (value['date'], value['label'], value['amount'])
+            if key in seen:
+                yield 'duplicate', {
+                    'line_no': kind,
+                    'date': value['date'],
+                    'type': value['type'],
+                    'payment_method': value['payment_method'],
+                    'label': value['label'],
+                    'amount': value['amount'],
+                }
+                continue
+            seen.add(key)
+            yield 'transaction', {**value, 'reconciled': False, 'to_analyze': True}
+    except ET.ParseError as e:
+        if not started:
+            raise ValueError(f'Fichier {fmt} invalide : {e}') from e
+        yield 'error', f'Fichier {fmt} invalide : {e}'
+        return
+    if not started:
+        yield 'account', {}
+        yield 'error', 'Aucun relevé trouvé dans le fichier'
+
+
+def iter_parse_camt(stream):
+    """Parse an ISO 20022 CAMT.053 statement and yield parse events.
+
+    The account is read from the first ``Stmt`` element: its IBAN (or other
+    identifier), type, name, creation date and opening balance. Statements
+    of other accounts in the same file are reported as errors and skipped.
+    """
+    yield from _with_duplicates(_iter_camt_entries(stream), 'CAMT.053')
+
+
+def _camt_account(acct, created, balances):
+    number = _text(acct, '{*}Id/{*}IBAN') or _text(acct, '{*}Id/{*}Othr/{*}Id')
+    code = _text(acct, '{*}Tp/{*}Cd')
+    account_type = CAMT_ACCOUNT_TYPES.get(code) or _text(acct, '{*}Tp/{*}Prtry') or code
+    info = {
+        'account_type': account_type or 'Compte courant',
+        'number': number,
+        'export_date': _iso_date(created) if created else None,
+    }
+    name = _text(acct, '{*}Nm')
+    if name:
+        info['name'] = name
+    for bal in balances:
+        if _text(bal, '{*}Tp/{*}CdOrPrtry/{*}Cd') in ('OPBD', 'PRCD'):
+            amount = float(_text(bal, '{*}Amt'))
+            if _text(bal, '{*}CdtDbtInd') == 'DBIT':
+                amount = -amount
+            balance_date = _text(bal, '{*}Dt/{*}Dt') or _text(bal, '{*}Dt/{*}DtTm')
+            info['initial_balance'] = amount
+            info['balance_date'] = _iso_date(balance_date) if balance_date else None
+            break
+    return info
+
+
+def _camt_entry(ntry):
+    amount = float(_text(ntry, '{*}Amt'))
+    credit = _text(ntry, '{*}CdtDbtInd') == 'CRDT'
+    if not credit:
+        amount = -amount
+    booked = (
+        _text(ntry, '{*}BookgDt/{*}Dt')
+        or _text(ntry, '{*}BookgDt/{*}DtTm')
+        or _text(ntry, '{*}ValDt/{*}Dt')
+    )
+    family = _text(ntry, '{*}BkTxCd/{*}Domn/{*}Fmly/{*}Cd')
+    method = CAMT_PAYMENT_METHODS.get(family) or _text(ntry, '{*}BkTxCd/{*}Prtry/{*}Cd')
+    label = _text(ntry, '{*}AddtlNtryInf')
+    if not label:
+        details = ntry.find('{*}NtryDtls/{*}TxDtls')
+        if details is not None:
+            party = 'Dbtr' if credit else 'Cdtr'
+            parts = [
+                _text(details, f'{{*}}RltdPties/{{*}}{party}/{{*}}Nm')
+                or _text(details, f'{{*}}RltdPties/{{*}}{party}/{{*}}Pty/{{*}}Nm')
+            ]
+            parts.extend(
+                ' '.join(u.text.split())
+                for u in details.iterfind('{*}RmtInf/{*}Ustrd')
+                if u.text
+            )
+            label = ' '.join(p for p in parts if p)
+    if not booked:
+        raise ValueError('date absente')
+    if not label:
+        raise ValueError('libellé absent')
+    return {
+        'date': _iso_date(booked),
+        'type': 'Credit' if credit else 'Debit',
+        'payment_method': method,
+        'label': _label(label),
+        'amount': amount,
+    }
+
+
+def _iter_camt_entries(stream):
+    """Yield ``('account', info)``, then numbered operations and errors."""
+    stack = []
+    created = None
+    acct = None
+    balances = []
+    account = None
+    skipping = False
+    number = 0
+    for event, elem in ET.iterparse(stream, events=('start', 'end')):
+        if event == 'start':
+            stack.append(elem)
+            if _local(elem.tag) == 'Stmt':
+                acct = None
+                balances = []
+                skipping = False
+            continue
+        stack.pop()
+        parent = stack[-1] if stack else None
+        tag = _local(elem.tag)
+        parent_tag = _local(parent.tag) if parent is not None else None
+        if tag == 'CreDtTm' and parent_tag in ('GrpHdr', 'Stmt'):
+            created = (elem.text or '').strip() or created
+        elif tag == 'Stmt':
+            parent.remove(elem)
+            continue
+        elif parent_tag != 'Stmt':
+            continue
+        elif tag == 'Acct':
+            acct = elem
+        elif tag == 'Bal':
+            balances.append(elem)
+        elif tag == 'Ntry':
+            if account is None:
+                account = _camt_account(
+                    acct if acct is not None else ET.Element('Acct'), created, balances
+                )
+                yield 'account', account
+            elif acct is not None and not skipping:
+                other = _camt_account(acct, created, balances)['number']
+                if other != account['number']:
+                    skipping = True
+                    yield 'error', f'Relevé du compte {other} ignoré : un seul compte par fichier'
+            acct = None
+            if not skipping:
+                number += 1
+                try:
+                    yield number, _camt_entry(elem)
+                except (TypeError, ValueError) as e:
+                    yield 'error', f'Opération {number}: {e}'
+        # Children of Stmt are no longer needed once processed
+        if tag not in ('Acct', 'Bal'):
+            parent.remove(elem)
+    if account is None and acct is not None:
+        yield 'account', _camt_account(acct, created, balances)
+
+
+def iter_parse_ofx(stream, encoding='utf-8'):
+    """Parse an OFX statement (1.x SGML or 2.x XML) and yield parse events.
+
+    The account comes from ``BANKACCTFROM`` (or ``CCACCTFROM`` for cards) and
+    the export date from the server date. SGML files are decoded with the
+    charset declared in their header, ``encoding`` otherwise.
+    """
+    prefix, stream = peek_stream(stream, FORMAT_SAMPLE_SIZE)
+    head = prefix.lstrip(b'\xef\xbb\xbf \t\r\n')
+    if head.startswith(b'<?xml') or head.upper().startswith(b'<?OFX'):
+        tokens = _iter_ofx_xml(stream)
+    else:
+        tokens = _iter_ofx_sgml(stream, _ofx_encoding(prefix, encoding))
+    yield from _with_duplicates(_iter_ofx_entries(tokens), 'OFX')
+
+
+def _ofx_encoding(prefix, default):
+    match = _OFX_ENCODING.search(prefix)
+    if match and match.group(1).upper() in (b'UTF-8', b'UNICODE'):
+        return 'utf-8'
+    match = _OFX_CHARSET.search(prefix)
+    if match:
+        charset = match.group(1).decode('ascii')
+        name = f'cp{charset}' if charset.isdigit() else charset
+        try:
+            return codecs.lookup(name).name
+        except LookupError:
+            pass
+    return default
+
+
+def _iter_ofx_xml(stream):
+    """Yield ``(event, tag, text)`` tokens from an OFX 2.x file."""
+    stack = []
+    for event, elem in ET.iterparse(stream, events=('start', 'end')):
+        tag = _local(elem.tag).upper()
+        if event == 'start':
+            stack.append(elem)
+            yield 'start', tag, None
+            continue
+        stack.pop()
+        text = ' '.join(elem.text.split()) if elem.text and not len(elem) else None
+        yield 'end', tag, text
+        if stack:
+            stack[-1].remove(elem)
+
+
+def _iter_ofx_sgml(stream, encoding):
+    """Yield ``(event, tag, text)`` tokens from an OFX 1.x file.
+
+    Leaf elements are not closed in SGML: a tag followed by text is reported
+    as a complete element and its optional closing tag is ignored.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)('replace')
+    buffer = ''
+    leaf = None
+    while True:
+        chunk = stream.read(OFX_CHUNK_SIZE)
+        buffer += decoder.decode(chunk, final=not chunk)
+        # The text of a tag ends at the next '<': keep the last one for later
+        cut = buffer.rfind('<') if chunk else len(buffer)
+        if cut <= 0:
+            if not chunk:
+                return
+            continue
+        for match in _OFX_TAG.finditer(buffer, 0, cut):
+            closing, tag, text = match.groups()
+            tag = tag.upper()
+            text = ' '.join(html.unescape(text).split())
+            if closing:
+                if tag != leaf:
+                    yield 'end', tag, None
+                leaf = None
+            elif text:
+                yield 'start', tag, None
+                yield 'end', tag, text
+                leaf = tag
+            else:
+                yield 'start', tag, None
+                leaf = None
+        buffer = buffer[cut:]
+        if not chunk:
+            return
+
+
+def _ofx_date(value):
+    value = value.strip()
+    return date(int(value[:4]), int(value[4:6]), int(value[6:8]))
+
+
+def _ofx_account(fields):
+    account_type = fields.get('ACCTTYPE', '')
+    info = {
+        'account_type': OFX_ACCOUNT_TYPES.get(account_type, account_type) or 'Compte courant',
+        'number': fields.get('ACCTID', ''),
+        'export_date': None,
+    }
+    server_date = fields.get('DTSERVER') or fields.get('DTEND')
+    if server_date:
+        info['export_date'] = _ofx_date(server_date)
+    return info
+
+
+def _ofx_transaction(fields):
+    amount = float(fields['TRNAMT'].replace(' ', '').replace(',', '.'))
+    name = fields.get('NAME', '')
+    memo = fields.get('MEMO', '')
+    label = name
+    if memo and memo not in name:
+        label = f'{name} {memo}' if name else memo
+    if not label:
+        raise ValueError('libellé absent')
+    trn_type = fields.get('TRNTYPE', '')
+    return {
+        'date': _ofx_date(fields['DTPOSTED']),
+        'type': 'Credit' if amount > 0 else 'Debit',
+        'payment_method': OFX_PAYMENT_METHODS.get(trn_type, trn_type),
+        'label': _label(label),
+        'amount': amount,
+    }
+
+
+def _iter_ofx_entries(tokens):
+    """Yield ``('account', info)``, then numbered operations and errors."""
+    fields = {}
+    current = None
+    account = None
+    skipping = False
+    number = 0
+    for event, tag, text in tokens:
+        if event == 'start':
+            if tag == 'STMTTRN':
+                current = {}
+            elif tag in ('STMTRS', 'CCSTMTRS'):
+                server_date = fields.get('DTSERVER')
+                fields = {'DTSERVER': server_date} if server_date else {}
+                if tag == 'CCSTMTRS':
+                    fields['ACCTTYPE'] = 'CREDITCARD'
+                skipping = False
+            continue
+        if current is not None:
+            if tag != 'STMTTRN':
+                current.setdefault(tag, text or '')
+                continue
+            if account is None:
+                account = _ofx_account(fields)
+                yield 'account', account
+            elif not skipping and fields.get('ACCTID', '') != account['number']:
+                skipping = True
+                yield 'error', (
+                    f"Relevé du compte {fields.get('ACCTID', '')} ignoré : "
+                    "un seul compte par fichier"
+                )
+            if not skipping:
+                number += 1
+                try:
+                    yield number, _ofx_transaction(current)
+                except (KeyError, TypeError, ValueError) as e:
+                    yield 'error', f'Opération {number}: {e}'
+            current = None
+        elif text is not None:
+            fields[tag] = text
+    if account is None and 'ACCTID' in fields:
+        yield 'account', _ofx_account(fields)
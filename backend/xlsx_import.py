@@ -0,0 +1,297 @@
+"""Streaming reader for XLSX statements.
+
+The workbook is opened with :mod:`zipfile`. Its shared strings table is read
+with :func:`xml.etree.ElementTree.iterparse` and its first sheet is fed in
+chunks to an expat parser target, so that no element tree is kept and each
+row is released once converted. Rows are lists of strings, dates being
+written as ``YYYY-MM-DD``, so they go through the same mapping logic as
+CSV rows (see :func:`csv_utils.iter_parse_rows`).
+"""
+
+import posixpath
+import re
+import shutil
+import tempfile
+import xml.etree.ElementTree as ET
+import zipfile
+from datetime import date, timedelta
+from itertools import islice
+
+from .csv_utils import iter_parse_rows
+
+_NAMESPACES = (
+    'http://schemas.openxmlformats.org/spreadsheetml/2006/main',
+    'http://purl.oclc.org/ooxml/spreadsheetml/main',
+)
+_REL_NAMESPACES = (
+    'http://schemas.openxmlformats.org/officeDocument/2006/relationships',
+    'http://purl.oclc.org/ooxml/officeDocument/relationships',
+)
+_CELL = {f'{{{ns}}}c' for ns in _NAMESPACES}
+_ROW = {f'{{{ns}}}row' for ns in _NAMESPACES}
+_VALUE = {f'{{{ns}}}v' for ns in _NAMESPACES}
+_SHARED_STRING = {f'{{{ns}}}si' for ns in _NAMESPACES}
+_TEXT = {f'{{{ns}}}t' for ns in _NAMESPACES}
+_RUN = {f'{{{ns}}}r' for ns in _NAMESPACES}
+
+# Built-in number formats displaying dates
+_DATE_FORMAT_IDS = set(range(14, 23)) | set(range(27, 37)) | {45, 46, 47} | set(range(50, 59))
+# Quoted text, escaped characters and [colour]/[locale] sections of a format
+_FORMAT_LITERALS = re.compile(r'"[^"]*"|\\.|\[[^\]]*\]')
+
+# Rows read to detect the header of a sheet
+STRUCTURE_ROWS = 20
+# Bytes of worksheet XML parsed at once
+SHEET_CHUNK_SIZE = 64 * 1024
+
+
+def is_xlsx(archive):
+    """Return ``True`` when the :class:`zipfile.ZipFile` is an XLSX workbook."""
+    return 'xl/workbook.xml' in archive.namelist()
+
+
+def _ns(tag):
+    return tag.partition('}')[0] + '}' if tag.startswith('{') else ''
+
+
+def _workbook(archive):
+    """Return ``(sheet_path, date1904)`` for the first sheet of the workbook."""
+    root = ET.fromstring(archive.read('xl/workbook.xml'))
+    ns = _ns(root.tag)
+    pr = root.find(f'{ns}workbookPr')
+    date1904 = pr is not None and pr.get('date1904') in ('1', 'true')
+    sheet = root.find(f'{ns}sheets/{ns}sheet')
+    path = 'xl/worksheets/sheet1.xml'
+    if sheet is None:
+        return path, date1904
+    rel_id = next((sheet.get(f'{{{rns}}}id') for rns in _REL_NAMESPACES
+                   if sheet.get(f'{{{rns}}}id')), None)
+    try:
+        rels = ET.fromstring(archive.read('xl/_rels/workbook.xml.rels'))
+    except KeyError:
+        return path, date1904
+    for rel in rels:
+        if rel.get('Id') == rel_id:
+            target = rel.get('Target', '')
+            if target.startswith('/'):
+                path = target.lstrip('/')
+            else:
+                path = posixpath.normpath(posixpath.join('xl', target))
+            break
+    return path, date1904
+
+
+def _date_styles(archive):
+    """Return the indexes of the cell styles displaying dates."""
+    try:
+        root = ET.fromstring(archive.read('xl/styles.xml'))
+    except KeyError:
+        return set()
+    ns = _ns(root.tag)
+    custom = set()
+    for fmt in root.iterfind(f'{ns}numFmts/{ns}numFmt'):
+        code = _FORMAT_LITERALS.sub('', fmt.get('formatCode', '')).lower()
+        if 'd' in code or 'y' in code:
+            custom.add(int(fmt.get('numFmtId', -1)))
+    styles = set()
+    for index, xf in enumerate(root.iterfind(f'{ns}cellXfs/{ns}xf')):
+        fmt_id = int(xf.get('numFmtId', 0))
+        if fmt_id in _DATE_FORMAT_IDS or fmt_id in custom:
+            styles.add(index)
+    return styles
+
+
+def _shared_strings(archive):
+    """Return the shared strings table, read as a stream."""
+    try:
+        fh = archive.open('xl/sharedStrings.xml')
+    except KeyError:
+        return []
+    strings = []
+    with fh:
+        context = ET.iterparse(fh, events=('start', 'end'))
+        _, root = next(context)
+        for event, elem in context:
+            if event != 'end' or elem.tag not in _SHARED_STRING:
+                continue
+            # Phonetic runs (rPh) are not part of the displayed text
+            parts = []
+            for child in elem:
+                if child.tag in _TEXT:
+                    parts.append(child.text or '')
+                elif child.tag in _RUN:
+                    for t in child:
+                        if t.tag in _TEXT:
+                            parts.append(t.text or '')
+            strings.append(''.join(parts))
+            root.remove(elem)
+    return strings
+
+
+def _column(ref):
+    index = 0
+    for ch in ref:
+        if 'A' <= ch <= 'Z':
+            index = index * 26 + ord(ch) - 64
+        else:
+            break
+    return index - 1
+
+
+def _seekable(stream):
+    """Return ``stream``, copied to a temporary file when it cannot seek."""
+    if getattr(stream, 'seekable', lambda: False)():
+        return stream
+    spool = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+    shutil.copyfileobj(stream, spool)
+    spool.seek(0)
+    return spool
+
+
+def iter_xlsx_rows(stream):
+    """Yield the rows of the first sheet of an XLSX binary ``stream``.
+
+    Missing rows are yielded as empty lists so that row positions match the
+    sheet. Raise ``ValueError`` when ``stream`` is not a workbook.
+    """
+    stream = _seekable(stream)
+    try:
+        archive = zipfile.ZipFile(stream)
+    except zipfile.BadZipFile as e:
+        raise ValueError(f'Classeur XLSX invalide : {e}') from e
+    with archive:
+        if not is_xlsx(archive):
+            raise ValueError('Classeur XLSX invalide : feuille de calcul absente')
+        path, date1904 = _workbook(archive)
+        strings = _shared_strings(archive)
+        date_styles = _date_styles(archive)
+        epoch = date(1904, 1, 1) if date1904 else date(1899, 12, 30)
+        try:
+            fh = archive.open(path)
+        except KeyError as e:
+            raise ValueError('Classeur XLSX invalide : feuille de calcul absente') from e
+        with fh:
+            yield from _iter_sheet_rows(fh, strings, date_styles, epoch)
+
+
+class _SheetReader:
+    """Parser target turning worksheet XML into rows of strings.
+
+    No element tree is built: cells are converted as their tags close and
+    completed rows are collected in :attr:`rows` for the caller to drain.
+    """
+
+    def __init__(self, strings, date_styles, epoch):
+        self.strings = strings
+        self.date_styles = date_styles
+        self.epoch = epoch
+        self.rows = []
+        self.cells = {}
+        self.row_number = 0
+        self.row_ref = None
+        self.cell = None
+        self.value = ''
+        self.parts = None
+
+    def start(self, tag, attrib):
+        if tag in _CELL:
+            self.cell = attrib
+            self.value = ''
+        elif tag in _VALUE or (tag in _TEXT and self.cell is not None):
+            self.parts = []
+        elif tag in _ROW:
+            self.row_ref = attrib.get('r')
+
+    def data(self, text):
+        if self.parts is not None:
+            self.parts.append(text)
+
+    def end(self, tag):
+        if self.parts is not None:
+            self.value += ''.join(self.parts)
+            self.parts = None
+        elif tag in _CELL:
+            self.cells[self.column(self.cell)] = self.convert(self.cell, self.value)
+            self.cell = None
+        elif tag in _ROW:
+            number = int(self.row_ref) if self.row_ref else self.row_number + 1
+            while self.row_number < number - 1:
+                self.row_number += 1
+                self.rows.append([])
+            self.row_number = number
+            cells = self.cells
+            row = [''] * (max(cells) + 1) if cells else []
+            for index, value in cells.items():
+                row[index] = value
+            self.rows.append(row)
+            self.cells = {}
+
+    def close(self):
+        pass
+
+    def column(self, cell):
+        ref = cell.get('r')
+        return _column(ref) if ref else len(self.cells)
+
+    def convert(self, cell, value):
+        kind = cell.get('t')
+        if kind == 's':
+            return self.strings[int(value)] if value else ''
+        if kind == 'd':
+            return value[:10]
+        if kind in (None, 'n') and value:
+            style = cell.get('s')
+            if style is not None and int(style) in self.date_styles:
+                return (self.epoch + timedelta(days=int(float(value)))).isoformat()
+        return value
+
+
+def _iter_sheet_rows(fh, strings, date_styles, epoch):
+    reader = _SheetReader(strings, date_styles, epoch)
+    parser = ET.XMLParser(target=reader)
+    for chunk in iter(lambda: fh.read(SHEET_CHUNK_SIZE), b''):
+        parser.feed(chunk)
+        if reader.rows:
+            rows, reader.rows = reader.rows, []
+            yield from rows
+    parser.close()
+    yield from reader.rows
+
+
+def _rows_structure(rows):
+    """Return ``(None, header_idx, data_start_idx, columns)`` for sheet ``rows``."""
+    start_index = next((i for i, row in enumerate(rows) if ''.join(row).strip()), None)
+    if start_index is None:
+        return None, None, 0, []
+    header_index = None
+    columns = []
+    for idx in range(start_index, len(rows)):
+        parts = [c.strip().lower() for c in rows[idx]]
+        if any('date' in p for p in parts) and any('montant' in p or 'amount' in p for p in parts):
+            header_index = idx
+            columns = [c.strip() for c in rows[idx]]
+            break
+    data_start_idx = (header_index if header_index is not None else start_index) + 1
+    while data_start_idx < len(rows) and not ''.join(rows[data_start_idx]).strip():
+        data_start_idx += 1
+    return None, header_index, data_start_idx, columns
+
+
+def detect_xlsx_structure(stream, max_rows=STRUCTURE_ROWS):
+    """Detect the header of the first rows of an XLSX ``stream``.
+
+    Return ``(structure, rows)`` like :func:`csv_utils.detect_stream_structure`,
+    the delimiter of ``structure`` being ``None``. The stream is left at its
+    initial position.
+    """
+    start = stream.tell()
+    try:
+        rows = list(islice(iter_xlsx_rows(stream), max_rows))
+    finally:
+        stream.seek(start)
+    return _rows_structure(rows), rows
+
+
+def iter_parse_xlsx(stream, mapping=None):
+    """Parse an XLSX statement and yield the events of :func:`iter_parse_csv`."""
+    yield from iter_parse_rows(iter_xlsx_rows(stream), mapping=mapping)
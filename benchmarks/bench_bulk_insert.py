@@ -0,0 +1,149 @@
+"""Compare the default and bulk insert modes of ``POST /import``.
+
+The benchmark builds a synthetic BNP-style export, imports it in a fresh
+SQLite database with each mode and prints the rows/second achieved for the
+whole request. The insert step alone is also timed for the original import
+loop (``per-row``: one lookup ``SELECT`` and one ORM object per row, each
+row flushed by the next lookup), the current default mode and bulk mode::
+
+    python -m benchmarks.bench_bulk_insert --rows 100000
+"""
+
+import argparse
+import datetime
+import io
+import os
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from backend import models
+from backend.csv_utils import bulk_insert_transactions
+import backend as app_module
+
+
+def synthetic_csv(rows):
+    """Return a BNP-style export with ``rows`` distinct transactions."""
+    start = datetime.date(2015, 1, 1)
+    lines = [
+        'Compte courant;Mon compte;12345678;2024-01-01;;1000,00',
+        '',
+        'Date operation;Libelle court;Type operation;Libelle operation;Montant operation en euro',
+    ]
+    for i in range(rows):
+        day = start + datetime.timedelta(days=i % 3000)
+        lines.append(f'{day.isoformat()};CB;Debit;Achat magasin {i};-{i % 500},{i % 100:02d}')
+    return '\n'.join(lines) + '\n'
+
+
+def fresh_database(directory, name):
+    engine = create_engine(f'sqlite:///{os.path.join(directory, name)}')
+    models.engine = engine
+    models.SessionLocal = sessionmaker(bind=engine, expire_on_commit=False)
+    app_module.SessionLocal = models.SessionLocal
+    models.init_db()
+    return engine
+
+
+def time_request(csv, mode):
+    with app_module.app.test_client() as client:
+        client.post('/login', json={'username': 'admin', 'password': 'admin'})
+        data = {'file': (io.BytesIO(csv.encode('utf-8')), 'bench.csv')}
+        if mode:
+            data['mode'] = mode
+        start = time.perf_counter()
+        resp = client.post('/import', data=data, content_type='multipart/form-data')
+        elapsed = time.perf_counter() - start
+    return resp.get_json()['imported'], elapsed
+
+
+def insert_rows(rows, account_id):
+    day = datetime.date(2020, 1, 1)
+    return [
+        {
+            'date': day,
+            'tx_type': 'Debit',
+            'payment_method': 'CB',
+            'label': f'Achat {i}',
+            'amount': -float(i % 500),
+            'bank_account_id': account_id,
+            'favorite': False,
+            'category_id': None,
+            'subcategory_id': None,
+            'rule_id': None,
+            'reconciled': False,
+            'to_analyze': True,
+            'fingerprint': models.transaction_fingerprint(day, f'Achat {i}', -float(i % 500)),
+        }
+        for i in range(rows)
+    ]
+
+
+def create_account():
+    session = models.SessionLocal()
+    account = models.BankAccount(name='Bench', account_type='Compte courant', number='12345678')
+    session.add(account)
+    session.commit()
+    account_id = account.id
+    session.close()
+    return account_id
+
+
+def time_insert(rows, mode, chunk_size):
+    session = models.SessionLocal()
+    start = time.perf_counter()
+    if mode == 'per-row':
+        for row in rows:
+            session.query(models.Transaction).filter_by(
+                bank_account_id=row['bank_account_id'],
+                fingerprint=row['fingerprint'],
+                date=row['date'],
+                label=row['label'],
+                amount=row['amount'],
+            ).first()
+            session.add(models.Transaction(**row))
+        session.commit()
+    elif mode == 'bulk':
+        for i in range(0, len(rows), chunk_size):
+            bulk_insert_transactions(session, rows[i:i + chunk_size])
+    else:
+        for i in range(0, len(rows), chunk_size):
+            session.add_all(models.Transaction(**row) for row in rows[i:i + chunk_size])
+            session.flush()
+        session.commit()
+    elapsed = time.perf_counter() - start
+    session.close()
+    return elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    args = parser.parse_args(argv)
+
+    csv = synthetic_csv(args.rows)
+    requests = {}
+    inserts = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in ('per-row', 'default', 'bulk'):
+            if mode != 'per-row':
+                fresh_database(tmp, f'request-{mode}.db')
+                imported, elapsed = time_request(csv, 'bulk' if mode == 'bulk' else None)
+                requests[mode] = imported / elapsed
+            fresh_database(tmp, f'insert-{mode}.db')
+            rows = insert_rows(args.rows, create_account())
+            inserts[mode] = args.rows / time_insert(rows, mode, args.chunk_size)
+            request = f'{requests[mode]:10.0f}' if mode in requests else ' ' * 10
+            print(f'{mode:7s} request: {request} rows/s   insert: {inserts[mode]:10.0f} rows/s')
+    print(
+        f'bulk speedup request: x{requests["bulk"] / requests["default"]:.1f} (default mode)   '
+        f'insert: x{inserts["bulk"] / inserts["per-row"]:.1f} (per-row), '
+        f'x{inserts["bulk"] / inserts["default"]:.1f} (default mode)'
+    )
+
+
+if __name__ == '__main__':
+    main()
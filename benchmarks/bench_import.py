@@ -0,0 +1,236 @@
+"""Time the phases of ``POST /import`` on synthetic exports.
+
+For each size the export of :mod:`benchmarks.generator` is decoded, parsed,
+checked against the rows already stored, categorised and inserted, each
+phase being timed alone, then imported through the ``/import`` route. Times
+are compared with a baseline file so that regressions show up::
+
+    python -m benchmarks.bench_import --sizes 10000 100000 1000000
+    python -m benchmarks.bench_import --save    # record the baseline
+
+The command exits with status 1 when a phase is slower than the baseline by
+more than ``--tolerance``.
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from backend import config, models
+from backend.csv_utils import (
+    ExistingKeys,
+    bulk_insert_transactions,
+    collect_events,
+    iter_decoded_lines,
+    iter_parse_csv,
+    sniff_encoding,
+)
+from backend.importer import NO_RULE, find_or_create_account
+from backend.rule_matcher import get_rule_matcher, invalidate_rule_matcher
+import backend as app_module
+
+from .generator import generate_export
+
+PHASES = ('decode', 'parse', 'dedupe', 'rules', 'insert', 'request')
+SIZES = (10000, 100000, 1000000)
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+# Rules matching the merchants of the generator vocabulary; cheques stay uncategorised
+RULE_PATTERNS = (
+    'CARREFOUR', 'MONOPRIX', 'BOULANGERIE', 'SNCF', 'AMAZON', 'TOTAL ENERGIES',
+    'PHARMACIE', 'RESTAURANT', 'EDF', 'FREE MOBILE', 'MAIF', 'DGFIP', 'SALAIRE',
+    'CAF', 'LOYER', 'RETRAIT DAB',
+)
+
+
+def fresh_database(directory, name):
+    engine = create_engine(f'sqlite:///{os.path.join(directory, name)}')
+    models.engine = engine
+    models.SessionLocal = sessionmaker(bind=engine, expire_on_commit=False)
+    app_module.SessionLocal = models.SessionLocal
+    models.init_db()
+    invalidate_rule_matcher()
+    return engine
+
+
+def add_rules(session, extra=200):
+    """Store one rule per merchant of the vocabulary plus ``extra`` unused ones."""
+    categories = session.query(models.Category).order_by(models.Category.id).all()
+    if not categories:
+        categories = [models.Category(name='Benchmark')]
+        session.add_all(categories)
+        session.flush()
+    patterns = list(RULE_PATTERNS)
+    patterns += [f'MARCHAND INCONNU {i}' for i in range(extra)]
+    session.add_all(
+        models.Rule(pattern=p, category_id=categories[i % len(categories)].id)
+        for i, p in enumerate(patterns)
+    )
+    session.commit()
+    invalidate_rule_matcher()
+
+
+def bench_size(directory, rows, duplicate_ratio, stored_ratio):
+    """Return the seconds spent in each phase for an export of ``rows`` operations."""
+    data = generate_export(rows, duplicate_ratio=duplicate_ratio).encode('utf-8')
+    timings = {}
+
+    start = time.perf_counter()
+    encoding, stream = sniff_encoding(io.BytesIO(data))
+    lines = list(iter_decoded_lines(stream, encoding))
+    timings['decode'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    transactions, _, _, account_info = collect_events(iter_parse_csv(lines))
+    timings['parse'] = time.perf_counter() - start
+    del lines
+
+    fresh_database(directory, f'phases-{rows}.db')
+    session = models.SessionLocal()
+    account = find_or_create_account(session, account_info)
+    add_rules(session)
+    # Part of the export is already stored, as when statements overlap
+    stored = transactions[:int(len(transactions) * stored_ratio)]
+    bulk_insert_transactions(session, [
+        {
+            'date': t['date'],
+            'tx_type': t['type'],
+            'payment_method': t['payment_method'],
+            'label': t['label'],
+            'amount': t['amount'],
+            'bank_account_id': account.id,
+            'fingerprint': models.transaction_fingerprint(t['date'], t['label'], t['amount']),
+        }
+        for t in stored
+    ])
+    chunk_size = config.IMPORT_CHUNK_SIZE
+
+    start = time.perf_counter()
+    existing = ExistingKeys(session, account.id)
+    fresh = []
+    for i in range(0, len(transactions), chunk_size):
+        batch = transactions[i:i + chunk_size]
+        fingerprints = [
+            models.transaction_fingerprint(t['date'], t['label'], t['amount']) for t in batch
+        ]
+        existing.load(fingerprints)
+        fresh.extend(
+            (t, fp) for t, fp in zip(batch, fingerprints)
+            if (t['date'], t['label'], t['amount']) not in existing
+        )
+    timings['dedupe'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    matcher = get_rule_matcher(session)
+    rules = [matcher.match(t['label']) or NO_RULE for t, _ in fresh]
+    timings['rules'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    new_rows = [
+        {
+            'date': t['date'],
+            'tx_type': t['type'],
+            'payment_method': t['payment_method'],
+            'label': t['label'],
+            'amount': t['amount'],
+            'bank_account_id': account.id,
+            'favorite': False,
+            'category_id': rule[2],
+            'subcategory_id': rule[3],
+            'rule_id': rule[0],
+            'reconciled': t['reconciled'],
+            'to_analyze': t['to_analyze'],
+            'fingerprint': fingerprint,
+        }
+        for (t, fingerprint), rule in zip(fresh, rules)
+    ]
+    for i in range(0, len(new_rows), chunk_size):
+        bulk_insert_transactions(session, new_rows[i:i + chunk_size])
+    timings['insert'] = time.perf_counter() - start
+    session.close()
+    del transactions, fresh, new_rows
+
+    fresh_database(directory, f'request-{rows}.db')
+    session = models.SessionLocal()
+    add_rules(session)
+    session.close()
+    with app_module.app.test_client() as client:
+        client.post('/login', json={'username': 'admin', 'password': 'admin'})
+        start = time.perf_counter()
+        resp = client.post(
+            '/import',
+            data={'file': (io.BytesIO(data), 'bench.csv')},
+            content_type='multipart/form-data',
+        )
+        timings['request'] = time.perf_counter() - start
+    if resp.status_code != 200:
+        raise RuntimeError(f'/import a échoué : {resp.get_json()}')
+    return timings
+
+
+def compare(results, baseline, tolerance):
+    """Return the ``(size, phase, seconds, baseline)`` entries slower than allowed."""
+    regressions = []
+    for size, timings in results.items():
+        reference = baseline.get('sizes', {}).get(size, {})
+        for phase, seconds in timings.items():
+            expected = reference.get(phase)
+            if expected and seconds > expected * (1 + tolerance):
+                regressions.append((size, phase, seconds, expected))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(SIZES))
+    parser.add_argument('--duplicates', type=float, default=0.02,
+                        help='share of rows repeated within the export')
+    parser.add_argument('--stored', type=float, default=0.1,
+                        help='share of the export already stored before the import')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save', action='store_true', help='write the baseline file')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed slowdown before reporting a regression')
+    args = parser.parse_args(argv)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in args.sizes:
+            timings = bench_size(tmp, rows, args.duplicates, args.stored)
+            results[str(rows)] = {phase: round(timings[phase], 4) for phase in PHASES}
+            print(f'{rows:>8d} rows  ' + '  '.join(
+                f'{phase}: {rows / timings[phase]:>9.0f} rows/s' for phase in PHASES
+            ))
+
+    if args.save:
+        with open(args.baseline, 'w', encoding='utf-8') as fh:
+            json.dump({
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'cpus': os.cpu_count(),
+                'sizes': results,
+            }, fh, indent=2)
+            fh.write('\n')
+        print(f'Baseline written to {args.baseline}')
+        return 0
+
+    if not os.path.exists(args.baseline):
+        return 0
+    with open(args.baseline, encoding='utf-8') as fh:
+        baseline = json.load(fh)
+    regressions = compare(results, baseline, args.tolerance)
+    for size, phase, seconds, expected in regressions:
+        print(f'REGRESSION {size} rows {phase}: {seconds:.3f}s (baseline {expected:.3f}s)')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,125 @@
+"""Generate synthetic BNP-style exports for benchmarks.
+
+Each export is read by :func:`backend.csv_utils.parse_csv` in header mode:
+an account row, a blank line, the column header then one row per operation
+in the default column order. Labels are drawn from a vocabulary of
+merchants and a share of the rows repeat an earlier row of the file::
+
+    python -m benchmarks.generator --rows 100000 --accounts 3 --out /tmp/exports
+"""
+
+import argparse
+import datetime
+import os
+import random
+
+HEADER = 'Date operation;Type operation;Moyen;Libelle operation;Montant operation en euro'
+
+# (payment method, label template, lowest amount, highest amount)
+VOCABULARY = (
+    ('CB', 'FACTURE CARTE DU {day} CARREFOUR MARKET {ref}', -180, -5),
+    ('CB', 'FACTURE CARTE DU {day} MONOPRIX {ref}', -90, -3),
+    ('CB', 'FACTURE CARTE DU {day} BOULANGERIE DU MARCHE', -15, -1),
+    ('CB', 'FACTURE CARTE DU {day} SNCF INTERNET {ref}', -150, -10),
+    ('CB', 'FACTURE CARTE DU {day} AMAZON EU SARL {ref}', -250, -5),
+    ('CB', 'FACTURE CARTE DU {day} TOTAL ENERGIES STATION', -90, -20),
+    ('CB', 'FACTURE CARTE DU {day} PHARMACIE CENTRALE', -60, -3),
+    ('CB', 'FACTURE CARTE DU {day} RESTAURANT LE PETIT ZINC', -80, -12),
+    ('PRLV', 'PRLV SEPA EDF CLIENTS PARTICULIERS ECH/{day} REF {ref}', -160, -40),
+    ('PRLV', 'PRLV SEPA FREE MOBILE ECH/{day} REF {ref}', -30, -10),
+    ('PRLV', 'PRLV SEPA MAIF ASSURANCES ECH/{day} REF {ref}', -90, -30),
+    ('PRLV', 'PRLV SEPA DGFIP IMPOT ECH/{day} REF {ref}', -400, -50),
+    ('VIR', 'VIR SEPA RECU /DE EMPLOYEUR SA /MOTIF SALAIRE {ref}', 1800, 3500),
+    ('VIR', 'VIR SEPA RECU /DE CAF /MOTIF PRESTATIONS {ref}', 100, 400),
+    ('VIR', 'VIR SEPA EMIS /MOTIF LOYER /BEN AGENCE IMMO {ref}', -1200, -600),
+    ('RET', 'RETRAIT DAB {day} AGENCE CENTRE {ref}', -200, -20),
+    ('CHQ', 'CHEQUE {ref}', -500, -15),
+)
+
+
+def _amount(value):
+    return f'{value:.2f}'.replace('.', ',')
+
+
+def generate_export(
+    rows,
+    account_number='12345678',
+    account_type='Compte courant',
+    vocabulary=VOCABULARY,
+    duplicate_ratio=0.0,
+    start=datetime.date(2015, 1, 1),
+    seed=0,
+):
+    """Return an export of ``rows`` operations as text.
+
+    About ``duplicate_ratio`` of the rows repeat an earlier row of the file
+    and are reported as duplicates by the parser. ``vocabulary`` holds
+    ``(payment_method, template, low, high)`` tuples, the template being
+    formatted with ``day`` and ``ref``. The same ``seed`` gives the same
+    export.
+    """
+    rnd = random.Random(f'{seed}-{account_number}')
+    # Operations span about eight years, the export being dated from the last one
+    end = start + datetime.timedelta(days=3000)
+    lines = [
+        f'{account_type};Mon compte;{account_number};{end.isoformat()};;1000,00',
+        '',
+        HEADER,
+    ]
+    written = []
+    for i in range(rows):
+        if written and rnd.random() < duplicate_ratio:
+            line = rnd.choice(written)
+        else:
+            method, template, low, high = rnd.choice(vocabulary)
+            day = start + datetime.timedelta(days=i * 3000 // max(rows, 1))
+            label = template.format(day=day.strftime('%d/%m'), ref=rnd.randrange(10 ** 6))
+            amount = rnd.randrange(low * 100, high * 100 + 1) / 100
+            kind = 'Credit' if amount > 0 else 'Debit'
+            line = f'{day.strftime("%d/%m/%Y")};{kind};{method};{label};{_amount(amount)}'
+            written.append(line)
+        lines.append(line)
+    return '\n'.join(lines) + '\n'
+
+
+def write_exports(directory, rows, accounts=1, encoding='utf-8', **options):
+    """Write one export of ``rows`` operations per account in ``directory``.
+
+    ``options`` are passed to :func:`generate_export`. Return the paths of
+    the written files.
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for index in range(accounts):
+        number = f'{12345678 + index:08d}'
+        path = os.path.join(directory, f'export-{number}.csv')
+        with open(path, 'w', encoding=encoding, newline='') as fh:
+            fh.write(generate_export(rows, account_number=number, **options))
+        paths.append(path)
+    return paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=10000, help='operations per account')
+    parser.add_argument('--accounts', type=int, default=1)
+    parser.add_argument('--duplicates', type=float, default=0.0, help='share of repeated rows')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--encoding', default='utf-8')
+    parser.add_argument('--out', default='.', help='output directory')
+    args = parser.parse_args(argv)
+
+    paths = write_exports(
+        args.out,
+        args.rows,
+        accounts=args.accounts,
+        encoding=args.encoding,
+        duplicate_ratio=args.duplicates,
+        seed=args.seed,
+    )
+    for path in paths:
+        print(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,4 @@
+import multiprocessing
 import socket
 
 from backend import run as backend_run
@@ -16,6 +17,8 @@ def find_available_port(start_port=5000, max_tries=20):
 
 
 if __name__ == '__main__':
+    # Needed by the batch import process pool in frozen executables
+    multiprocessing.freeze_support()
     port = find_available_port(5000)
     print(f"Running on http://localhost:{port}")
     backend_run(port=port)
@@ -0,0 +1,124 @@
+import io
+import json
+import zipfile
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from backend import cli, models
+import backend as app_module
+
+
+@pytest.fixture
+def client():
+    engine = create_engine('sqlite:///:memory:')
+    models.engine = engine
+    models.SessionLocal = sessionmaker(bind=engine, expire_on_commit=False)
+    app_module.SessionLocal = models.SessionLocal
+    models.init_db()
+    with app_module.app.test_client() as client:
+        yield client
+
+
+def login(client):
+    resp = client.post('/login', json={'username': 'admin', 'password': 'admin'})
+    assert resp.status_code == 200
+
+
+JANUARY = """Compte courant 12345678 2021-02-01
+2021-01-02;Debit;CB;Achat;-12,34
+2021-01-30;Credit;VIR;Salaire;1000,00
+"""
+
+FEBRUARY = """Compte courant 12345678 2021-03-01
+2021-01-30;Credit;VIR;Salaire;1000,00
+2021-02-03;Debit;CB;Boulangerie;-3,10
+"""
+
+SAVINGS = """Livret A 87654321 2021-03-01
+2021-02-15;Credit;VIR;Epargne;50,00
+"""
+
+
+def zipped(**members):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w') as archive:
+        for name, content in members.items():
+            archive.writestr(name, content)
+    return buf.getvalue()
+
+
+def test_batch_merges_files_per_account(client):
+    login(client)
+    data = {
+        'files': [
+            (io.BytesIO(JANUARY.encode('utf-8')), 'janvier.csv'),
+            (io.BytesIO(zipped(**{'fevrier.csv': FEBRUARY, 'livret.csv': SAVINGS})), 'mars.zip'),
+        ],
+    }
+    resp = client.post('/import/batch', data=data, content_type='multipart/form-data')
+    assert resp.status_code == 200
+    report = resp.get_json()
+    assert report['imported'] == 4
+
+    files = {f['filename']: f for f in report['files']}
+    assert set(files) == {'janvier.csv', 'mars.zip/fevrier.csv', 'mars.zip/livret.csv'}
+    assert files['janvier.csv']['imported'] == 2
+    assert files['mars.zip/fevrier.csv']['imported'] == 1
+    assert [d['label'] for d in files['mars.zip/fevrier.csv']['duplicates']] == ['Salaire']
+    assert files['mars.zip/livret.csv']['account']['number'] == '87654321'
+    assert files['janvier.csv']['account'] == files['mars.zip/fevrier.csv']['account']
+    # The latest export date describes the account
+    assert files['janvier.csv']['account']['export_date'] == '2021-03-01'
+
+    session = models.SessionLocal()
+    assert session.query(models.BankAccount).count() == 2
+    assert session.query(models.Transaction).count() == 4
+    session.close()
+
+    again = client.post(
+        '/import/batch',
+        data={'files': [(io.BytesIO(FEBRUARY.encode('utf-8')), 'fevrier.csv')]},
+        content_type='multipart/form-data',
+    ).get_json()
+    assert again['imported'] == 0
+    assert again['files'][0]['already_imported'] is True
+
+    forced = client.post(
+        '/import/batch',
+        data={'files': [(io.BytesIO(FEBRUARY.encode('utf-8')), 'fevrier.csv')], 'force': 'true'},
+        content_type='multipart/form-data',
+    ).get_json()
+    assert forced['imported'] == 0
+    assert len(forced['files'][0]['duplicates']) == 2
+
+
+def test_batch_reports_undecodable_file(client):
+    login(client)
+    data = {
+        'files': [
+            (io.BytesIO(b'\xff\xfe\xfa'), 'bad.csv'),
+            (io.BytesIO(SAVINGS.encode('utf-8')), 'livret.csv'),
+        ],
+    }
+    report = client.post('/import/batch', data=data, content_type='multipart/form-data').get_json()
+    files = {f['filename']: f for f in report['files']}
+    assert files['bad.csv']['errors']
+    assert files['livret.csv']['imported'] == 1
+
+
+def test_batch_requires_files(client):
+    login(client)
+    resp = client.post('/import/batch', data={}, content_type='multipart/form-data')
+    assert resp.status_code == 400
+
+
+def test_cli_import(client, tmp_path, capsys):
+    first = tmp_path / 'janvier.csv'
+    first.write_text(JANUARY, encoding='utf-8')
+    second = tmp_path / 'fevrier.csv'
+    second.write_text(FEBRUARY, encoding='utf-8')
+    assert cli.main(['import', str(first), str(second), '--workers', '2']) == 0
+    report = json.loads(capsys.readouterr().out)
+    assert report['imported'] == 3
+    assert [f['imported'] for f in report['files']] == [2, 1]
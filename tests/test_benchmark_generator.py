@@ -0,0 +1,36 @@
+from benchmarks.bench_import import compare
+from benchmarks.generator import generate_export, write_exports
+from backend.csv_utils import parse_csv
+
+
+def test_generated_export_is_parsed_in_header_mode():
+    transactions, duplicates, errors, account = parse_csv(
+        generate_export(2000, account_number='87654321', duplicate_ratio=0.1)
+    )
+    assert errors == []
+    assert account['number'] == '87654321'
+    assert account['initial_balance'] == 1000.0
+    assert len(transactions) + len(duplicates) == 2000
+    assert 100 < len(duplicates) < 300
+    assert {t['payment_method'] for t in transactions} >= {'CB', 'PRLV', 'VIR'}
+
+
+def test_generated_export_is_reproducible():
+    assert generate_export(100, seed=3) == generate_export(100, seed=3)
+    assert generate_export(100, seed=3) != generate_export(100, seed=4)
+
+
+def test_write_exports_one_file_per_account(tmp_path):
+    paths = write_exports(tmp_path, 10, accounts=3, encoding='cp1252')
+    numbers = set()
+    for path in paths:
+        with open(path, 'rb') as fh:
+            numbers.add(parse_csv(fh, encoding='cp1252')[3]['number'])
+    assert len(paths) == 3
+    assert len(numbers) == 3
+
+
+def test_compare_reports_slower_phases():
+    baseline = {'sizes': {'10000': {'parse': 1.0, 'insert': 2.0}}}
+    results = {'10000': {'parse': 1.5, 'insert': 2.1, 'request': 9.0}}
+    assert compare(results, baseline, 0.25) == [('10000', 'parse', 1.5, 1.0)]
@@ -1,6 +1,7 @@
 import datetime
+import io
 
-from backend.csv_utils import detect_csv_structure
+from backend.csv_utils import detect_csv_structure, detect_stream_structure
 
 
 def test_detect_header_after_blank():
@@ -74,3 +75,56 @@ def test_detect_delimiter_from_middle():
     assert delim == ';'
     assert header_idx is None
     assert data_idx == 1
+
+
+class CountingStream(io.BytesIO):
+    """Binary stream recording how many bytes were read."""
+
+    bytes_read = 0
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self.bytes_read += len(data)
+        return data
+
+
+def test_stream_detection_matches_text_detection():
+    samples = [
+        "Compte courant;Mon compte;12345678;2021-01-01;;1000,00\n\n"
+        "Date operation;Libelle;Montant\n2021-01-02;Achat;-12,34\n",
+        "Compte courant 12345678 2021-01-01\n2021-01-02;Debit;CB;Achat;-12,34\n",
+        "\n  Date\t Type \t Montant  \n2021-01-02\t Debit \t -12.34\n",
+        "",
+    ]
+    for csv_data in samples:
+        structure, lines = detect_stream_structure(io.BytesIO(csv_data.encode('utf-8')))
+        assert structure == detect_csv_structure(csv_data)
+        assert lines == csv_data.splitlines()
+
+
+def test_stream_detection_reads_bounded_sample():
+    lines = ["Compte courant 12345678 2021-01-01", "Date;Libelle;Montant"]
+    for i in range(200000):
+        lines.append(f"2021-01-{i % 28 + 1:02d};Achat numéro {i};-{i % 90 + 1},00")
+    data = ("\n".join(lines) + "\n").encode('utf-8')
+    stream = CountingStream(data)
+
+    structure, prefix = detect_stream_structure(stream, prefix_size=4096, sample_size=1024)
+    assert structure == (';', 1, 2, ['Date', 'Libelle', 'Montant'])
+    assert stream.bytes_read <= 4096 + 1024
+    assert stream.tell() == 0
+    assert prefix == lines[:len(prefix)]
+    assert len(prefix) > 5
+
+
+def test_stream_detection_uses_middle_sample():
+    lines = ["Compte courant 12345678 2021-01-01"]
+    for i in range(12):
+        lines.append(f"2021-01-{i+2:02d},Achat,-{i+1}.00")
+    for i in range(12, 2000):
+        lines.append(f"2021-01-{i % 28 + 1:02d};Debit;CB;Achat;-{i+1},00")
+    data = ("\n".join(lines) + "\n").encode('utf-8')
+    head, _ = detect_stream_structure(io.BytesIO(data), prefix_size=300, sample_size=0)
+    assert head[0] == ','
+    structure, _ = detect_stream_structure(io.BytesIO(data), prefix_size=300, sample_size=500)
+    assert structure[0] == ';'
@@ -0,0 +1,86 @@
+import io
+import json
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from backend import models
+import backend as app_module
+
+
+@pytest.fixture
+def client():
+    engine = create_engine('sqlite:///:memory:')
+    models.engine = engine
+    models.SessionLocal = sessionmaker(bind=engine, expire_on_commit=False)
+    app_module.SessionLocal = models.SessionLocal
+    models.init_db()
+    session = models.SessionLocal()
+    cat = models.Category(name='Courses')
+    session.add(cat)
+    session.flush()
+    session.add(models.Rule(pattern='MARCHE', category_id=cat.id))
+    session.commit()
+    cat_id = cat.id
+    session.close()
+    with app_module.app.test_client() as client:
+        client.cat_id = cat_id
+        yield client
+
+
+def login(client):
+    resp = client.post('/login', json={'username': 'admin', 'password': 'admin'})
+    assert resp.status_code == 200
+
+
+CSV = """Compte courant 12345678 2021-01-01
+2021-01-02;Debit;CB;Marche du dimanche;-12,34
+2021-01-03;Credit;VIR;Salaire;1000,00
+2021-01-04;Debit;CB;Boulangerie;-3,10
+2021-01-04;Debit;CB;Boulangerie;-3,10
+2021-01-05;Debit;CB;Pharmacie;-8,00
+"""
+
+
+def import_file(client, csv, **form):
+    data = {'file': (io.BytesIO(csv.encode('utf-8')), 'test.csv'), **form}
+    return client.post('/import', data=data, content_type='multipart/form-data')
+
+
+def test_bulk_import_inserts_in_chunks(client):
+    login(client)
+    resp = import_file(client, CSV, mode='bulk', chunk_size='2')
+    assert resp.status_code == 200
+    data = resp.get_json()
+    assert data['imported'] == 4
+    assert len(data['duplicates']) == 1
+
+    session = models.SessionLocal()
+    txs = session.query(models.Transaction).order_by(models.Transaction.date).all()
+    session.close()
+    assert len(txs) == 4
+    assert all(t.bank_account_id == data['account']['id'] for t in txs)
+    assert txs[0].category_id == client.cat_id
+    assert txs[0].favorite is False
+    assert txs[1].category_id is None
+
+    again = import_file(client, CSV, mode='bulk', force='true')
+    assert again.get_json()['imported'] == 0
+    assert len(again.get_json()['duplicates']) == 5
+
+
+def test_bulk_import_rejects_invalid_chunk_size(client):
+    login(client)
+    resp = import_file(client, CSV, mode='bulk', chunk_size='abc')
+    assert resp.status_code == 400
+    session = models.SessionLocal()
+    assert session.query(models.Transaction).count() == 0
+    session.close()
+
+
+def test_bulk_import_with_mapping(client):
+    login(client)
+    csv = "Compte courant 12345678 2021-01-01\nAchat;Debit;2021-01-02;-12,34;CB\n"
+    mapping = {'label': 0, 'type': 1, 'date': 2, 'amount': 3, 'payment_method': 4}
+    resp = import_file(client, csv, mode='bulk', mapping=json.dumps(mapping))
+    assert resp.get_json()['imported'] == 1
@@ -0,0 +1,106 @@
+import io
+
+import pytest
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import sessionmaker
+
+from backend import config, models
+import backend as app_module
+
+
+@pytest.fixture
+def client():
+    engine = create_engine('sqlite:///:memory:')
+    models.engine = engine
+    models.SessionLocal = sessionmaker(bind=engine, expire_on_commit=False)
+    app_module.SessionLocal = models.SessionLocal
+    models.init_db()
+    with app_module.app.test_client() as client:
+        client.engine = engine
+        yield client
+
+
+def login(client):
+    resp = client.post('/login', json={'username': 'admin', 'password': 'admin'})
+    assert resp.status_code == 200
+
+
+def create_account(client):
+    csv = "Compte courant 12345678 2021-03-01\n2021-01-01;Debit;CB;Achat 1;-1,00\n"
+    data = {'file': (io.BytesIO(csv.encode('utf-8')), 'test.csv')}
+    resp = client.post('/import', data=data, content_type='multipart/form-data')
+    return resp.get_json()['account']['id']
+
+
+def rows(count, label='Achat'):
+    return [
+        {'date': f'2021-02-{1 + i % 28:02d}', 'label': f'{label} {i}', 'amount': -i - 0.5}
+        for i in range(count)
+    ]
+
+
+def test_confirm_rejects_unknown_account(client):
+    login(client)
+    for account_id in (999, 'abc'):
+        resp = client.post('/import/confirm', json={'transactions': rows(2), 'account_id': account_id})
+        assert resp.status_code == 400
+        assert resp.get_json() == {'error': 'invalid account'}
+    session = models.SessionLocal()
+    assert session.query(models.Transaction).count() == 0
+    session.close()
+
+
+def test_confirm_reports_invalid_rows(client):
+    login(client)
+    acc_id = create_account(client)
+    payload = rows(2) + [
+        {'date': '01/02/2021', 'label': 'Mauvaise date', 'amount': -1},
+        {'date': '2021-02-01', 'label': 'Sans montant', 'amount': 'abc'},
+        {'date': '2021-2-5', 'label': 'Date courte', 'amount': -2},
+    ]
+    resp = client.post('/import/confirm', json={'transactions': payload, 'account_id': acc_id})
+    assert resp.status_code == 400
+    assert resp.get_json() == {'imported': 3, 'errors': ['Date invalide', 'Montant invalide']}
+
+
+def test_failing_chunk_keeps_other_chunks(client, monkeypatch):
+    login(client)
+    acc_id = create_account(client)
+    with client.engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TRIGGER reject_label BEFORE INSERT ON transactions "
+            "WHEN NEW.label = 'Refus 0' BEGIN SELECT RAISE(ABORT, 'libellé refusé'); END"
+        ))
+    monkeypatch.setattr(config, 'IMPORT_CHUNK_SIZE', 3)
+    payload = rows(4) + rows(1, label='Refus') + rows(4, label='Autre')
+    resp = client.post('/import/confirm', json={'transactions': payload, 'account_id': acc_id})
+    assert resp.status_code == 400
+    body = resp.get_json()
+    assert body['imported'] == 6
+    assert body['errors'] == ['Lignes 4 à 6 : libellé refusé']
+
+    session = models.SessionLocal()
+    labels = {t.label for t in session.query(models.Transaction)}
+    session.close()
+    assert {'Achat 0', 'Achat 2', 'Autre 1', 'Autre 3'} <= labels
+    assert 'Achat 3' not in labels and 'Refus 0' not in labels
+
+
+def test_confirm_inserts_by_chunks(client, monkeypatch):
+    login(client)
+    acc_id = create_account(client)
+    monkeypatch.setattr(config, 'IMPORT_CHUNK_SIZE', 100)
+    statements = []
+
+    def before(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(client.engine, 'before_cursor_execute', before)
+    try:
+        resp = client.post('/import/confirm', json={'transactions': rows(250), 'account_id': acc_id})
+    finally:
+        event.remove(client.engine, 'before_cursor_execute', before)
+    assert resp.status_code == 200
+    assert resp.get_json() == {'imported': 250}
+    inserts = [s for s in statements if s.lstrip().startswith('INSERT INTO transactions (')]
+    assert len(inserts) == 3
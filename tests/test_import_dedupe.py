@@ -0,0 +1,91 @@
+import io
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from backend import config, models
+import backend as app_module
+
+
+@pytest.fixture
+def client():
+    engine = create_engine('sqlite:///:memory:')
+    models.engine = engine
+    models.SessionLocal = sessionmaker(bind=engine, expire_on_commit=False)
+    app_module.SessionLocal = models.SessionLocal
+    models.init_db()
+    with app_module.app.test_client() as client:
+        client.engine = engine
+        yield client
+
+
+def login(client):
+    resp = client.post('/login', json={'username': 'admin', 'password': 'admin'})
+    assert resp.status_code == 200
+
+
+def make_csv(days):
+    lines = ["Compte courant 12345678 2021-03-01"]
+    for day in days:
+        lines.append(f"2021-01-{day:02d};Debit;CB;Achat {day};-{day},00")
+    return "\n".join(lines) + "\n"
+
+
+def import_file(client, csv):
+    data = {'file': (io.BytesIO(csv.encode('utf-8')), 'test.csv')}
+    return client.post('/import', data=data, content_type='multipart/form-data')
+
+
+def count_queries(client, func):
+    statements = []
+
+    def before(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(client.engine, 'before_cursor_execute', before)
+    try:
+        result = func()
+    finally:
+        event.remove(client.engine, 'before_cursor_execute', before)
+    return result, statements
+
+
+def test_import_dedupe_uses_constant_queries(client, monkeypatch):
+    login(client)
+    assert import_file(client, make_csv(range(1, 6))).status_code == 200
+
+    monkeypatch.setattr(config, 'IMPORT_BATCH_SIZE', 1000)
+    small, small_sql = count_queries(client, lambda: import_file(client, make_csv(range(1, 8))))
+    big, big_sql = count_queries(client, lambda: import_file(client, make_csv(range(1, 29))))
+
+    assert small.get_json()['imported'] == 2
+    assert len(small.get_json()['duplicates']) == 5
+    assert big.get_json()['imported'] == 21
+    assert len(big.get_json()['duplicates']) == 7
+    selects = [s for s in big_sql if s.lstrip().upper().startswith('SELECT')]
+    assert len(selects) == len([s for s in small_sql if s.lstrip().upper().startswith('SELECT')])
+
+
+def test_import_dedupe_across_batches(client, monkeypatch):
+    login(client)
+    assert import_file(client, make_csv([3, 9])).status_code == 200
+
+    monkeypatch.setattr(config, 'IMPORT_BATCH_SIZE', 2)
+    resp = import_file(client, make_csv([10, 9, 8, 4, 3, 2]))
+    data = resp.get_json()
+    assert resp.status_code == 200
+    assert data['imported'] == 4
+    assert sorted(d['label'] for d in data['duplicates']) == ['Achat 3', 'Achat 9']
+
+
+def test_confirm_skips_existing_rows(client):
+    login(client)
+    acc_id = import_file(client, make_csv([1])).get_json()['account']['id']
+    rows = [
+        {'date': '2021-01-01', 'label': 'Achat 1', 'amount': -1.0},
+        {'date': '2021-01-02', 'label': 'Nouveau', 'amount': -2.0},
+        {'date': '2021-01-02', 'label': 'Nouveau', 'amount': -2.0},
+    ]
+    resp = client.post('/import/confirm', json={'transactions': rows, 'account_id': acc_id})
+    assert resp.status_code == 200
+    assert resp.get_json()['imported'] == 1
@@ -0,0 +1,106 @@
+import codecs
+import io
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from backend import models
+from backend.csv_utils import detect_encoding, sniff_encoding
+import backend as app_module
+
+
+CSV = (
+    "Compte courant;Mon compte;12345678;2021-01-01;;1000,00\n"
+    "\n"
+    "Date;Type;Moyen;Libellé;Montant\n"
+    "2021-01-02;Debit;CB;Café crème;-12,34\n"
+    "2021-01-03;Credit;VIR;Prime été;100,00\n"
+)
+
+
+@pytest.fixture
+def client():
+    engine = create_engine('sqlite:///:memory:')
+    models.engine = engine
+    models.SessionLocal = sessionmaker(bind=engine, expire_on_commit=False)
+    app_module.SessionLocal = models.SessionLocal
+    models.init_db()
+    with app_module.app.test_client() as client:
+        yield client
+
+
+def login(client):
+    resp = client.post('/login', json={'username': 'admin', 'password': 'admin'})
+    assert resp.status_code == 200
+
+
+def post_file(client, url, data, **fields):
+    fields['file'] = (io.BytesIO(data), 'test.csv')
+    return client.post(url, data=fields, content_type='multipart/form-data')
+
+
+def test_detect_encoding():
+    assert detect_encoding(codecs.BOM_UTF8 + b'abc') == 'utf-8-sig'
+    assert detect_encoding('é'.encode('utf-16')) == 'utf-16'
+    assert detect_encoding('Café'.encode('utf-8')) == 'utf-8'
+    # A multi-byte character cut at the end of the sample is still UTF-8
+    assert detect_encoding('Café'.encode('utf-8')[:-1]) == 'utf-8'
+    assert detect_encoding('Café €'.encode('cp1252')) == 'cp1252'
+    assert detect_encoding(b'Caf\xe9 \x81') == 'latin-1'
+
+
+def test_sniff_encoding_keeps_stream_position():
+    class Unseekable:
+        def __init__(self, data):
+            self.raw = io.BytesIO(data)
+
+        def read(self, size=-1):
+            return self.raw.read(size)
+
+    data = CSV.encode('cp1252')
+    for stream in (io.BytesIO(data), Unseekable(data)):
+        encoding, stream = sniff_encoding(stream, sample_size=100)
+        assert encoding == 'cp1252'
+        assert stream.read() == data
+
+
+@pytest.mark.parametrize('encoding', ['utf-8', 'utf-8-sig', 'cp1252', 'latin-1', 'utf-16'])
+def test_import_detects_encoding(client, encoding):
+    login(client)
+    data = CSV.encode(encoding)
+
+    resp = post_file(client, '/import/preset', data)
+    assert resp.status_code == 200
+    assert resp.get_json()['columns'][3] == 'Libellé'
+
+    resp = post_file(client, '/import', data)
+    assert resp.status_code == 200
+    assert resp.get_json()['imported'] == 2
+    resp = client.get('/transactions')
+    labels = sorted(t['label'] for t in resp.get_json())
+    assert labels == ['Café crème', 'Prime été']
+
+
+def test_preset_stores_detected_encoding(client):
+    login(client)
+    resp = client.post('/import_presets', json={'name': 'Banque', 'mapping': {}})
+    preset_id = resp.get_json()['id']
+    assert resp.get_json()['encoding'] is None
+
+    resp = post_file(client, '/import/preview', CSV.encode('cp1252'), preset_id=str(preset_id))
+    assert resp.status_code == 200
+    assert resp.get_json()['transactions'][0]['label'] == 'Café crème'
+    assert client.get(f'/import_presets/{preset_id}').get_json()['encoding'] == 'cp1252'
+
+    # The stored encoding is used as is, without detection
+    client.put(f'/import_presets/{preset_id}', json={'encoding': 'latin-1'})
+    resp = post_file(client, '/import', CSV.encode('latin-1'), preset_id=str(preset_id))
+    assert resp.status_code == 200
+    assert resp.get_json()['imported'] == 2
+
+
+def test_unknown_preset(client):
+    login(client)
+    resp = post_file(client, '/import/preview', CSV.encode('utf-8'), preset_id='42')
+    assert resp.status_code == 404
@@ -24,10 +24,12 @@ def login(client):
     assert resp.status_code == 200
 
 
-def import_file(client, csv, mapping=None):
+def import_file(client, csv, mapping=None, force=False):
     data = {'file': (io.BytesIO(csv.encode('utf-8')), 'test.csv')}
     if mapping:
         data['mapping'] = json.dumps(mapping)
+    if force:
+        data['force'] = 'true'
     return client.post('/import', data=data, content_type='multipart/form-data')
 
 def preview_file(client, csv, mapping=None):
@@ -50,7 +52,13 @@ def test_reimport_returns_duplicates(client):
     assert data1.get('imported') == 2
     assert 'duplicates' not in data1
 
-    second = import_file(client, csv)
+    # An identical file is recognised without re-reading its rows
+    same = import_file(client, csv)
+    assert same.status_code == 200
+    assert same.get_json()['already_imported'] is True
+    assert same.get_json()['account']['id'] == acc_id
+
+    second = import_file(client, csv, force=True)
     assert second.status_code == 200
     data2 = second.get_json()
     assert data2['account']['id'] == acc_id
@@ -84,7 +92,7 @@ def test_import_with_custom_profile(client):
     assert data1.get('imported') == 1
     assert 'duplicates' not in data1
 
-    second = import_file(client, csv, mapping=mapping)
+    second = import_file(client, csv, mapping=mapping, force=True)
     assert second.status_code == 200
     data2 = second.get_json()
     assert data2['account']['id'] == acc_id
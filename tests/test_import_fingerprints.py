@@ -0,0 +1,106 @@
+import io
+
+import pytest
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import sessionmaker
+
+from backend import models
+import backend as app_module
+
+
+@pytest.fixture
+def client():
+    engine = create_engine('sqlite:///:memory:')
+    models.engine = engine
+    models.SessionLocal = sessionmaker(bind=engine, expire_on_commit=False)
+    app_module.SessionLocal = models.SessionLocal
+    models.init_db()
+    with app_module.app.test_client() as client:
+        client.engine = engine
+        yield client
+
+
+def login(client):
+    resp = client.post('/login', json={'username': 'admin', 'password': 'admin'})
+    assert resp.status_code == 200
+
+
+def make_csv(days):
+    lines = ["Compte courant 12345678 2021-03-01"]
+    for day in days:
+        lines.append(f"2021-01-{day:02d};Debit;CB;Achat {day};-{day},00")
+    return "\n".join(lines) + "\n"
+
+
+def import_file(client, csv):
+    data = {'file': (io.BytesIO(csv.encode('utf-8')), 'test.csv')}
+    return client.post('/import', data=data, content_type='multipart/form-data')
+
+
+def test_rows_store_their_fingerprint(client):
+    login(client)
+    assert import_file(client, make_csv([1, 2])).status_code == 200
+    acc_id = client.get('/accounts').get_json()[0]['id']
+    resp = client.post('/import/confirm', json={
+        'transactions': [{'date': '2021-01-03', 'label': 'Manuel', 'amount': -3}],
+        'account_id': acc_id,
+    })
+    assert resp.get_json()['imported'] == 1
+
+    session = models.SessionLocal()
+    for tx in session.query(models.Transaction):
+        assert tx.fingerprint == models.transaction_fingerprint(tx.date, tx.label, tx.amount)
+    session.close()
+
+
+def test_overlapping_file_looks_up_fingerprints(client):
+    login(client)
+    assert import_file(client, make_csv(range(1, 6))).get_json()['imported'] == 5
+
+    statements = []
+
+    def before(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(client.engine, 'before_cursor_execute', before)
+    try:
+        data = import_file(client, make_csv(range(3, 9))).get_json()
+    finally:
+        event.remove(client.engine, 'before_cursor_execute', before)
+
+    assert data['imported'] == 3
+    assert sorted(d['label'] for d in data['duplicates']) == ['Achat 3', 'Achat 4', 'Achat 5']
+    lookups = [s for s in statements if 'transactions.fingerprint IN' in s]
+    assert len(lookups) == 1
+
+
+def test_reset_and_account_deletion_forget_files(client):
+    login(client)
+    csv = make_csv([1, 2])
+    acc_id = import_file(client, csv).get_json()['account']['id']
+    assert import_file(client, csv).get_json()['already_imported'] is True
+
+    client.post('/reset')
+    assert import_file(client, csv).get_json()['imported'] == 2
+
+    assert client.delete(f'/accounts/{acc_id}').status_code == 204
+    session = models.SessionLocal()
+    assert session.query(models.ImportFile).count() == 0
+    session.close()
+    assert import_file(client, csv).get_json()['imported'] == 2
+
+
+def test_init_db_backfills_fingerprints(client):
+    login(client)
+    import_file(client, make_csv([1, 2, 3]))
+    with client.engine.begin() as conn:
+        conn.execute(text('UPDATE transactions SET fingerprint = NULL'))
+
+    models.init_db()
+
+    session = models.SessionLocal()
+    txs = session.query(models.Transaction).all()
+    session.close()
+    assert len(txs) == 3
+    for tx in txs:
+        assert tx.fingerprint == models.transaction_fingerprint(tx.date, tx.label, tx.amount)
@@ -0,0 +1,83 @@
+import io
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from backend import models
+from backend.import_jobs import wait_for_job
+import backend as app_module
+
+
+@pytest.fixture
+def client(tmp_path):
+    # Jobs run in worker threads, which need a database shared across connections
+    engine = create_engine(f"sqlite:///{tmp_path / 'jobs.db'}")
+    models.engine = engine
+    models.SessionLocal = sessionmaker(bind=engine, expire_on_commit=False)
+    app_module.SessionLocal = models.SessionLocal
+    models.init_db()
+    with app_module.app.test_client() as client:
+        yield client
+
+
+def login(client):
+    resp = client.post('/login', json={'username': 'admin', 'password': 'admin'})
+    assert resp.status_code == 200
+
+
+CSV = """Compte courant 12345678 2021-01-01
+2021-01-02;Debit;CB;Achat;-12,34
+2021-01-03;Credit;VIR;Salaire;1000,00
+2021-01-03;Credit;VIR;Salaire;1000,00
+"""
+
+
+def submit(client, csv, **form):
+    data = {'file': (io.BytesIO(csv.encode('utf-8')), 'test.csv'), 'async': 'true', **form}
+    return client.post('/import', data=data, content_type='multipart/form-data')
+
+
+def test_async_import_reports_progress_and_result(client):
+    login(client)
+    resp = submit(client, CSV, chunk_size='1')
+    assert resp.status_code == 202
+    job_id = resp.get_json()['job_id']
+    assert resp.get_json()['status_url'] == f'/import/jobs/{job_id}'
+    wait_for_job(job_id, timeout=10)
+
+    data = client.get(f'/import/jobs/{job_id}').get_json()
+    assert data['phase'] == 'done'
+    assert data['filename'] == 'test.csv'
+    assert data['rows_processed'] == 2
+    assert data['imported'] == 2
+    assert data['duplicates'] == 1
+    assert data['errors'] == 0
+    assert data['status_code'] == 200
+    result = data['result']
+    assert result['imported'] == 2
+    assert result['account']['number'] == '12345678'
+    assert len(result['duplicates']) == 1
+
+    session = models.SessionLocal()
+    assert session.query(models.Transaction).count() == 2
+    session.close()
+
+
+def test_async_import_matches_sync_response(client):
+    login(client)
+    sync = client.post(
+        '/import',
+        data={'file': (io.BytesIO(CSV.encode('utf-8')), 'test.csv')},
+        content_type='multipart/form-data',
+    ).get_json()
+    job_id = submit(client, CSV, force='true').get_json()['job_id']
+    wait_for_job(job_id, timeout=10)
+    data = client.get(f'/import/jobs/{job_id}').get_json()
+    assert data['result']['account'] == sync['account']
+    assert data['result']['imported'] == 0
+    assert len(data['result']['duplicates']) == 3
+
+
+def test_unknown_job(client):
+    login(client)
+    assert client.get('/import/jobs/unknown').status_code == 404
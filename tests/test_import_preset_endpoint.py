@@ -56,3 +56,13 @@ def test_import_preset_without_header(client):
     assert data['columns'] == ['Colonne 1', 'Colonne 2', 'Colonne 3']
     assert data['preview'][0] == ['2021-01-02', 'Achat', '-12,34']
 
+
+def test_import_preset_large_file_uses_prefix(client):
+    login(client)
+    lines = ["Date;Libelle;Montant"]
+    lines += [f"2021-01-02;Achat {i};-{i},00" for i in range(100000)]
+    resp = send_preset_file(client, "\n".join(lines) + "\n")
+    assert resp.status_code == 200
+    data = resp.get_json()
+    assert data['columns'] == ['Date', 'Libelle', 'Montant']
+    assert data['preview'] == [['2021-01-02', f'Achat {i}', f'-{i},00'] for i in range(5)]
@@ -0,0 +1,103 @@
+import io
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from backend import models
+from backend.csv_utils import header_signature
+import backend as app_module
+
+
+CSV = (
+    "Compte courant;Mon compte;12345678;2021-01-01;;1000,00\n"
+    "\n"
+    "Date operation;Libelle court;Type operation;Libelle operation;Montant operation en euro\n"
+    "2021-01-02;CB;Debit;Achat;-12,34\n"
+    "2021-01-03;VIR;Credit;Salaire;1000,00\n"
+)
+
+BNP_MAPPING = {'date': 0, 'payment_method': 1, 'type': 2, 'label': 3, 'amount': 4}
+
+
+@pytest.fixture
+def client():
+    engine = create_engine('sqlite:///:memory:')
+    models.engine = engine
+    models.SessionLocal = sessionmaker(bind=engine, expire_on_commit=False)
+    app_module.SessionLocal = models.SessionLocal
+    models.init_db()
+    with app_module.app.test_client() as client:
+        yield client
+
+
+def login(client):
+    resp = client.post('/login', json={'username': 'admin', 'password': 'admin'})
+    assert resp.status_code == 200
+
+
+def post_file(client, url, csv, **fields):
+    fields['file'] = (io.BytesIO(csv.encode('utf-8')), 'test.csv')
+    return client.post(url, data=fields, content_type='multipart/form-data')
+
+
+def test_header_signature_normalises_columns():
+    sig = header_signature(';', ['Date', 'Libellé', 'Montant'])
+    assert sig == header_signature(';', [' date', 'LIBELLE ', 'Montant'])
+    assert sig != header_signature(',', ['Date', 'Libellé', 'Montant'])
+    assert sig != header_signature(';', ['Date', 'Montant', 'Libellé'])
+    assert header_signature(';', []) is None
+
+
+def test_preview_and_import_select_preset_from_header(client):
+    login(client)
+    resp = post_file(client, '/import/preset', CSV)
+    signature = resp.get_json()['signature']
+    assert resp.get_json()['preset'] is None
+
+    preset_id = client.post('/import_presets', json={
+        'name': 'BNP', 'mapping': BNP_MAPPING, 'signature': signature,
+    }).get_json()['id']
+    assert post_file(client, '/import/preset', CSV).get_json()['preset']['id'] == preset_id
+
+    data = post_file(client, '/import/preview', CSV).get_json()
+    assert data['preset'] == {'id': preset_id, 'name': 'BNP'}
+    assert data['transactions'][0]['type'] == 'Debit'
+    assert data['transactions'][0]['payment_method'] == 'CB'
+
+    data = post_file(client, '/import', CSV).get_json()
+    assert data['imported'] == 2
+    assert data['preset']['id'] == preset_id
+    tx = client.get('/transactions').get_json()
+    assert {t['type'] for t in tx} == {'Debit', 'Credit'}
+    # The detected encoding is stored on the selected preset
+    assert client.get(f'/import_presets/{preset_id}').get_json()['encoding'] == 'utf-8'
+
+
+def test_explicit_mapping_skips_automatic_preset(client):
+    login(client)
+    signature = post_file(client, '/import/preset', CSV).get_json()['signature']
+    client.post('/import_presets', json={
+        'name': 'BNP', 'mapping': BNP_MAPPING, 'signature': signature,
+    })
+    data = post_file(client, '/import/preview', CSV, mapping='{"date": 0, "type": 1, '
+                     '"payment_method": 2, "label": 3, "amount": 4}').get_json()
+    assert 'preset' not in data
+    assert data['transactions'][0]['type'] == 'CB'
+
+
+def test_preset_learns_signature_when_used(client):
+    login(client)
+    preset_id = client.post('/import_presets', json={
+        'name': 'BNP', 'mapping': BNP_MAPPING,
+    }).get_json()['id']
+    post_file(client, '/import/preview', CSV, preset_id=str(preset_id))
+    preset = client.get(f'/import_presets/{preset_id}').get_json()
+    assert preset['signature'] == header_signature(
+        ';',
+        ['Date operation', 'Libelle court', 'Type operation', 'Libelle operation',
+         'Montant operation en euro'],
+    )
+
+    data = post_file(client, '/import/preview', CSV).get_json()
+    assert data['preset']['id'] == preset_id
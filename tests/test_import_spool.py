@@ -0,0 +1,107 @@
+import io
+import os
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from backend import config, import_spool, models
+from backend.import_jobs import wait_for_job
+import backend as app_module
+
+
+CSV = """Compte courant 12345678 2021-01-01
+2021-01-02;Debit;CB;Achat;-12,34
+2021-01-03;Credit;VIR;Salaire;1000,00
+2021-01-03;Credit;VIR;Salaire;1000,00
+"""
+
+
+@pytest.fixture
+def client(tmp_path):
+    # Async jobs run in worker threads, which need a database shared across connections
+    engine = create_engine(f"sqlite:///{tmp_path / 'spool.db'}")
+    models.engine = engine
+    models.SessionLocal = sessionmaker(bind=engine, expire_on_commit=False)
+    app_module.SessionLocal = models.SessionLocal
+    models.init_db()
+    with app_module.app.test_client() as client:
+        yield client
+
+
+def login(client):
+    resp = client.post('/login', json={'username': 'admin', 'password': 'admin'})
+    assert resp.status_code == 200
+
+
+def preview(client, csv=CSV):
+    data = {'file': (io.BytesIO(csv.encode('utf-8')), 'test.csv')}
+    return client.post('/import/preview', data=data, content_type='multipart/form-data')
+
+
+def import_token(client, token, **form):
+    return client.post(
+        '/import', data={'token': token, **form}, content_type='multipart/form-data'
+    )
+
+
+def test_import_with_preview_token(client):
+    login(client)
+    token = preview(client).get_json()['token']
+    spool_path = import_spool._spools[token].path
+
+    resp = import_token(client, token)
+    data = resp.get_json()
+    assert resp.status_code == 200
+    assert data['imported'] == 2
+    assert [d['label'] for d in data['duplicates']] == ['Salaire']
+    assert not os.path.exists(spool_path)
+
+    # Tokens are single use
+    assert import_token(client, token).status_code == 404
+
+    # The file hash was recorded by the preview
+    data = {'file': (io.BytesIO(CSV.encode('utf-8')), 'test.csv')}
+    again = client.post('/import', data=data, content_type='multipart/form-data')
+    assert again.get_json()['already_imported'] is True
+
+
+def test_async_import_with_token(client):
+    login(client)
+    token = preview(client).get_json()['token']
+    resp = import_token(client, token, **{'async': 'true'})
+    assert resp.status_code == 202
+    job_id = resp.get_json()['job_id']
+    wait_for_job(job_id, timeout=10)
+    job = client.get(f'/import/jobs/{job_id}').get_json()
+    assert job['phase'] == 'done'
+    assert job['result']['imported'] == 2
+
+
+def test_confirm_requires_account(client):
+    login(client)
+    token = preview(client).get_json()['token']
+    resp = client.post('/import/confirm', json={
+        'token': token,
+        'transactions': [{'date': '2021-01-02', 'label': 'Achat', 'amount': -12.34}],
+    })
+    assert resp.status_code == 400
+    assert resp.get_json() == {'error': 'invalid account'}
+
+    session = models.SessionLocal()
+    assert session.query(models.Transaction).count() == 0
+    session.close()
+
+
+def test_expired_and_oversized_spools(client, monkeypatch):
+    login(client)
+    token = preview(client).get_json()['token']
+    monkeypatch.setattr(config, 'IMPORT_SPOOL_TTL', -1)
+    assert import_token(client, token).status_code == 404
+    assert import_spool._spools == {}
+
+    monkeypatch.setattr(config, 'IMPORT_SPOOL_TTL', 900)
+    monkeypatch.setattr(config, 'IMPORT_SPOOL_MAX_BYTES', 10)
+    data = preview(client).get_json()
+    assert 'token' not in data
+    assert len(data['transactions']) == 2
@@ -0,0 +1,115 @@
+import io
+import json
+import logging
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from backend import config, models
+from backend.import_metrics import ImportMetrics
+import backend as app_module
+
+
+@pytest.fixture
+def client():
+    engine = create_engine('sqlite:///:memory:')
+    models.engine = engine
+    models.SessionLocal = sessionmaker(bind=engine, expire_on_commit=False)
+    app_module.SessionLocal = models.SessionLocal
+    models.init_db()
+    with app_module.app.test_client() as client:
+        client.engine = engine
+        yield client
+
+
+def login(client):
+    resp = client.post('/login', json={'username': 'admin', 'password': 'admin'})
+    assert resp.status_code == 200
+
+
+def make_csv(count):
+    lines = ["Compte courant 12345678 2021-03-01"]
+    for i in range(count):
+        lines.append(f"2021-01-{1 + i % 28:02d};Debit;CB;Achat {i};-{i},00")
+    return "\n".join(lines) + "\n"
+
+
+def post_file(client, url, csv, **form):
+    data = {'file': (io.BytesIO(csv.encode('utf-8')), 'test.csv'), **form}
+    return client.post(url, data=data, content_type='multipart/form-data')
+
+
+def metrics_records(caplog):
+    prefix = 'import metrics '
+    return [
+        json.loads(r.getMessage()[len(prefix):])
+        for r in caplog.records
+        if r.getMessage().startswith(prefix)
+    ]
+
+
+def test_phases_add_up_and_count_queries(client):
+    metrics = ImportMetrics()
+    metrics.watch(client.engine)
+    metrics.switch('parse')
+    metrics.add_rows('parse', 3)
+    metrics.switch('insert')
+    with client.engine.connect() as conn:
+        conn.exec_driver_sql('SELECT 1')
+        conn.exec_driver_sql('SELECT 2')
+    metrics.stop()
+    with client.engine.connect() as conn:
+        conn.exec_driver_sql('SELECT 3')
+
+    payload = metrics.payload()
+    assert payload['phases']['parse']['rows'] == 3
+    assert payload['phases']['parse']['queries'] == 0
+    assert payload['phases']['insert']['queries'] == 2
+    total = sum(p['seconds'] for p in payload['phases'].values())
+    assert total <= payload['total_seconds'] + 0.001
+
+
+def test_import_returns_timings_on_request(client, caplog, monkeypatch):
+    login(client)
+    monkeypatch.setattr(config, 'IMPORT_BATCH_SIZE', 10)
+    resp = post_file(client, '/import', make_csv(25))
+    assert resp.status_code == 200
+    assert 'timings' not in resp.get_json()
+
+    with caplog.at_level(logging.INFO, logger='backend.routes'):
+        resp = post_file(client, '/import', make_csv(30), timings='true', force='true')
+    body = resp.get_json()
+    phases = body['timings']['phases']
+    assert {'read', 'parse', 'account', 'dedupe', 'rules', 'insert', 'commit'} <= set(phases)
+    assert phases['parse']['rows'] == 30
+    assert phases['dedupe']['rows'] == 30
+    assert phases['insert']['rows'] == 5
+    # One fingerprint lookup per batch of 10 rows
+    assert phases['dedupe']['queries'] == 3
+
+    records = metrics_records(caplog)
+    assert len(records) == 1
+    assert records[0]['import'] == 'csv'
+    assert records[0]['imported'] == 5
+    assert records[0]['phases'] == phases
+
+
+def test_preview_and_confirm_timings(client, caplog):
+    login(client)
+    acc_id = post_file(client, '/import', make_csv(3)).get_json()['account']['id']
+
+    with caplog.at_level(logging.INFO, logger='backend.routes'):
+        preview = post_file(client, '/import/preview', make_csv(8), timings='1').get_json()
+        confirm = client.post('/import/confirm', json={
+            'transactions': preview['transactions'],
+            'account_id': acc_id,
+            'timings': True,
+        }).get_json()
+    assert preview['timings']['phases']['parse']['rows'] == 8
+    assert preview['timings']['phases']['dedupe']['rows'] == 8
+    # The preview lists five rows, three of them already stored
+    assert confirm['imported'] == 2
+    assert confirm['timings']['phases']['insert']['rows'] == 2
+    assert confirm['timings']['phases']['insert']['queries'] >= 1
+    assert [r['import'] for r in metrics_records(caplog)] == ['preview', 'confirm']
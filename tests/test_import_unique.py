@@ -0,0 +1,105 @@
+import datetime
+import io
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker
+
+from backend import config, models
+import backend as app_module
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(config, 'UNIQUE_TRANSACTIONS', True)
+    engine = create_engine('sqlite:///:memory:')
+    models.engine = engine
+    models.SessionLocal = sessionmaker(bind=engine, expire_on_commit=False)
+    app_module.SessionLocal = models.SessionLocal
+    models.init_db()
+    with app_module.app.test_client() as client:
+        client.engine = engine
+        yield client
+
+
+def login(client):
+    resp = client.post('/login', json={'username': 'admin', 'password': 'admin'})
+    assert resp.status_code == 200
+
+
+def make_csv(days, repeat=()):
+    lines = ["Compte courant 12345678 2021-03-01"]
+    for day in list(days) + list(repeat):
+        lines.append(f"2021-01-{day:02d};Debit;CB;Achat {day};-{day},00")
+    return "\n".join(lines) + "\n"
+
+
+def import_file(client, csv, **form):
+    data = {'file': (io.BytesIO(csv.encode('utf-8')), 'test.csv'), **form}
+    return client.post('/import', data=data, content_type='multipart/form-data')
+
+
+def has_index(client):
+    with client.engine.connect() as conn:
+        return models.has_unique_transaction_index(conn)
+
+
+def test_ignore_mode_reports_conflicts_as_duplicates(client):
+    login(client)
+    assert has_index(client)
+    first = import_file(client, make_csv([1, 2, 3]), mode='ignore')
+    assert first.status_code == 200
+    assert first.get_json()['imported'] == 3
+
+    resp = import_file(client, make_csv([2, 3, 4, 5], repeat=[5]), mode='ignore', chunk_size='2')
+    data = resp.get_json()
+    assert resp.status_code == 200
+    assert data['imported'] == 2
+    # In-file duplicates come first, then the rows ignored by the database
+    assert [d['label'] for d in data['duplicates']] == ['Achat 5', 'Achat 2', 'Achat 3']
+    assert data['duplicates'][1]['date'] == '2021-01-02'
+    assert data['duplicates'][1]['account_id'] == data['account']['id']
+
+    session = models.SessionLocal()
+    assert session.query(models.Transaction).count() == 5
+    session.close()
+
+
+def test_index_rejects_duplicate_rows(client):
+    login(client)
+    acc_id = import_file(client, make_csv([1])).get_json()['account']['id']
+    session = models.SessionLocal()
+    session.add(models.Transaction(
+        date=datetime.date(2021, 1, 1), label='Achat 1', amount=-1.0, bank_account_id=acc_id
+    ))
+    with pytest.raises(IntegrityError):
+        session.commit()
+    session.rollback()
+    session.close()
+
+
+def test_ignore_mode_requires_index(client, monkeypatch):
+    login(client)
+    monkeypatch.setattr(config, 'UNIQUE_TRANSACTIONS', False)
+    models.init_db()
+    assert not has_index(client)
+    resp = import_file(client, make_csv([1]), mode='ignore')
+    assert resp.status_code == 400
+
+
+def test_index_not_created_over_duplicates(client, monkeypatch):
+    login(client)
+    acc_id = import_file(client, make_csv([1])).get_json()['account']['id']
+    monkeypatch.setattr(config, 'UNIQUE_TRANSACTIONS', False)
+    models.init_db()
+    session = models.SessionLocal()
+    session.add(models.Transaction(
+        date=datetime.date(2021, 1, 1), label='Achat 1', amount=-1.0, bank_account_id=acc_id
+    ))
+    session.commit()
+    session.close()
+
+    monkeypatch.setattr(config, 'UNIQUE_TRANSACTIONS', True)
+    models.init_db()
+    assert not has_index(client)
@@ -0,0 +1,134 @@
+import datetime
+
+import pytest
+from sqlalchemy import create_engine, select, text
+from sqlalchemy.orm import sessionmaker
+
+from backend import config, models
+from backend.csv_utils import bulk_insert_transactions
+import backend as app_module
+
+
+LABELS = ['CARTE 12/03 LECLERC', 'Prélèvement EDF', 'Virement salaire', 'Carte Auchan']
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(config, 'LABEL_SEARCH_INDEX', True)
+    engine = create_engine('sqlite:///:memory:')
+    models.engine = engine
+    models.SessionLocal = sessionmaker(bind=engine)
+    app_module.SessionLocal = models.SessionLocal
+    models.init_db()
+    session = models.SessionLocal()
+    session.add(models.Category(name='Courses'))
+    session.add_all(
+        models.Transaction(date=datetime.date(2021, 1, 1 + i), label=label, amount=-10 - i)
+        for i, label in enumerate(LABELS)
+    )
+    session.commit()
+    session.close()
+    with app_module.app.test_client() as client:
+        client.engine = engine
+        yield client
+
+
+def login(client):
+    resp = client.post('/login', json={'username': 'admin', 'password': 'admin'})
+    assert resp.status_code == 200
+
+
+def indexed(engine, trigram):
+    with engine.connect() as conn:
+        rows = conn.execute(
+            text("SELECT rowid FROM transactions_fts WHERE transactions_fts MATCH :q"),
+            {'q': f'"{trigram}"'},
+        )
+        return sorted(r[0] for r in rows)
+
+
+def search(pattern):
+    session = models.SessionLocal()
+    try:
+        return sorted(
+            session.execute(
+                select(models.Transaction.label).where(models.label_like(session, pattern))
+            ).scalars()
+        )
+    finally:
+        session.close()
+
+
+def test_triggers_keep_index_in_sync(client):
+    session = models.SessionLocal()
+    tx = session.query(models.Transaction).filter_by(label='Virement salaire').one()
+    assert indexed(client.engine, 'salaire') == [tx.id]
+    tx.label = 'Virement loyer'
+    session.commit()
+    assert indexed(client.engine, 'salaire') == []
+    assert indexed(client.engine, 'loyer') == [tx.id]
+    session.delete(tx)
+    session.commit()
+    session.close()
+    assert indexed(client.engine, 'loyer') == []
+
+
+def test_existing_labels_indexed_by_init_db(client, monkeypatch):
+    monkeypatch.setattr(config, 'LABEL_SEARCH_INDEX', False)
+    models.init_db()
+    with client.engine.connect() as conn:
+        assert not models.has_transaction_fts(conn)
+    assert search('%carte%') == ['CARTE 12/03 LECLERC', 'Carte Auchan']
+
+    monkeypatch.setattr(config, 'LABEL_SEARCH_INDEX', True)
+    models.init_db()
+    assert len(indexed(client.engine, 'car')) == 2
+    assert search('%carte%leclerc%') == ['CARTE 12/03 LECLERC']
+    assert search('%PRÉL%') == ['Prélèvement EDF']
+    # Short segments of multibyte characters are not looked up in the index
+    assert search('%lè%') == ['Prélèvement EDF']
+    assert search('%ca%auch%') == ['Carte Auchan']
+
+
+def test_bulk_inserts_index_labels_once(client):
+    session = models.SessionLocal()
+    bulk_insert_transactions(session, [
+        {'date': datetime.date(2021, 2, 1), 'label': f'Achat groupé {i}', 'amount': -1}
+        for i in range(3)
+    ])
+    ids = [t.id for t in session.query(models.Transaction).filter(models.Transaction.label.like('Achat%'))]
+    assert indexed(client.engine, 'groupé') == sorted(ids)
+    assert session.execute(text('SELECT COUNT(*) FROM transactions_fts_deferred')).scalar() == 0
+
+    # Other inserts are indexed by the trigger again
+    tx = models.Transaction(date=datetime.date(2021, 2, 2), label='Achat seul', amount=-2)
+    session.add(tx)
+    session.commit()
+    assert indexed(client.engine, 'seul') == [tx.id]
+    session.close()
+
+
+def test_label_search_uses_index(client):
+    session = models.SessionLocal()
+    query = select(models.Transaction.id).where(models.label_like(session, '%leclerc%'))
+    compiled = query.compile(client.engine, compile_kwargs={'literal_binds': True})
+    plan = session.execute(text(f'EXPLAIN QUERY PLAN {compiled}')).fetchall()
+    session.close()
+    assert any('transactions_fts VIRTUAL TABLE' in row[3] for row in plan)
+
+
+def test_endpoints_filter_through_index(client):
+    login(client)
+    data = client.get('/transactions?label=carte').get_json()
+    assert sorted(t['label'] for t in data) == ['CARTE 12/03 LECLERC', 'Carte Auchan']
+    data = client.get('/transactions?label=lè').get_json()
+    assert [t['label'] for t in data] == ['Prélèvement EDF']
+
+    session = models.SessionLocal()
+    cat_id = session.query(models.Category).filter_by(name='Courses').one().id
+    session.close()
+    resp = client.post('/rules', json={'pattern': 'carte leclerc', 'category_id': cat_id})
+    assert resp.get_json()['updated'] == 1
+
+    assert client.post('/favorite_filters', json={'pattern': 'EDF'}).status_code == 201
+    assert client.get('/dashboard').get_json()['favorite_count'] == 1
@@ -0,0 +1,91 @@
+import json
+import mmap
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from backend import cli, models
+from backend.csv_utils import parse_csv
+from backend.parallel_csv import parse_csv_parallel, split_chunks
+import backend as app_module
+
+
+@pytest.fixture
+def session():
+    engine = create_engine('sqlite:///:memory:')
+    models.engine = engine
+    models.SessionLocal = sessionmaker(bind=engine, expire_on_commit=False)
+    app_module.SessionLocal = models.SessionLocal
+    models.init_db()
+    yield models.SessionLocal()
+
+
+def make_csv(count, header=True):
+    if header:
+        lines = [
+            "Compte courant;Mon compte;12345678;2021-03-01;;1000,00",
+            "",
+            "Date;Type;Moyen;Libellé;Montant",
+        ]
+    else:
+        lines = ["Compte courant 12345678 2021-03-01"]
+    for i in range(count):
+        if i % 97 == 50:
+            lines.append(f"2021-01-{1 + i % 28:02d};Debit;CB;Achat {i};abc")
+        elif i % 89 == 10:
+            lines.append("")
+        elif i % 31 == 7:
+            # Repeats a row of an earlier chunk
+            lines.append("2021-01-01;Debit;CB;Achat 0;-0,50")
+        else:
+            lines.append(f"2021-01-{1 + i % 28:02d};Debit;CB;Achat {i};-{i},50")
+    return "\n".join(lines) + "\n"
+
+
+def test_split_chunks_end_at_newlines(tmp_path):
+    path = tmp_path / 'data.csv'
+    path.write_bytes(b'a\nbb\nccc\ndddd\ne')
+    with open(path, 'rb') as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        chunks = split_chunks(mm, 2, 4)
+    assert chunks == [(2, 9), (9, 14), (14, 15)]
+
+
+@pytest.mark.parametrize('header', [True, False])
+def test_parallel_matches_sequential(tmp_path, header):
+    content = make_csv(2000, header=header)
+    path = tmp_path / 'historique.csv'
+    path.write_text(content, encoding='utf-8')
+
+    expected = parse_csv(content)
+    result = parse_csv_parallel(str(path), workers=1, chunk_size=4096)
+    assert result == expected
+    assert any(e.startswith('Ligne ') for e in result[2])
+    assert len(result[1]) > 10
+
+
+def test_parallel_with_processes(tmp_path):
+    content = make_csv(3000)
+    path = tmp_path / 'historique.csv'
+    path.write_bytes(('﻿' + content).encode('utf-8'))
+    expected = parse_csv(content)
+    assert parse_csv_parallel(str(path), workers=2, chunk_size=8192) == expected
+
+
+def test_parallel_falls_back_for_utf16(tmp_path):
+    content = make_csv(50)
+    path = tmp_path / 'historique.csv'
+    path.write_bytes(content.encode('utf-16'))
+    assert parse_csv_parallel(str(path), workers=2, chunk_size=64) == parse_csv(content)
+
+
+def test_cli_parallel_import(session, tmp_path, capsys):
+    path = tmp_path / 'historique.csv'
+    path.write_text(make_csv(500), encoding='utf-8')
+    args = ['import', '--parallel', '--workers', '1', str(path)]
+    assert cli.main(args) == 1
+    report = json.loads(capsys.readouterr().out)
+    sequential = parse_csv(make_csv(500))
+    assert report['imported'] == len(sequential[0])
+    assert report['files'][0]['errors'] == sequential[2]
+    assert len(report['files'][0]['duplicates']) == len(sequential[1])
@@ -0,0 +1,146 @@
+import datetime
+import io
+import mmap
+import tempfile
+import tracemalloc
+
+import pytest
+
+from backend import csv_utils
+from backend.csv_utils import (
+    ascii_compatible,
+    iter_decoded_lines,
+    iter_mapped_lines,
+    iter_parse_csv,
+    map_stream,
+    parse_csv,
+)
+
+
+BNP_CSV = (
+    "Compte courant;Mon compte;12345678;2021-01-01;;1000,00\r\n"
+    "\r\n"
+    "Date operation;Libelle court;Type operation;Libelle operation;Montant operation en euro\r\n"
+    "2021-01-02;CB;Debit;Café crème;-12,34\r\n"
+    "2021-01-03;VIR;Credit;Salaire;1000,00\r\n"
+    "2021-01-03;VIR;Credit;Salaire;1000,00\r\n"
+    "2021-01-04;CB;Debit;Achat\r\n"
+)
+
+
+class SmallReads(io.BytesIO):
+    """Binary stream returning at most ``size`` bytes per read."""
+
+    def __init__(self, data, size):
+        super().__init__(data)
+        self.size = size
+
+    def read(self, n=-1):
+        return super().read(self.size)
+
+
+def test_decoded_lines_across_chunk_boundaries():
+    data = "é\r\nligne 2\n\nfin".encode('utf-8')
+    for size in range(1, 6):
+        lines = list(iter_decoded_lines(io.BytesIO(data), chunk_size=size))
+        assert lines == ['é', 'ligne 2', '', 'fin']
+
+
+def test_parse_stream_matches_string():
+    expected = parse_csv(BNP_CSV)
+    for size in (1, 7, 64):
+        stream = SmallReads(BNP_CSV.encode('utf-8'), size)
+        assert parse_csv(stream) == expected
+
+
+def test_iter_parse_csv_yields_account_first():
+    events = list(iter_parse_csv(io.BytesIO(BNP_CSV.encode('utf-8'))))
+    kind, info = events[0]
+    assert kind == 'account'
+    assert info['number'] == '12345678'
+    assert info['export_date'] == datetime.date(2021, 1, 1)
+    kinds = [k for k, _ in events[1:]]
+    assert kinds == ['transaction', 'transaction', 'duplicate', 'error']
+    assert events[1][1]['label'] == 'Café crème'
+    assert events[3][1]['line_no'] == 6
+    assert events[4][1].startswith('Ligne 7')
+
+
+def test_empty_stream():
+    transactions, duplicates, errors, info = parse_csv(io.BytesIO(b''))
+    assert transactions == []
+    assert errors == ['Fichier totalement vide']
+    assert info == {}
+
+
+@pytest.mark.parametrize('encoding, text', [
+    ('utf-8', 'é\r\nligne 2\n\n"cité\nsur deux";x\x0cy\nfin'),
+    ('utf-8-sig', '\ufeffa\nb\n'),
+    ('latin-1', 'a\x85b\nc\rd\r\n'),
+    ('cp1252', 'café;€\n' * 5),
+])
+def test_mapped_lines_match_decoded_lines(tmp_path, encoding, text):
+    data = text.encode('utf-8' if encoding == 'utf-8-sig' else encoding)
+    expected = list(iter_decoded_lines(io.BytesIO(data), encoding))
+    path = tmp_path / 'data.csv'
+    path.write_bytes(data)
+    with open(path, 'rb') as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for window in (1, 2, 5, 1024):
+            assert list(iter_mapped_lines(mm, 0, encoding, window=window)) == expected
+
+
+def test_ascii_compatible():
+    assert all(ascii_compatible(e) for e in ('utf-8', 'utf-8-sig', 'cp1252', 'latin-1'))
+    assert not any(ascii_compatible(e) for e in ('utf-16', 'utf-32', 'shift_jis'))
+
+
+def test_map_stream_only_for_files_on_disk(tmp_path):
+    assert map_stream(io.BytesIO(b'abc')) is None
+    spooled = tempfile.SpooledTemporaryFile(max_size=10)
+    spooled.write(b'abc')
+    assert map_stream(spooled) is None
+    # Rolled over to disk, it is still read through the buffered path
+    spooled.write(b'd' * 20)
+    assert map_stream(spooled) is None
+    spooled.close()
+    path = tmp_path / 'releve.csv'
+    path.write_bytes(b'abc' + b'd' * 20)
+    with open(path, 'rb') as fh:
+        fh.seek(2)
+        mm, offset = map_stream(fh)
+        with mm:
+            assert (mm[:], offset) == (b'abc' + b'd' * 20, 2)
+
+
+def test_parse_file_on_disk_through_map(tmp_path, monkeypatch):
+    path = tmp_path / 'releve.csv'
+    path.write_bytes(BNP_CSV.encode('cp1252'))
+    calls = []
+    original = csv_utils.iter_mapped_lines
+
+    def mapped_lines(*args, **kwargs):
+        calls.append(args)
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(csv_utils, 'iter_mapped_lines', mapped_lines)
+    with open(path, 'rb') as fh:
+        assert parse_csv(fh, encoding='cp1252') == parse_csv(BNP_CSV)
+    assert len(calls) == 1
+
+
+def test_mapped_parse_memory_does_not_grow_with_file(tmp_path):
+    lines = ["Compte courant 12345678 2021-03-01"]
+    lines += ["2021-01-01;Debit;CB;Achat;-1,00"] * 200000
+    path = tmp_path / 'releve.csv'
+    path.write_text("\n".join(lines) + "\n", encoding='utf-8')
+
+    tracemalloc.start()
+    try:
+        with open(path, 'rb') as fh:
+            count = sum(1 for _ in iter_parse_csv(fh))
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert count == 200001
+    # The file is about 6 MB; only one window is decoded at a time
+    assert peak < 2 * 1024 * 1024
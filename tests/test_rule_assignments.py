@@ -0,0 +1,112 @@
+import io
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from backend import models
+import backend as app_module
+
+
+@pytest.fixture
+def client():
+    engine = create_engine('sqlite:///:memory:')
+    models.engine = engine
+    models.SessionLocal = sessionmaker(bind=engine)
+    app_module.SessionLocal = models.SessionLocal
+    models.init_db()
+    session = models.SessionLocal()
+    food = models.Category(name='Rule Food')
+    fuel = models.Category(name='Rule Fuel')
+    session.add_all([food, fuel])
+    session.flush()
+    session.add(models.Rule(pattern='station', category_id=fuel.id))
+    session.add(models.Rule(pattern='leclerc', category_id=food.id))
+    session.commit()
+    ids = {'food': food.id, 'fuel': fuel.id}
+    session.close()
+    with app_module.app.test_client() as client:
+        client.ids = ids
+        csv = (
+            "Compte courant 12345678 2021-03-01\n"
+            "2021-01-01;Debit;CB;CARTE LECLERC;-1,00\n"
+            "2021-01-02;Debit;CB;CARTE LECLERC STATION;-2,00\n"
+            "2021-01-03;Debit;CB;CARTE AUCHAN;-3,00\n"
+        )
+        data = {'file': (io.BytesIO(csv.encode('utf-8')), 'test.csv')}
+        login(client)
+        resp = client.post('/import', data=data, content_type='multipart/form-data')
+        assert resp.status_code == 200
+        yield client
+
+
+def login(client):
+    resp = client.post('/login', json={'username': 'admin', 'password': 'admin'})
+    assert resp.status_code == 200
+
+
+def assignments():
+    session = models.SessionLocal()
+    result = {
+        t.label: (t.category_id, t.rule_id) for t in session.query(models.Transaction)
+    }
+    session.close()
+    return result
+
+
+def rule_id(pattern):
+    session = models.SessionLocal()
+    rule = session.query(models.Rule).filter_by(pattern=pattern).one()
+    session.close()
+    return rule.id
+
+
+def test_import_records_rule(client):
+    fuel, food = client.ids['fuel'], client.ids['food']
+    assert assignments() == {
+        'CARTE LECLERC': (food, rule_id('leclerc')),
+        'CARTE LECLERC STATION': (fuel, rule_id('station')),
+        'CARTE AUCHAN': (None, None),
+    }
+
+
+def test_rule_update_recomputes_previous_matches(client):
+    fuel, food = client.ids['fuel'], client.ids['food']
+    station, leclerc = rule_id('station'), rule_id('leclerc')
+    resp = client.put(f'/rules/{station}', json={'pattern': 'auchan'})
+    assert resp.status_code == 200
+    # LECLERC STATION falls back to the other rule, AUCHAN is a new match
+    assert resp.get_json()['updated'] == 2
+    assert assignments() == {
+        'CARTE LECLERC': (food, leclerc),
+        'CARTE LECLERC STATION': (food, leclerc),
+        'CARTE AUCHAN': (fuel, station),
+    }
+
+    resp = client.put(f'/rules/{station}', json={'pattern': 'inconnu'})
+    assert resp.get_json()['updated'] == 1
+    assert assignments()['CARTE AUCHAN'] == (None, None)
+
+
+def test_manual_edit_clears_rule(client):
+    session = models.SessionLocal()
+    tx_id = session.query(models.Transaction).filter_by(label='CARTE LECLERC').one().id
+    session.close()
+    resp = client.put(f'/transactions/{tx_id}', json={'category_id': client.ids['fuel']})
+    assert resp.status_code == 200
+    assert assignments()['CARTE LECLERC'] == (client.ids['fuel'], None)
+
+    # A manual category is kept when the rule that matched the label changes
+    client.put(f"/rules/{rule_id('leclerc')}", json={'pattern': 'drive'})
+    assert assignments()['CARTE LECLERC'] == (client.ids['fuel'], None)
+
+
+def test_rule_delete_keeps_or_clears_assignments(client):
+    food = client.ids['food']
+    resp = client.delete(f"/rules/{rule_id('leclerc')}")
+    assert resp.get_json() == {'message': 'deleted'}
+    assert assignments()['CARTE LECLERC'] == (food, None)
+
+    resp = client.delete(f"/rules/{rule_id('station')}?clear=true")
+    assert resp.get_json() == {'message': 'deleted', 'cleared': 1}
+    assert assignments()['CARTE LECLERC STATION'] == (None, None)
@@ -0,0 +1,109 @@
+import io
+import random
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from backend import models
+from backend.rule_matcher import RuleMatcher
+import backend as app_module
+
+
+def naive_match(rules, label):
+    for rule in rules:
+        if rule[1].lower() in label.lower():
+            return rule
+    return None
+
+
+def test_first_rule_wins():
+    rules = [
+        (1, 'carte', 10, None),
+        (2, 'CARTE X', 20, 21),
+        (3, 'x', 30, None),
+    ]
+    matcher = RuleMatcher(rules)
+    assert matcher.match('PAIEMENT CARTE X') == rules[0]
+    assert matcher.match('prelevement x') == rules[2]
+    assert matcher.match('virement') is None
+    assert matcher.categorize('virement') == (None, None)
+    assert matcher.categorize('carte') == (10, None)
+
+
+def test_overlapping_patterns_follow_rule_order():
+    rules = [(1, 'she', 1, None), (2, 'hers', 2, None), (3, 'he', 3, None)]
+    matcher = RuleMatcher(rules)
+    assert matcher.match('ushers') == rules[0]
+    assert matcher.match('hershe') == rules[0]
+    assert matcher.match('xhers') == rules[1]
+    assert matcher.match('he') == rules[2]
+
+
+def test_empty_pattern_matches_everything():
+    rules = [(1, 'abc', 1, None), (2, '', 2, None)]
+    matcher = RuleMatcher(rules)
+    assert matcher.match('zzz') == rules[1]
+    assert matcher.match('xabc') == rules[0]
+
+
+def test_matches_naive_semantics_on_random_data():
+    rng = random.Random(42)
+    alphabet = 'abcÉé '
+    rules = [
+        (i, ''.join(rng.choice(alphabet) for _ in range(rng.randint(1, 4))), i, None)
+        for i in range(60)
+    ]
+    matcher = RuleMatcher(rules)
+    for _ in range(500):
+        label = ''.join(rng.choice(alphabet + 'xyz') for _ in range(rng.randint(0, 12)))
+        assert matcher.match(label) == naive_match(rules, label)
+
+
+@pytest.fixture
+def client():
+    engine = create_engine('sqlite:///:memory:')
+    models.engine = engine
+    models.SessionLocal = sessionmaker(bind=engine, expire_on_commit=False)
+    app_module.SessionLocal = models.SessionLocal
+    models.init_db()
+    session = models.SessionLocal()
+    cat_a = models.Category(name='A')
+    cat_b = models.Category(name='B')
+    session.add_all([cat_a, cat_b])
+    session.commit()
+    ids = (cat_a.id, cat_b.id)
+    session.close()
+    with app_module.app.test_client() as client:
+        client.cat_ids = ids
+        yield client
+
+
+def import_file(client, csv):
+    data = {'file': (io.BytesIO(csv.encode('utf-8')), 'test.csv')}
+    return client.post('/import', data=data, content_type='multipart/form-data')
+
+
+def categories_by_label(prefix):
+    session = models.SessionLocal()
+    tx = session.query(models.Transaction).filter(
+        models.Transaction.label.startswith(prefix)
+    ).one()
+    session.close()
+    return tx.category_id
+
+
+def test_import_uses_rules_updated_through_endpoint(client):
+    client.post('/login', json={'username': 'admin', 'password': 'admin'})
+    cat_a, cat_b = client.cat_ids
+    resp = client.post('/rules', json={'pattern': 'loyer', 'category_id': cat_a})
+    rule_id = resp.get_json()['id']
+    import_file(client, "Compte courant 12345678 2021-01-01\n2021-01-02;Debit;PRLV;LOYER JANVIER;-500,00\n")
+    assert categories_by_label('LOYER JANVIER') == cat_a
+
+    client.put(f'/rules/{rule_id}', json={'category_id': cat_b})
+    import_file(client, "Compte courant 12345678 2021-02-01\n2021-02-02;Debit;PRLV;LOYER FEVRIER;-500,00\n")
+    assert categories_by_label('LOYER FEVRIER') == cat_b
+
+    client.delete(f'/rules/{rule_id}')
+    import_file(client, "Compte courant 12345678 2021-03-01\n2021-03-02;Debit;PRLV;LOYER MARS;-500,00\n")
+    assert categories_by_label('LOYER MARS') is None
@@ -0,0 +1,223 @@
+import datetime
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from backend import models, rule_suggestions
+import backend as app_module
+
+
+UNCATEGORISED = [
+    'CARTE 01/03 PHARMACIE CENTRALE',
+    'CARTE 02/03 PHARMACIE CENTRALE',
+    'CARTE 03/03 PHARMACIE CENTRALE',
+    'CARTE 04/03 PHARMACIE DU PORT',
+    'CARTE 05/03 BOULANGERIE MARIE',
+    'CARTE 06/03 GARAGE',
+    'CARTE 07/03 CINEMA',
+    'PRLV EDF 123',
+    'PRLV EDF 456',
+    'PRLV FREE MOBILE',
+    'PRLV ASSURANCE',
+    'VIR LOYER AGENCE',
+    'VIR SALAIRE',
+    'VIR EPARGNE',
+    'CHEQUE 1234567',
+    'RETRAIT DAB 01/03',
+]
+
+
+@pytest.fixture
+def client():
+    engine = create_engine('sqlite:///:memory:')
+    models.engine = engine
+    models.SessionLocal = sessionmaker(bind=engine)
+    app_module.SessionLocal = models.SessionLocal
+    models.init_db()
+    session = models.SessionLocal()
+    food = models.Category(name='Suggest Food')
+    fuel = models.Category(name='Suggest Fuel')
+    session.add_all([food, fuel])
+    session.flush()
+    categorised = [
+        ('CARTE 20/02 PHARMACIE CENTRALE', fuel.id),
+        ('CARTE 21/02 PHARMACIE CENTRALE', food.id),
+        ('CARTE 22/02 PHARMACIE DU PORT', food.id),
+    ]
+    labels = categorised + [(label, None) for label in UNCATEGORISED]
+    session.add_all(
+        models.Transaction(
+            date=datetime.date(2021, 3, 1), label=label, amount=-10 - i, category_id=cat
+        )
+        for i, (label, cat) in enumerate(labels)
+    )
+    session.commit()
+    ids = {'food': food.id, 'fuel': fuel.id}
+    session.close()
+    with app_module.app.test_client() as client:
+        client.ids = ids
+        client.engine = engine
+        yield client
+
+
+def login(client):
+    resp = client.post('/login', json={'username': 'admin', 'password': 'admin'})
+    assert resp.status_code == 200
+
+
+def patterns(client, limit=5):
+    resp = client.get(f'/rules/suggestions?limit={limit}')
+    assert resp.status_code == 200
+    return [(s['pattern'], s['count']) for s in resp.get_json()]
+
+
+def set_category(category_id, ids):
+    session = models.SessionLocal()
+    session.query(models.Transaction).filter(models.Transaction.id.in_(ids)).update(
+        {'category_id': category_id}, synchronize_session=False
+    )
+    session.commit()
+    session.close()
+
+
+def add_transactions(*labels):
+    session = models.SessionLocal()
+    session.add_all(
+        models.Transaction(date=datetime.date(2021, 4, 1), label=label, amount=-5)
+        for label in labels
+    )
+    session.commit()
+    session.close()
+
+
+def test_label_phrases():
+    assert rule_suggestions.label_phrases('CB*Boulangerie 12/03 DU Port Vieux') == (
+        ('boulangerie',),
+        ('port', 'vieux'),
+    )
+    assert rule_suggestions.label_phrases('SNCF101INTERNET') == (('sncf',), ('internet',))
+    assert rule_suggestions.label_phrases('PRLV FREE-MOBILE') == (('prlv', 'free'), ('mobile',))
+
+
+def test_suggestions_ranked_by_coverage(client):
+    login(client)
+    # CARTE, PRLV and VIR are found in too many labels; consecutive words
+    # come first on ties and patterns adding no transaction are skipped
+    assert patterns(client) == [
+        ('pharmacie', 4),
+        ('edf', 2),
+        ('boulangerie marie', 1),
+        ('free mobile', 1),
+        ('loyer agence', 1),
+    ]
+
+
+def test_suggestions_propose_category(client):
+    login(client)
+    pharmacie, edf = client.get('/rules/suggestions?limit=2').get_json()
+    assert pharmacie == {
+        'pattern': 'pharmacie',
+        'count': 4,
+        'example': 'CARTE 01/03 PHARMACIE CENTRALE',
+        'category_id': client.ids['food'],
+        'subcategory_id': None,
+        'confidence': 0.667,
+    }
+    assert (edf['category_id'], edf['confidence']) == (None, None)
+
+
+def test_suggestions_follow_changes(client):
+    login(client)
+    patterns(client)
+    index = rule_suggestions._indexes[client.engine]
+    assert sum(index.groups.values()) == len(UNCATEGORISED)
+
+    resp = client.post(
+        '/rules', json={'pattern': 'pharmacie centrale', 'category_id': client.ids['food']}
+    )
+    assert resp.get_json()['updated'] == 5
+    resp = client.post('/rules', json={'pattern': 'edf', 'category_id': client.ids['fuel']})
+    assert resp.get_json()['updated'] == 2
+    add_transactions('PRLV 8 FREE MOBILE', 'PRLV 9 FREE MOBILE', 'PRLV EDF 789')
+
+    # The patterns of existing rules are not suggested again
+    assert patterns(client, limit=3) == [
+        ('free mobile', 3),
+        ('boulangerie marie', 1),
+        ('loyer agence', 1),
+    ]
+    assert rule_suggestions._indexes[client.engine] is index
+    assert sum(index.groups.values()) == len(UNCATEGORISED) - 2
+
+
+def test_suggestions_match_at_import(client):
+    login(client)
+    add_transactions('SNCF101INTERNET', 'SNCF202INTERNET', 'SNCF 3INTERNET', 'PRLV FREE-MOBILE')
+    suggestions = client.get('/rules/suggestions?limit=50').get_json()
+    for suggestion in suggestions:
+        assert suggestion['pattern'] in suggestion['example'].lower()
+    counts = {s['pattern']: s['count'] for s in suggestions}
+    assert 'sncfinternet' not in counts
+    assert counts['internet'] == 3
+    preview = client.post('/rules/preview', json={'pattern': 'internet'}).get_json()
+    assert preview['results'][0]['count'] == 3
+
+    # Only the label with a space between both words counts for the pair
+    index = rule_suggestions._indexes[client.engine]
+    assert index.coverage[('free', 'mobile')] == 1
+    assert index.coverage[('free',)] == 2
+
+
+def test_suggestions_follow_swapped_rows(client):
+    login(client)
+    session = models.SessionLocal()
+    ids = {t.label: t.id for t in session.query(models.Transaction).filter_by(category_id=None)}
+    session.close()
+    central = ids['CARTE 02/03 PHARMACIE CENTRALE']
+    other = ids['CARTE 03/03 PHARMACIE CENTRALE']
+    port = ids['CARTE 04/03 PHARMACIE DU PORT']
+    bakery = ids['CARTE 05/03 BOULANGERIE MARIE']
+    assert central + bakery == other + port
+
+    set_category(client.ids['food'], [central, bakery])
+    assert ('boulangerie marie', 1) not in patterns(client, limit=20)
+    # Same number of rows, largest id and sum of ids
+    set_category(None, [central, bakery])
+    set_category(client.ids['food'], [other, port])
+    result = patterns(client, limit=20)
+    assert ('pharmacie centrale', 2) in result
+    assert ('boulangerie marie', 1) in result
+
+
+def test_suggestions_follow_reused_ids(client):
+    login(client)
+    patterns(client, limit=20)
+    session = models.SessionLocal()
+    last = session.query(models.Transaction).order_by(models.Transaction.id.desc()).first()
+    assert last.label == 'RETRAIT DAB 01/03'
+    last_id = last.id
+    session.delete(last)
+    session.commit()
+    session.close()
+    add_transactions('CARTE 08/03 FLEURISTE')
+    session = models.SessionLocal()
+    assert session.query(models.Transaction).filter_by(label='CARTE 08/03 FLEURISTE').one().id == last_id
+    session.close()
+
+    result = patterns(client, limit=20)
+    assert ('fleuriste', 1) in result
+    assert ('retrait dab', 1) not in result
+
+
+def test_label_counts_read_from_index(client):
+    session = models.SessionLocal()
+    plan = session.execute(text(f'EXPLAIN QUERY PLAN {rule_suggestions._LABEL_COUNTS.text}')).fetchall()
+    session.close()
+    assert [row[3] for row in plan] == ['SCAN transactions USING INDEX ix_transactions_uncategorised']
+
+
+def test_suggestions_limit(client):
+    login(client)
+    assert patterns(client, limit=0) == []
+    assert len(patterns(client, limit='abc')) == 12
@@ -0,0 +1,98 @@
+import datetime
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from backend import config, models
+import backend as app_module
+
+
+@pytest.fixture
+def client():
+    engine = create_engine('sqlite:///:memory:')
+    models.engine = engine
+    models.SessionLocal = sessionmaker(bind=engine)
+    app_module.SessionLocal = models.SessionLocal
+    models.init_db()
+    session = models.SessionLocal()
+    food = models.Category(name='Preview Food')
+    fuel = models.Category(name='Preview Fuel')
+    session.add_all([food, fuel])
+    session.flush()
+    labels = [
+        ('CARTE 01/03 LECLERC', fuel.id),
+        ('CARTE 02/03 LECLERC', None),
+        ('CARTE 03/03 LECLERC DRIVE', food.id),
+        ('CARTE AUCHAN', None),
+        ('PRLV EDF', None),
+    ]
+    session.add_all(
+        models.Transaction(
+            date=datetime.date(2021, 3, 1 + i), label=label, amount=-10 - i, category_id=cat
+        )
+        for i, (label, cat) in enumerate(labels)
+    )
+    session.add(models.Rule(pattern='leclerc drive', category_id=food.id))
+    session.add(models.Rule(pattern='carte leclerc', category_id=fuel.id))
+    session.commit()
+    ids = {'food': food.id, 'fuel': fuel.id}
+    session.close()
+    with app_module.app.test_client() as client:
+        client.ids = ids
+        yield client
+
+
+def login(client):
+    resp = client.post('/login', json={'username': 'admin', 'password': 'admin'})
+    assert resp.status_code == 200
+
+
+def test_preview_counts_overrides_and_conflicts(client, monkeypatch):
+    login(client)
+    monkeypatch.setattr(config, 'RULES_PREVIEW_SAMPLE_SIZE', 2)
+    food = client.ids['food']
+    resp = client.post('/rules/preview', json={'pattern': ' leclerc ', 'category_id': food})
+    assert resp.status_code == 200
+    [result] = resp.get_json()['results']
+    assert result['pattern'] == 'leclerc'
+    assert result['count'] == 3
+    assert result['overrides'] == 1
+    assert [t['label'] for t in result['sample']] == [
+        'CARTE 03/03 LECLERC DRIVE',
+        'CARTE 02/03 LECLERC',
+    ]
+    assert result['complete'] is True
+    assert [(c['pattern'], c['count']) for c in result['conflicts']] == [('carte leclerc', 2)]
+
+    # Nothing was written
+    session = models.SessionLocal()
+    assert session.query(models.Transaction).filter_by(category_id=food).count() == 1
+    session.close()
+
+
+def test_preview_several_patterns(client):
+    login(client)
+    resp = client.post('/rules/preview', json={'patterns': ['carte', 'edf', '  ', 'inconnu']})
+    results = resp.get_json()['results']
+    assert [r['count'] for r in results] == [4, 1, 0, 0]
+    # Without category every categorised match is overridden
+    assert results[0]['overrides'] == 2
+    assert {c['pattern'] for c in results[0]['conflicts']} == {'leclerc drive', 'carte leclerc'}
+
+
+def test_preview_truncates_conflict_lookup(client, monkeypatch):
+    login(client)
+    monkeypatch.setattr(config, 'RULES_PREVIEW_LABEL_LIMIT', 2)
+    result = client.post('/rules/preview', json={'pattern': 'carte'}).get_json()['results'][0]
+    assert result['count'] == 4
+    assert result['complete'] is False
+
+
+def test_preview_rejects_invalid_payload(client):
+    login(client)
+    assert client.post('/rules/preview', json={}).status_code == 400
+    assert client.post('/rules/preview', json={'patterns': [1]}).status_code == 400
+    resp = client.post('/rules/preview', json={'pattern': 'edf', 'category_id': 'abc'})
+    assert resp.status_code == 400
+    assert resp.get_json() == {'error': 'invalid category'}
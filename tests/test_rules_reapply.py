@@ -0,0 +1,163 @@
+import datetime
+import random
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from backend import models
+from backend.rule_matcher import WordSequenceMatcher, reapply_rules
+import backend as app_module
+
+
+def naive_match(rules, label):
+    for rule in rules:
+        words = [w.lower() for w in rule[1].split()]
+        position = 0
+        for word in words:
+            position = label.lower().find(word, position)
+            if position < 0:
+                break
+            position += len(word)
+        else:
+            if words:
+                return rule
+    return None
+
+
+@pytest.fixture
+def client():
+    engine = create_engine('sqlite:///:memory:')
+    models.engine = engine
+    models.SessionLocal = sessionmaker(bind=engine)
+    app_module.SessionLocal = models.SessionLocal
+    models.init_db()
+    session = models.SessionLocal()
+    cats = [models.Category(name=f'Cat {i}') for i in range(3)]
+    session.add_all(cats)
+    session.flush()
+    labels = [
+        'CARTE 12/03 LECLERC',
+        'Carte Auchan',
+        'PRLV EDF',
+        'Virement salaire',
+        'Cotisation carte',
+    ]
+    for i, label in enumerate(labels):
+        session.add(models.Transaction(
+            date=datetime.date(2021, 1, 1 + i),
+            label=label,
+            amount=-10 - i,
+            category_id=cats[2].id if label == 'PRLV EDF' else None,
+        ))
+    session.add_all([
+        models.Rule(pattern='carte leclerc', category_id=cats[0].id),
+        models.Rule(pattern='carte', category_id=cats[1].id),
+        models.Rule(pattern='edf', category_id=cats[2].id),
+        models.Rule(pattern='   ', category_id=cats[0].id),
+    ])
+    session.commit()
+    cat_ids = [c.id for c in cats]
+    session.close()
+    with app_module.app.test_client() as client:
+        client.engine = engine
+        client.cat_ids = cat_ids
+        yield client
+
+
+def login(client):
+    resp = client.post('/login', json={'username': 'admin', 'password': 'admin'})
+    assert resp.status_code == 200
+
+
+def categories(client):
+    session = models.SessionLocal()
+    result = {t.label: t.category_id for t in session.query(models.Transaction)}
+    session.close()
+    return result
+
+
+def test_words_must_appear_in_order():
+    rules = [(1, 'carte leclerc', 1, None), (2, 'car', 2, None), (3, 'b a', 3, None)]
+    matcher = WordSequenceMatcher(rules)
+    assert matcher.match('CARTE 12/03 LECLERC') == rules[0]
+    assert matcher.match('LECLERC CARTE') == rules[1]
+    assert matcher.match('a b') is None
+    assert matcher.match('aba') == rules[2]
+    assert matcher.categorize('virement') == (None, None)
+
+
+def test_matches_like_semantics_on_random_data():
+    rng = random.Random(7)
+    alphabet = 'abcé'
+    rules = [
+        (
+            i,
+            ' '.join(
+                ''.join(rng.choice(alphabet) for _ in range(rng.randint(1, 3)))
+                for _ in range(rng.randint(0, 3))
+            ),
+            i,
+            None,
+        )
+        for i in range(80)
+    ]
+    matcher = WordSequenceMatcher(rules)
+    for _ in range(1000):
+        label = ''.join(rng.choice(alphabet + 'xy ') for _ in range(rng.randint(0, 14)))
+        assert matcher.match(label) == naive_match(rules, label)
+
+
+def test_reapply_endpoint_first_rule_wins(client):
+    login(client)
+    resp = client.post('/rules/reapply')
+    assert resp.status_code == 200
+    # PRLV EDF already has the category of its rule but is now attributed to it
+    assert resp.get_json() == {'scanned': 5, 'updated': 4}
+    first, second, third = client.cat_ids
+    assert categories(client) == {
+        'CARTE 12/03 LECLERC': first,
+        'Carte Auchan': second,
+        'PRLV EDF': third,
+        'Virement salaire': None,
+        'Cotisation carte': second,
+    }
+    assert client.post('/rules/reapply').get_json() == {'scanned': 5, 'updated': 0}
+
+
+def test_reapply_detaches_rows_no_rule_matches(client):
+    login(client)
+    session = models.SessionLocal()
+    salary = session.query(models.Transaction).filter_by(label='Virement salaire').one()
+    edf = session.query(models.Rule).filter_by(pattern='edf').one()
+    salary.category_id = client.cat_ids[2]
+    salary.rule_id = edf.id
+    session.commit()
+    session.close()
+
+    assert client.post('/rules/reapply').get_json() == {'scanned': 5, 'updated': 5}
+    session = models.SessionLocal()
+    salary = session.query(models.Transaction).filter_by(label='Virement salaire').one()
+    assert (salary.category_id, salary.rule_id) == (client.cat_ids[2], None)
+    session.close()
+
+
+def test_reapply_reads_once_and_updates_in_batches(client):
+    statements = []
+
+    def before(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement.lstrip().split()[0].upper(), executemany))
+
+    event.listen(client.engine, 'before_cursor_execute', before)
+    session = models.SessionLocal()
+    try:
+        result = reapply_rules(session, chunk_size=2)
+    finally:
+        session.close()
+        event.remove(client.engine, 'before_cursor_execute', before)
+    assert result == {'scanned': 5, 'updated': 4}
+    # One query for the rules, one for the transactions
+    assert [s for s in statements if s[0] == 'SELECT'] == [('SELECT', False)] * 2
+    # Chunks of two rows: the last two chunks have a single change
+    updates = [s for s in statements if s[0] == 'UPDATE']
+    assert updates == [('UPDATE', True), ('UPDATE', False), ('UPDATE', False)]
@@ -0,0 +1,241 @@
+import io
+import tracemalloc
+import xml.etree.ElementTree as ET
+from datetime import date
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from backend import models, statements
+from backend.batch_import import import_batch
+from backend.statements import detect_format, iter_parse_statement
+import backend as app_module
+
+
+def camt(entries, iban='FR7630001007941234567890185'):
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<Document xmlns="urn:iso:std:iso:20022:tech:xsd:camt.053.001.02">'
+        '<BkToCstmrStmt><GrpHdr><MsgId>1</MsgId>'
+        '<CreDtTm>2021-03-01T08:00:00</CreDtTm></GrpHdr>'
+        '<Stmt><Id>S1</Id><CreDtTm>2021-03-02T08:00:00</CreDtTm>'
+        f'<Acct><Id><IBAN>{iban}</IBAN></Id><Tp><Cd>CACC</Cd></Tp>'
+        '<Nm>Compte joint</Nm></Acct>'
+        '<Bal><Tp><CdOrPrtry><Cd>OPBD</Cd></CdOrPrtry></Tp>'
+        '<Amt Ccy="EUR">1500.50</Amt><CdtDbtInd>CRDT</CdtDbtInd>'
+        '<Dt><Dt>2021-01-01</Dt></Dt></Bal>'
+        + ''.join(entries)
+        + '</Stmt></BkToCstmrStmt></Document>\n'
+    ).encode('utf-8')
+
+
+def camt_entry(day, amount, label, credit=False):
+    return (
+        f'<Ntry><Amt Ccy="EUR">{amount}</Amt>'
+        f'<CdtDbtInd>{"CRDT" if credit else "DBIT"}</CdtDbtInd>'
+        f'<BookgDt><Dt>2021-01-{day:02d}</Dt></BookgDt>'
+        '<BkTxCd><Domn><Cd>PMNT</Cd><Fmly><Cd>CCRD</Cd></Fmly></Domn></BkTxCd>'
+        f'<AddtlNtryInf>{label}</AddtlNtryInf></Ntry>'
+    )
+
+
+OFX_SGML = (
+    'OFXHEADER:100\r\nDATA:OFXSGML\r\nVERSION:102\r\nENCODING:USASCII\r\n'
+    'CHARSET:1252\r\n\r\n'
+    '<OFX><SIGNONMSGSRSV1><SONRS><DTSERVER>20210301120000</SONRS>'
+    '</SIGNONMSGSRSV1><BANKMSGSRSV1><STMTTRNRS><STMTRS><CURDEF>EUR'
+    '<BANKACCTFROM><BANKID>30004<ACCTID>00012345678<ACCTTYPE>CHECKING'
+    '</BANKACCTFROM><BANKTRANLIST>\n'
+    '<STMTTRN><TRNTYPE>POS<DTPOSTED>20210105<TRNAMT>-12,30<FITID>1'
+    '<NAME>CB BOULANGERIE &amp; CO</NAME><MEMO>Café</STMTTRN>\n'
+    '<STMTTRN><TRNTYPE>DIRECTDEP<DTPOSTED>20210128000000[+1:CET]'
+    '<TRNAMT>2000.00<FITID>2<NAME>VIR ACME<MEMO>SALAIRE</STMTTRN>\n'
+    '<STMTTRN><TRNTYPE>POS<DTPOSTED>20210105<TRNAMT>-12.30<FITID>3'
+    '<NAME>CB BOULANGERIE &amp; CO<MEMO>Café</STMTTRN>\n'
+    '</BANKTRANLIST></STMTRS></STMTTRNRS></BANKMSGSRSV1></OFX>\n'
+).encode('cp1252')
+
+OFX_XML = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<?OFX OFXHEADER="200" VERSION="220"?>\n'
+    '<OFX><SIGNONMSGSRSV1><SONRS><DTSERVER>20210301</DTSERVER></SONRS>'
+    '</SIGNONMSGSRSV1><CREDITCARDMSGSRSV1><CCSTMTTRNRS><CCSTMTRS>'
+    '<CURDEF>EUR</CURDEF><CCACCTFROM><ACCTID>4970XXXX1234</ACCTID></CCACCTFROM>'
+    '<BANKTRANLIST>'
+    '<STMTTRN><TRNTYPE>DEBIT</TRNTYPE><DTPOSTED>20210110</DTPOSTED>'
+    '<TRNAMT>-45.00</TRNAMT><FITID>a</FITID><NAME>SUPERMARCHE</NAME></STMTTRN>'
+    '<STMTTRN><TRNTYPE>CREDIT</TRNTYPE><DTPOSTED>20210111</DTPOSTED>'
+    '<TRNAMT>5.00</TRNAMT><FITID>b</FITID><PAYEE><NAME>REMBOURSEMENT</NAME></PAYEE>'
+    '</STMTTRN></BANKTRANLIST></CCSTMTRS></CCSTMTTRNRS></CREDITCARDMSGSRSV1></OFX>\n'
+).encode('utf-8')
+
+
+@pytest.fixture
+def client():
+    engine = create_engine('sqlite:///:memory:')
+    models.engine = engine
+    models.SessionLocal = sessionmaker(bind=engine, expire_on_commit=False)
+    app_module.SessionLocal = models.SessionLocal
+    models.init_db()
+    with app_module.app.test_client() as client:
+        yield client
+
+
+def login(client):
+    resp = client.post('/login', json={'username': 'admin', 'password': 'admin'})
+    assert resp.status_code == 200
+
+
+def post_file(client, url, data, name, **fields):
+    fields['file'] = (io.BytesIO(data), name)
+    return client.post(url, data=fields, content_type='multipart/form-data')
+
+
+def test_detect_format():
+    assert detect_format(camt([])[:4096]) == 'camt'
+    assert detect_format(OFX_SGML[:4096]) == 'ofx'
+    assert detect_format(OFX_XML[:4096]) == 'ofx'
+    assert detect_format(b'Compte courant 12345678 2021-03-01\n') == 'csv'
+
+
+def test_parse_camt():
+    data = camt([
+        camt_entry(5, '12.30', 'CARTE BOULANGERIE'),
+        '<Ntry><Amt Ccy="EUR">2000</Amt><CdtDbtInd>CRDT</CdtDbtInd>'
+        '<BookgDt><DtTm>2021-01-28T10:00:00</DtTm></BookgDt>'
+        '<NtryDtls><TxDtls><RltdPties><Dbtr><Nm>ACME SA</Nm></Dbtr></RltdPties>'
+        '<RmtInf><Ustrd>SALAIRE</Ustrd><Ustrd>JANVIER</Ustrd></RmtInf>'
+        '</TxDtls></NtryDtls></Ntry>',
+        camt_entry(5, '12.30', 'CARTE BOULANGERIE'),
+    ])
+    events = list(iter_parse_statement(io.BytesIO(data)))
+    assert events[0] == ('account', {
+        'account_type': 'Compte courant',
+        'number': 'FR7630001007941234567890185',
+        'export_date': date(2021, 3, 2),
+        'name': 'Compte joint',
+        'initial_balance': 1500.5,
+        'balance_date': date(2021, 1, 1),
+    })
+    assert events[1] == ('transaction', {
+        'date': date(2021, 1, 5),
+        'type': 'Debit',
+        'payment_method': 'CB',
+        'label': 'CARTE BOULANGERIE',
+        'amount': -12.3,
+        'reconciled': False,
+        'to_analyze': True,
+    })
+    assert events[2][1]['label'] == 'ACME SA SALAIRE JANVIER'
+    assert events[2][1]['amount'] == 2000.0
+    assert events[3][0] == 'duplicate'
+    assert events[3][1]['line_no'] == 3
+
+
+def test_parse_camt_reports_bad_entries_and_other_accounts():
+    data = camt([
+        camt_entry(5, 'abc', 'CARTE'),
+        camt_entry(6, '1.00', 'CARTE'),
+    ])
+    second = camt([camt_entry(7, '2.00', 'AUTRE')], iban='FR00OTHER')
+    start = second.index(b'<Stmt>')
+    end = second.index(b'</BkToCstmrStmt>')
+    data = data.replace(b'</BkToCstmrStmt>', second[start:end] + b'</BkToCstmrStmt>')
+    kinds = [kind for kind, _ in iter_parse_statement(io.BytesIO(data))]
+    assert kinds == ['account', 'error', 'transaction', 'error']
+
+
+def test_parse_ofx_sgml(monkeypatch):
+    events = list(iter_parse_statement(io.BytesIO(OFX_SGML)))
+    assert events[0] == ('account', {
+        'account_type': 'Compte courant',
+        'number': '00012345678',
+        'export_date': date(2021, 3, 1),
+    })
+    assert events[1][1]['label'] == 'CB BOULANGERIE & CO Café'
+    assert events[1][1]['amount'] == -12.3
+    assert events[1][1]['payment_method'] == 'CB'
+    assert events[2][1]['date'] == date(2021, 1, 28)
+    assert events[3][0] == 'duplicate'
+
+    # Tags split across decoded chunks give the same events
+    monkeypatch.setattr(statements, 'OFX_CHUNK_SIZE', 7)
+    assert list(iter_parse_statement(io.BytesIO(OFX_SGML))) == events
+
+
+def test_parse_ofx_xml():
+    events = list(iter_parse_statement(io.BytesIO(OFX_XML)))
+    assert events[0][1]['account_type'] == 'Carte'
+    assert events[0][1]['number'] == '4970XXXX1234'
+    assert [(e[1]['label'], e[1]['amount']) for e in events[1:]] == [
+        ('SUPERMARCHE', -45.0),
+        ('REMBOURSEMENT', 5.0),
+    ]
+
+
+def test_invalid_xml_raises_before_account():
+    with pytest.raises(ValueError):
+        list(iter_parse_statement(io.BytesIO(b'<Document xmlns="camt.053"><oops')))
+
+
+def test_camt_entries_are_released():
+    entries = [camt_entry(1 + i % 28, f'{i}.00', f'Achat {i}') for i in range(20000)]
+    data = camt(entries)
+
+    def peak(consume):
+        tracemalloc.start()
+        try:
+            consume()
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    streamed = peak(lambda: sum(1 for _ in iter_parse_statement(io.BytesIO(data))))
+    tree = peak(lambda: ET.parse(io.BytesIO(data)))
+    # Only the in-file duplicate keys are kept, not the parsed elements
+    assert streamed < tree / 3
+
+
+def test_import_camt_endpoint(client):
+    login(client)
+    data = camt([
+        camt_entry(5, '12.30', 'CARTE BOULANGERIE'),
+        camt_entry(6, '40.00', 'CARTE LIBRAIRIE'),
+    ])
+    resp = post_file(client, '/import/preview', data, 'releve.xml')
+    assert resp.status_code == 200
+    preview = resp.get_json()
+    assert preview['format'] == 'camt'
+    assert preview['account']['number'] == 'FR7630001007941234567890185'
+    assert len(preview['transactions']) == 2
+
+    resp = post_file(client, '/import', data, 'releve.xml')
+    assert resp.status_code == 200
+    payload = resp.get_json()
+    assert payload['imported'] == 2
+    assert payload['account']['initial_balance'] == 1500.5
+
+    more = camt([
+        camt_entry(6, '40.00', 'CARTE LIBRAIRIE'),
+        camt_entry(7, '3.00', 'CARTE CAFE'),
+    ])
+    resp = post_file(client, '/import', more, 'releve2.xml')
+    assert resp.get_json()['imported'] == 1
+    assert len(resp.get_json()['duplicates']) == 1
+
+
+def test_import_preset_reports_xml_format(client):
+    login(client)
+    resp = post_file(client, '/import/preset', OFX_SGML, 'releve.ofx')
+    assert resp.status_code == 200
+    assert resp.get_json()['format'] == 'ofx'
+    assert resp.get_json()['columns'] == []
+
+
+def test_batch_import_ofx(client):
+    session = models.SessionLocal()
+    report = import_batch(session, [('releve.ofx', OFX_SGML), ('carte.ofx', OFX_XML)], workers=1)
+    session.close()
+    assert report['imported'] == 4
+    assert {a['account']['number'] for a in report['accounts']} == {'00012345678', '4970XXXX1234'}
@@ -0,0 +1,85 @@
+import datetime
+import pytest
+
+from backend.csv_utils import (
+    _AMOUNT_PARSERS,
+    _DATE_PARSERS,
+    _parse_amount,
+    _parse_date,
+    detect_value_formats,
+    parse_csv,
+)
+
+MAPPING = {'date': 0, 'type': 1, 'payment_method': 2, 'label': 3, 'amount': 4}
+
+
+def rows(dates, amounts):
+    return [[d, 'Debit', 'CB', 'Achat', a] for d, a in zip(dates, amounts)]
+
+
+@pytest.mark.parametrize(
+    'dates,amounts,expected',
+    [
+        (['2021-01-02', '2021-01-03'], ['-12.34', '5'], ('iso', 'dot')),
+        (['02/01/2021', '03/01/2021'], ['-12,34', '5,00'], ('dmy', 'comma')),
+        (['02/01/2021', '03/01/2021'], ['12,34-', '(5,00)'], ('dmy', 'signed')),
+        (['2/1/2021', '3/1/2021'], ['1 234,56', '1\xa0000,00'], (None, None)),
+    ],
+)
+def test_detect_value_formats(dates, amounts, expected):
+    assert detect_value_formats(rows(dates, amounts), MAPPING) == expected
+
+
+@pytest.mark.parametrize(
+    'value',
+    ['2021-01-02', ' 2021-01-02', '2021-1-2', '20210102', '02/01/2021', '2/1/2021',
+     '31/02/2021', '2021-02-31', '+1/01/2021', 'abcdefghij', '02-01-2021'],
+)
+def test_fast_dates_agree_with_generic(value):
+    try:
+        expected = _parse_date(value)
+    except ValueError:
+        expected = ValueError
+    for parser in _DATE_PARSERS.values():
+        try:
+            result = parser(value)
+        except ValueError:
+            continue
+        assert result == expected
+
+
+@pytest.mark.parametrize(
+    'value',
+    ['-12,34', '12.34', '12,34-', '(12,34)', '1 234,56', '1\xa0234,56', ' 12,34 ',
+     '-12,34-', '(-5)', '12,34 -', 'abc', '1,234.56', '1e3', '--'],
+)
+def test_fast_amounts_agree_with_generic(value):
+    try:
+        expected = _parse_amount(value)
+    except ValueError:
+        expected = ValueError
+    for parser in _AMOUNT_PARSERS.values():
+        try:
+            result = parser(value)
+        except ValueError:
+            continue
+        assert result == expected
+
+
+def test_mixed_formats_fall_back_per_row():
+    lines = ["Compte courant 12345678 2021-01-01"]
+    lines += [f"2021-01-{d:02d};Debit;CB;Achat {d};-{d},00" for d in range(1, 21)]
+    lines += [
+        "05/02/2021;Debit;CB;Autre date;-1,00",
+        "2021-02-06;Debit;CB;Montant groupe;-1 000,00-",
+        "2021/02/07;Debit;CB;Mauvaise date;-1,00",
+        "2021-02-08;Debit;CB;Mauvais montant;abc",
+    ]
+    transactions, duplicates, errors, info = parse_csv("\n".join(lines) + "\n")
+    by_label = {t['label']: t for t in transactions}
+    assert by_label['Autre date']['date'] == datetime.date(2021, 2, 5)
+    assert by_label['Montant groupe']['amount'] == 1000.0
+    assert errors == [
+        "Ligne 24: date impossible à convertir (formats acceptés : YYYY-MM-DD ou DD/MM/YYYY)",
+        "Ligne 25: montant non numérique (gestion du signe - en fin ou de parenthèses)",
+    ]
@@ -0,0 +1,219 @@
+import io
+import json
+import tracemalloc
+import zipfile
+from datetime import date
+from xml.sax.saxutils import escape
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from backend import models
+from backend.batch_import import expand_uploads
+from backend.csv_utils import iter_parse_csv
+from backend.statements import iter_parse_statement
+from backend.xlsx_import import detect_xlsx_structure, iter_xlsx_rows
+import backend as app_module
+
+NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+
+
+def column(index):
+    name = ''
+    index += 1
+    while index:
+        index, rem = divmod(index - 1, 26)
+        name = chr(65 + rem) + name
+    return name
+
+
+def make_xlsx(rows, inline=False):
+    """Build a workbook; ``date`` cells are stored as serials with a date style."""
+    strings = []
+    positions = {}
+    sheet_rows = []
+    for r, row in enumerate(rows, start=1):
+        if row is None:
+            # Rows absent from the sheet XML
+            continue
+        cells = []
+        for c, value in enumerate(row):
+            ref = f'{column(c)}{r}'
+            if value is None or value == '':
+                continue
+            if isinstance(value, date):
+                serial = (value - date(1899, 12, 30)).days
+                cells.append(f'<c r="{ref}" s="1"><v>{serial}</v></c>')
+            elif isinstance(value, (int, float)):
+                cells.append(f'<c r="{ref}"><v>{value}</v></c>')
+            elif inline:
+                cells.append(f'<c r="{ref}" t="inlineStr"><is><t>{escape(value)}</t></is></c>')
+            else:
+                if value not in positions:
+                    positions[value] = len(strings)
+                    strings.append(value)
+                cells.append(f'<c r="{ref}" t="s"><v>{positions[value]}</v></c>')
+        sheet_rows.append(f'<row r="{r}">{"".join(cells)}</row>')
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml', '<Types/>')
+        archive.writestr(
+            'xl/workbook.xml',
+            f'<workbook xmlns="{NS}" xmlns:r="http://schemas.openxmlformats.org/'
+            'officeDocument/2006/relationships"><sheets>'
+            '<sheet name="Relevé" sheetId="1" r:id="rId1"/></sheets></workbook>',
+        )
+        archive.writestr(
+            'xl/_rels/workbook.xml.rels',
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/'
+            'relationships"><Relationship Id="rId1" Type="worksheet" '
+            'Target="worksheets/releve.xml"/></Relationships>',
+        )
+        archive.writestr(
+            'xl/styles.xml',
+            f'<styleSheet xmlns="{NS}"><numFmts count="1">'
+            '<numFmt numFmtId="164" formatCode="dd/mm/yyyy"/></numFmts>'
+            '<cellXfs count="2"><xf numFmtId="0"/><xf numFmtId="164"/></cellXfs>'
+            '</styleSheet>',
+        )
+        archive.writestr(
+            'xl/sharedStrings.xml',
+            f'<sst xmlns="{NS}">'
+            + ''.join(f'<si><t>{escape(s)}</t></si>' for s in strings)
+            + '</sst>',
+        )
+        archive.writestr(
+            'xl/worksheets/releve.xml',
+            f'<worksheet xmlns="{NS}"><sheetData>{"".join(sheet_rows)}</sheetData></worksheet>',
+        )
+    return buffer.getvalue()
+
+
+BNP_ROWS = [
+    ['Compte courant', 'Mon compte', '12345678', date(2021, 3, 1), '', 1000.5],
+    None,
+    ['Date', 'Type', 'Moyen', 'Libellé', 'Montant'],
+    [date(2021, 1, 2), 'Debit', 'CB', 'Café crème', -12.34],
+    [date(2021, 1, 3), 'Credit', 'VIR', 'Prime été', 100],
+    [date(2021, 1, 2), 'Debit', 'CB', 'Café crème', -12.34],
+]
+
+BNP_CSV = (
+    "Compte courant;Mon compte;12345678;2021-03-01;;1000.5\n"
+    "\n"
+    "Date;Type;Moyen;Libellé;Montant\n"
+    "2021-01-02;Debit;CB;Café crème;-12.34\n"
+    "2021-01-03;Credit;VIR;Prime été;100\n"
+    "2021-01-02;Debit;CB;Café crème;-12.34\n"
+)
+
+
+@pytest.fixture
+def client():
+    engine = create_engine('sqlite:///:memory:')
+    models.engine = engine
+    models.SessionLocal = sessionmaker(bind=engine, expire_on_commit=False)
+    app_module.SessionLocal = models.SessionLocal
+    models.init_db()
+    with app_module.app.test_client() as client:
+        yield client
+
+
+def login(client):
+    resp = client.post('/login', json={'username': 'admin', 'password': 'admin'})
+    assert resp.status_code == 200
+
+
+def post_file(client, url, data, **fields):
+    fields['file'] = (io.BytesIO(data), 'releve.xlsx')
+    return client.post(url, data=fields, content_type='multipart/form-data')
+
+
+@pytest.mark.parametrize('inline', [False, True])
+def test_xlsx_rows(inline):
+    rows = list(iter_xlsx_rows(io.BytesIO(make_xlsx(BNP_ROWS, inline=inline))))
+    assert rows[0] == ['Compte courant', 'Mon compte', '12345678', '2021-03-01', '', '1000.5']
+    assert rows[1] == []
+    assert rows[3] == ['2021-01-02', 'Debit', 'CB', 'Café crème', '-12.34']
+
+
+def test_xlsx_events_match_csv():
+    xlsx = list(iter_parse_statement(io.BytesIO(make_xlsx(BNP_ROWS))))
+    csv = list(iter_parse_csv(BNP_CSV))
+    assert xlsx == csv
+    assert xlsx[0][1]['initial_balance'] == 1000.5
+    assert [kind for kind, _ in xlsx] == ['account', 'transaction', 'transaction', 'duplicate']
+
+
+def test_xlsx_uses_mapping():
+    rows = [
+        ['Compte courant 12345678 2021-03-01'],
+        ['Achat', -5.5, date(2021, 1, 4)],
+    ]
+    mapping = {'label': 0, 'amount': 1, 'date': 2}
+    events = list(iter_parse_statement(io.BytesIO(make_xlsx(rows)), mapping=mapping))
+    assert events[1][1]['date'] == date(2021, 1, 4)
+    assert events[1][1]['label'] == 'Achat'
+    assert events[1][1]['amount'] == -5.5
+
+
+def test_detect_xlsx_structure_rewinds():
+    stream = io.BytesIO(make_xlsx(BNP_ROWS))
+    (delimiter, header_idx, start, columns), rows = detect_xlsx_structure(stream)
+    assert (delimiter, header_idx, start) == (None, 2, 3)
+    assert columns == ['Date', 'Type', 'Moyen', 'Libellé', 'Montant']
+    assert stream.tell() == 0
+
+
+def test_xlsx_rows_are_released():
+    rows = [['Compte courant 12345678 2021-03-01']]
+    rows += [[date(2021, 1, 1 + i % 28), 'Debit', 'CB', f'Achat {i}', -i] for i in range(50000)]
+    data = make_xlsx(rows, inline=True)
+
+    tracemalloc.start()
+    try:
+        count = sum(1 for _ in iter_xlsx_rows(io.BytesIO(data)))
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert count == 50001
+    # Far below the size of the uncompressed sheet (several MB)
+    assert peak < 2 * 1024 * 1024
+
+
+def test_xlsx_preset_and_import(client):
+    login(client)
+    data = make_xlsx(BNP_ROWS)
+    resp = post_file(client, '/import/preset', data)
+    assert resp.status_code == 200
+    body = resp.get_json()
+    assert body['format'] == 'xlsx'
+    assert body['columns'] == ['Date', 'Type', 'Moyen', 'Libellé', 'Montant']
+    assert body['preview'][0] == ['2021-01-02', 'Debit', 'CB', 'Café crème', '-12.34']
+    assert body['signature']
+
+    resp = client.post('/import_presets', json={
+        'name': 'Banque XLSX',
+        'mapping': {'date': 0, 'type': 1, 'payment_method': 2, 'label': 3, 'amount': 4},
+        'signature': body['signature'],
+    })
+    assert resp.status_code in (200, 201)
+
+    resp = post_file(client, '/import/preview', data)
+    preview = resp.get_json()
+    assert preview['format'] == 'xlsx'
+    assert preview['preset']['name'] == 'Banque XLSX'
+    assert len(preview['transactions']) == 2
+
+    resp = post_file(client, '/import', data, mapping=json.dumps(
+        {'date': 0, 'type': 1, 'payment_method': 2, 'label': 3, 'amount': 4}
+    ))
+    assert resp.status_code == 200
+    assert resp.get_json()['imported'] == 2
+
+
+def test_batch_keeps_xlsx_whole():
+    data = make_xlsx(BNP_ROWS)
+    assert expand_uploads([('releve.xlsx', data)]) == [('releve.xlsx', data)]